@@ -0,0 +1,98 @@
+"""
+Benchmark codecs of html stored in db.crawl: brotli (current default), zstd, and zstd + trained dictionaries
+Reports compress/decompress throughput and stored size on a sample of stored pages
+
+Dictionaries are trained on half of the sampled pages (per site, plus global), measured on the other half
+
+python benchmarks/bench_codec.py [--samples 2000] [--sites a.com b.com] [--size 114688]
+"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import argparse
+import tempfile
+from collections import defaultdict
+
+from fable import config
+from fable.utils import codec
+from fable.utils.storage import SQLiteDB
+
+
+def benchmark(htmls, sites=None, size=codec.DICT_SIZE, train_ratio=0.5):
+    """
+    Compress/decompress throughput and storage size of htmls with each codec
+    Dictionaries are trained on the first train_ratio of pages (per site if sites is given, plus global), measured on the rest
+
+    Return: {codec: {'compress_mbps', 'decompress_mbps', 'bytes', 'ratio'}}, raw bytes of measured pages
+    """
+    sites = sites or [None] * len(htmls)
+    n_train = int(len(htmls) * train_ratio)
+    train_htmls, test = htmls[:n_train], list(zip(htmls[n_train:], sites[n_train:]))
+    raw = sum(len(h.encode()) for h, _ in test)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SQLiteDB(os.path.join(tmp, 'bench.sqlite'))
+        dict_codec = codec.HtmlCodec(codec='zstd', db=db)
+        if len(train_htmls) >= codec.MIN_DICT_SAMPLES:
+            dict_codec.train(train_htmls, codec.GLOBAL_DICT, size=size)
+        by_site = defaultdict(list)
+        for h, site in zip(train_htmls, sites[:n_train]):
+            if site: by_site[site].append(h)
+        for site, site_htmls in by_site.items():
+            if len(site_htmls) >= codec.MIN_DICT_SAMPLES:
+                dict_codec.train(site_htmls, f'site:{site}', size=size)
+        codecs = {
+            'brotli': codec.HtmlCodec(codec='brotli', db=db),
+            'zstd': codec.HtmlCodec(codec='zstd', db=db, use_dict=False),
+            'zstd+dict': dict_codec
+        }
+        for name, c in codecs.items():
+            start = time.time()
+            docs = [c.compress(h, site=site) for h, site in test]
+            compress_time = time.time() - start
+            start = time.time()
+            for doc in docs:
+                c.decompress(doc)
+            decompress_time = time.time() - start
+            size_bytes = sum(len(doc['html']) for doc in docs)
+            results[name] = {
+                'compress_mbps': raw / 1e6 / max(compress_time, 1e-9),
+                'decompress_mbps': raw / 1e6 / max(decompress_time, 1e-9),
+                'bytes': size_bytes,
+                'ratio': raw / max(size_bytes, 1)
+            }
+    return results, raw
+
+
+def sample_pages(db, samples, sites=None):
+    """Return: [(html, site)] sampled from db.crawl, sites interleaved between training and measured halves"""
+    c = codec.HtmlCodec(db=db)
+    query = {'html': {'$exists': True}}
+    if sites: query['site'] = {'$in': sites}
+    docs = db.crawl.aggregate([{'$match': query}, {'$sample': {'size': samples}}, {'$project': {'html': 1, 'codec': 1, 'dict_id': 1, 'site': 1}}], allowDiskUse=True)
+    pages = []
+    for doc in docs:
+        try:
+            pages.append((c.decompress(doc), doc.get('site')))
+        except Exception as e:
+            print(f'Cannot decompress {doc["_id"]}: {str(e)}')
+    pages.sort(key=lambda x: str(x[1]))
+    return pages[::2] + pages[1::2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark codecs on stored pages')
+    parser.add_argument('--samples', type=int, default=2000, help='Pages sampled from db.crawl')
+    parser.add_argument('--sites', nargs='*', default=None, help='Sites to sample from. Default: all')
+    parser.add_argument('--size', type=int, default=codec.DICT_SIZE, help='Bytes of each dictionary')
+    args = parser.parse_args()
+    pages = sample_pages(config.DB, args.samples, sites=args.sites)
+    results, raw = benchmark([h for h, _ in pages], sites=[s for _, s in pages], size=args.size)
+    print(f'{len(pages) - len(pages) // 2} pages measured, {raw / 1e6:.2f} MB raw')
+    print(f'{"codec":<10} {"compress MB/s":>14} {"decompress MB/s":>16} {"MB stored":>10} {"ratio":>7}')
+    for name, r in results.items():
+        print(f'{name:<10} {r["compress_mbps"]:>14.1f} {r["decompress_mbps"]:>16.1f} {r["bytes"] / 1e6:>10.3f} {r["ratio"]:>7.2f}')
+
+
+if __name__ == '__main__':
+    main()
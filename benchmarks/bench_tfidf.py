@@ -0,0 +1,193 @@
+"""
+Benchmark TFidfStatic (incremental workingset) against the previous implementation
+(refits a TfidfVectorizer on the workingset and copies the corpus vocabulary on every add_corpus)
+
+Workload mirrors Similar.max_similar: for each target, set workingset to target + candidates, and compare target with each candidate
+(pair by pair, then with TFidfStatic.similar_many)
+
+python benchmarks/bench_tfidf.py [--corpus-size 2000] [--targets 50] [--candidates 10] [--synthetic]
+Corpus is sampled from db.corpus (as Similar does), or generated with --synthetic (or when db.corpus is empty)
+"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import time
+import random
+import argparse
+import functools
+import numpy as np
+
+from fable import config
+from fable.utils import text_utils
+from fable.utils.text_utils import vectorizer_kwargs
+
+
+# * Previous implementation, kept as the reference
+class LegacyTFidfStatic:
+    def __init__(self, corpus):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        corpus = list(set(corpus))
+        self.corpus = corpus
+        self.vectorizer = TfidfVectorizer(**vectorizer_kwargs)
+        self.vectorizer.fit(corpus)
+        self.tfidf = self.vectorizer.transform(corpus)
+        self.workingset_vec = None
+        self.workingset_tfidf = None
+        self.idx = None
+    
+    def _init_workingset(self, inputs):
+        """
+        Get tfidf within inputs. 
+        TFIDF value will be based on the previous corpus instead of the input
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        inputs = list(set(inputs))
+        self.idx = {i: c for c, i in enumerate(inputs)}
+        # Get vocabulary from inputs
+        idf = self.vectorizer.idf_
+        # vocab = defaultdict(None, self.vectorizer.vocabulary_)
+        vocab = self.vectorizer.vocabulary_.copy()
+        vsize = len(vocab)
+        # vocab.default_factory = vocab.__len__
+        inputs_tfidf = TfidfVectorizer(**vectorizer_kwargs)
+        inputs_matrix = inputs_tfidf.fit_transform(inputs)
+        # Add unseen vocab to existed corpus
+        num_docs = inputs_matrix.shape[0]
+        inputs_idf = inputs_tfidf.idf_
+        inputs_vocab = inputs_tfidf.vocabulary_
+        for word in inputs_vocab.keys():
+            # Added with proper index if not in vocabulary
+            if word not in vocab:
+                vocab[word] = vsize
+                vsize += 1
+                df = (num_docs + 1) / np.exp(inputs_idf[inputs_vocab[word]] - 1) - 1
+                df = np.log((self.tfidf.shape[0] + 1) / (df + 1)) + 1
+                idf = np.append(idf, [df])
+        # Construct workingset
+        self.workingset_vec = TfidfVectorizer(vocabulary=vocab, **vectorizer_kwargs)
+        def my_validate_vocab(self):
+            self.vocabulary_ = self.vocabulary
+        self.workingset_vec._validate_vocabulary = functools.partial(my_validate_vocab, self.workingset_vec)
+        self.fixed_vocabulary_ = True       
+        self.workingset_vec.idf_ = idf
+        # self.workingset_vec._idf_diag = sp.diags(idf, offsets=0,
+        #                                 shape=(idf.shape[0], idf.shape[0]),
+        #                                 format='csr',
+        #                                 dtype=np.float64)
+        self.workingset_tfidf = self.workingset_vec.transform(inputs)
+    
+    def _clear_workingset(self):
+        self.idx = None
+        self.workingset_vec = None
+        self.workingset_tfidf = None
+    
+    def similar(self, text1, text2):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.metrics.pairwise import cosine_similarity
+        if text1 == "" or text2 == "": return 0
+        if self.workingset_vec is None:
+            inputs_tfidf = TfidfVectorizer(**vectorizer_kwargs)
+            try:
+                _ = inputs_tfidf.fit_transform([text1, text2])
+            except: return 0
+            self._init_workingset([text1, text2])
+        idx1, idx2 = self.idx[text1], self.idx[text2]
+        return cosine_similarity(self.workingset_tfidf[idx1], self.workingset_tfidf[idx2])[0,0]
+    
+    def topN(self, text, N=7):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        if self.workingset_vec is None:
+            inputs_tfidf = TfidfVectorizer(**vectorizer_kwargs)
+            try:
+                _ = inputs_tfidf.fit_transform([text])
+            except: return ''
+            self._init_workingset([text])
+        array = self.workingset_tfidf[self.idx[text]].toarray()[0]
+        idxes = array.argsort()[-N:]
+        words = self.workingset_vec.get_feature_names()
+        return [words[i] for i in reversed(idxes)]
+
+    def add_corpus(self, inputs):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        if self.workingset_vec is not None:
+            self._clear_workingset()
+        inputs_tfidf = TfidfVectorizer(**vectorizer_kwargs)
+        try:
+            _ = inputs_tfidf.fit_transform(inputs)
+        except: return
+        self._init_workingset(inputs)
+
+
+def synthetic_corpus(size, seed=0):
+    """Return: size documents with zipf distributed words"""
+    rng = random.Random(seed)
+    vocab = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 9))) for _ in range(20000)]
+    weights = [1 / (i + 1) for i in range(len(vocab))]
+    return [' '.join(rng.choices(vocab, weights=weights, k=rng.randint(100, 600))) for _ in range(size)]
+
+
+def db_corpus(size):
+    try:
+        corpus = config.DB.corpus.aggregate([{'$project': {'content': True}}, {'$sample': {'size': size}}], allowDiskUse=True)
+        return [c['content'] for c in corpus if c.get('content')]
+    except Exception as e:
+        print(f'Cannot sample db.corpus: {str(e)}')
+        return []
+
+
+def run(tfidf, workload):
+    simis = []
+    start = time.time()
+    for target, candidates in workload:
+        tfidf._clear_workingset()
+        tfidf.add_corpus([target] + candidates)
+        for c in candidates:
+            simis.append(tfidf.similar(target, c))
+    return time.time() - start, simis
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark TFidfStatic workingset')
+    parser.add_argument('--corpus-size', type=int, default=2000)
+    parser.add_argument('--targets', type=int, default=50)
+    parser.add_argument('--candidates', type=int, default=10)
+    parser.add_argument('--synthetic', action='store_true', help='Generate corpus instead of sampling db.corpus')
+    args = parser.parse_args()
+    docs = [] if args.synthetic else db_corpus(args.corpus_size + args.targets * (args.candidates + 1))
+    if len(docs) < args.corpus_size + args.targets * (args.candidates + 1):
+        docs = synthetic_corpus(args.corpus_size + args.targets * (args.candidates + 1))
+    corpus, rest = docs[:args.corpus_size], docs[args.corpus_size:]
+    # * Targets are compared several times (as in Similar), with different candidates
+    targets = rest[:args.targets]
+    pool = rest[args.targets:]
+    rng = random.Random(1)
+    workload = [(rng.choice(targets), rng.sample(pool, args.candidates)) for _ in range(args.targets * 2)]
+
+    start = time.time()
+    legacy = LegacyTFidfStatic(corpus)
+    legacy_init = time.time() - start
+    start = time.time()
+    tfidf = text_utils.TFidfStatic(corpus)
+    tfidf_init = time.time() - start
+    legacy_time, legacy_simis = run(legacy, workload)
+    tfidf_time, tfidf_simis = run(tfidf, workload)
+    max_diff = float(np.max(np.abs(np.array(legacy_simis) - np.array(tfidf_simis))))
+    n = len(tfidf_simis)
+    print(f'corpus: {len(corpus)} docs, {len(workload)} workingsets, {n} similarities')
+    print(f'{"":<10} {"init s":>8} {"workload s":>11} {"ms/similar":>11}')
+    print(f'{"previous":<10} {legacy_init:>8.2f} {legacy_time:>11.2f} {legacy_time / n * 1000:>11.3f}')
+    print(f'{"current":<10} {tfidf_init:>8.2f} {tfidf_time:>11.2f} {tfidf_time / n * 1000:>11.3f}')
+    print(f'speedup: {legacy_time / max(tfidf_time, 1e-9):.1f}x, max similarity difference: {max_diff:.2e}')
+    # * Batch scoring (similar_many) against pair by pair, on the same workingsets (texts already vectorized for both)
+    pair_time, _ = run(tfidf, workload)
+    start = time.time()
+    batch_simis = []
+    for target, candidates in workload:
+        tfidf.add_corpus([target] + candidates)
+        batch_simis += list(tfidf.similar_many(target, candidates))
+    batch_time = time.time() - start
+    max_diff = float(np.max(np.abs(np.array(batch_simis) - np.array(tfidf_simis))))
+    print(f'similar_many: {batch_time:.2f}s vs. {pair_time:.2f}s pair by pair, max similarity difference: {max_diff:.2e}')
+
+
+if __name__ == '__main__':
+    main()
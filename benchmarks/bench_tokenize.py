@@ -0,0 +1,93 @@
+"""
+Benchmark tokenizer (prebuilt analyzers + LRU of tokens) against the previous tokenize
+(built a CountVectorizer and its analyzer on every call, only stems cached)
+
+Workload on dataset/inputs/url_title.json, run for several passes (FABLE sees the same texts repeatedly):
+    titles: text_utils.tokenize (as shorttext_match / k_shingling)
+    url tokens: tokenize(stop_words=[]) of path pieces (as tokenize_url(process=True))
+    filenames: tokenize(stop_words=[], stemming=False) (as na_url)
+
+python benchmarks/bench_tokenize.py [--passes 3] [--limit 5000]
+"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import time
+import argparse
+from urllib.parse import urlsplit, unquote
+
+from fable.utils import tokenizer
+
+DATASET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dataset', 'inputs', 'url_title.json')
+
+
+# * Previous implementation, kept as the reference
+legacy_stemmer = None
+legacy_stem_cache = {}
+def legacy_tokenize(texts, stop_words='english', nonstop_words=[], stemming=True):
+    global legacy_stemmer
+    from sklearn.feature_extraction.text import CountVectorizer
+    if legacy_stemmer is None:
+        from nltk.stem.snowball import SnowballStemmer
+        legacy_stemmer = SnowballStemmer('english')
+    texts = texts.replace('_', ' ')
+    for nsw in nonstop_words:
+        texts = texts.replace(nsw, '')
+    cv = CountVectorizer(stop_words=stop_words, token_pattern=r"(?u)\b\w+\b")
+    analyze = cv.build_analyzer()
+    texts = analyze(texts)
+    def cached_transform(t, func, cache):
+        if t in cache:
+            return cache[t]
+        tt = func(t)
+        cache[t] = tt
+        return tt
+    if stemming:
+        texts = [cached_transform(t, legacy_stemmer.stem, legacy_stem_cache) for t in texts]
+    return texts
+
+
+def workload(path, limit=None):
+    """Return: [(text, kwargs)] of tokenize calls"""
+    url_titles = json.load(open(path))
+    calls = []
+    for i, (url, title) in enumerate(url_titles.items()):
+        if limit and i >= limit:
+            break
+        if title:
+            calls.append((title, {}))
+        pieces = [unquote(p) for p in unquote(urlsplit(url).path.lower()).split('/')[1:] if p]
+        for p in pieces:
+            calls.append((os.path.splitext(p)[0], {'stop_words': []}))
+        if pieces:
+            calls.append((pieces[-1], {'stop_words': [], 'stemming': False}))
+    return calls
+
+
+def run(tokenize, calls, passes):
+    start = time.time()
+    for _ in range(passes):
+        results = [tokenize(text, **kwargs) for text, kwargs in calls]
+    return time.time() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tokenizer')
+    parser.add_argument('--passes', type=int, default=3)
+    parser.add_argument('--limit', type=int, default=None, help='Max URLs from dataset')
+    parser.add_argument('--dataset', default=DATASET)
+    args = parser.parse_args()
+    calls = workload(args.dataset, limit=args.limit)
+    legacy_time, legacy_results = run(legacy_tokenize, calls, args.passes)
+    current_time, current_results = run(tokenizer.tokenize, calls, args.passes)
+    assert(legacy_results == current_results)
+    n = len(calls) * args.passes
+    print(f'{len(calls)} tokenize calls x {args.passes} passes, same tokens: {legacy_results == current_results}')
+    print(f'previous: {n / legacy_time:>10.0f} calls/s ({legacy_time:.2f}s)')
+    print(f'current:  {n / current_time:>10.0f} calls/s ({current_time:.2f}s)')
+    hits, misses = tokenizer.token_cache.hits, tokenizer.token_cache.misses
+    print(f'speedup: {legacy_time / max(current_time, 1e-9):.1f}x, token cache hit rate: {hits / max(hits + misses, 1):.2f}')
+
+
+if __name__ == '__main__':
+    main()
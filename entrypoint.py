@@ -1,48 +1,241 @@
 import json
 import logging
 import argparse
+import queue
+import multiprocessing as mp
+from concurrent import futures
+from collections import defaultdict
 from fable import tools, fable, tracer, config, verifier
+from fable.budget import Budget
 from fable.utils import url_utils
 import os
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--log', help='path of execution log, in .log ext', default='fable_run.log')
-parser.add_argument('input_file', nargs=1, help='Input file for broken links (in json format)')
-parser.add_argument('output_file', nargs=1, help='Output file for found aliases (in json format)')
-args = parser.parse_args()
-
-log_file = '.'.join(args.log.split('.')[:-1])
-input_file = args.input_file[0]
-output_file = args.output_file[0]
-
 he = url_utils.HostExtractor()
-memo = tools.Memoizer()
 simi = None
-db = config.DB
 alias_finder = None
-tr = None
+title_inits = 0 # * Number of times site title index is built (by all workers)
+result_queue = None # * Queue in worker processes, where each netloc_dir's result is put once it finishes
 
-def _init_large_obj():
-    global simi, alias_finder, tr
-    if tr is None:
-        try:
-            os.remove(log_file + '.log')
-        except: pass
+use_pipeline = False # * Run netloc_dirs with AliasFinder.run_pipeline instead of run_order
+
+def _init_large_obj(log_file, logname=None, prefetch=0, limits={}, pipeline=False):
+    """
+    limits: kwargs of budget.Budget for every netloc_dir
+    pipeline: Whether to use AliasFinder.run_pipeline
+    """
+    global simi, alias_finder, use_pipeline
+    use_pipeline = pipeline
     if simi is None:
         simi = tools.Similar()
     if alias_finder is None:
-        alias_finder = fable.AliasFinder(similar=simi, classname=log_file, loglevel=logging.DEBUG)
+        alias_finder = fable.AliasFinder(similar=simi, classname=log_file, logname=logname, \
+                                        loglevel=logging.DEBUG, prefetch=prefetch, budget=Budget(**limits))
+
+def _init_worker(log_file, prefetch=0, limits={}, pipeline=False, results=None):
+    """
+    Initializer of each worker process
+    Every worker owns its AliasFinder/Memoizer/Similar (and DB clients), caches are shared through the DB
+    results: Queue where run_batch streams results back to the main process
+    """
+    global result_queue
+    result_queue = results
+    _init_large_obj(log_file, logname=f'{log_file}_{os.getpid()}', prefetch=prefetch, limits=limits, pipeline=pipeline)
 
-_init_large_obj()
-input_urls = json.load(open(input_file, 'r'))
-results = []
-for obj in input_urls:
+def run_netloc(obj):
     netloc = obj['netloc_dir']
     urls = obj['urls']
-    aliases = alias_finder.run_order(netloc, urls)
-    results.append({
+    if use_pipeline:
+        aliases = alias_finder.run_pipeline(netloc, urls)
+    else:
+        aliases = alias_finder.run_order(netloc, urls)
+    result = {
         'netloc_dir': netloc,
         'aliases': aliases
-    })
-    json.dump(results, open(output_file, 'w+'), indent=2)
-json.dump(results, open(output_file, 'w+'), indent=2)
+    }
+    # * Only record spend when running under a budget
+    if alias_finder.budget.limited():
+        result['spend'] = alias_finder.spend
+    return result
+
+def run_batch(batch):
+    """
+    Run a batch of [(idx, obj)] in this process
+    Each (idx, result, #times title index is built) is put into result_queue as soon as its netloc_dir finishes
+
+    Return: Number of netloc_dirs run
+    """
+    for idx, obj in batch:
+        inits = simi.init_count
+        result = run_netloc(obj)
+        result_queue.put((idx, result, simi.init_count - inits))
+    return len(batch)
+
+def schedule_by_site(input_urls):
+    """
+    Group netloc_dirs by registrable domain, so that Similar's title index is built once per site
+
+    Return: [[(idx, obj)] of the same site], in the order sites first appear
+    """
+    site_objs = defaultdict(list)
+    for idx, obj in enumerate(input_urls):
+        site = he.extract(f"http://{obj['netloc_dir']}")
+        site_objs[site].append((idx, obj))
+    return list(site_objs.values())
+
+def run(input_urls, log_file, workers=1, prefetch=0, site_affinity=True, limits={}, pipeline=False):
+    """
+    Run all netloc_dirs in input_urls, yield (idx in input_urls, result) as they finish
+    workers: Number of worker processes. If <= 1, run serially in this process
+    prefetch: See AliasFinder
+    site_affinity: Run netloc_dirs of the same site together (and in the same worker)
+    limits: kwargs of budget.Budget, applied to each netloc_dir
+    pipeline: Run with AliasFinder.run_pipeline (stages ordered by cost model) instead of run_order
+    """
+    global title_inits
+    if site_affinity:
+        batches = schedule_by_site(input_urls)
+    else:
+        batches = [[(idx, obj)] for idx, obj in enumerate(input_urls)]
+    if workers <= 1:
+        _init_large_obj(log_file, prefetch=prefetch, limits=limits, pipeline=pipeline)
+        inits = simi.init_count
+        for batch in batches:
+            for idx, obj in batch:
+                yield idx, run_netloc(obj)
+        title_inits += simi.init_count - inits
+        return
+    # * spawn instead of fork: MongoClient is not fork-safe
+    ctx = mp.get_context('spawn')
+    manager = ctx.Manager()
+    results = manager.Queue()
+    total = sum(len(batch) for batch in batches)
+    with manager, futures.ProcessPoolExecutor(max_workers=workers, mp_context=ctx, \
+                    initializer=_init_worker, initargs=(log_file, prefetch, limits, pipeline, results)) as executor:
+        # * A batch keeps its site on one worker, while results are streamed per netloc_dir
+        pending = [executor.submit(run_batch, batch) for batch in batches]
+        received = 0
+        while received < total:
+            try:
+                idx, result, inits = results.get(timeout=1)
+            except queue.Empty:
+                # * Surface a failed batch, instead of waiting for its results forever
+                for f in pending:
+                    if f.done() and f.exception() is not None:
+                        raise f.exception()
+                continue
+            received += 1
+            title_inits += inits
+            yield idx, result
+
+def load_done(output_file, fmt):
+    """
+    Load results already in output_file (for resuming)
+    For jsonl, a partially written last record (crash during write) is truncated away
+
+    Return: [results]
+    """
+    if not os.path.exists(output_file):
+        return []
+    if fmt == 'json':
+        try:
+            return json.load(open(output_file, 'r'))
+        except:
+            return []
+    results = []
+    valid_end = 0
+    with open(output_file, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                results.append(json.loads(line))
+            except:
+                break
+            valid_end += len(line)
+    if valid_end < os.path.getsize(output_file):
+        with open(output_file, 'r+b') as f:
+            f.truncate(valid_end)
+    return results
+
+def in_input_order(runner):
+    """
+    Reorder (idx, result) from run into input order
+    Results finishing ahead of an unfinished earlier one are buffered until it finishes
+
+    Return: generator of results
+    """
+    buffered = {}
+    next_idx = 0
+    for idx, result in runner:
+        buffered[idx] = result
+        while next_idx in buffered:
+            yield buffered.pop(next_idx)
+            next_idx += 1
+
+def append_jsonl(f, result):
+    """Append one record and make sure it hits the disk"""
+    f.write(json.dumps(result) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', help='path of execution log, in .log ext', default='fable_run.log')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes running netloc_dirs in parallel')
+    parser.add_argument('--prefetch', type=int, default=0, help='Number of URLs per directory whose candidates are fetched ahead of verification')
+    parser.add_argument('--no-site-affinity', action='store_true', help='Run netloc_dirs in input order instead of grouping them by site')
+    parser.add_argument('--format', choices=['json', 'jsonl'], default=None, \
+                        help='Output format. jsonl appends one record per netloc_dir. Default: jsonl if output_file ends with .jsonl, else json')
+    parser.add_argument('--resume', action='store_true', help='Skip netloc_dirs already in output_file')
+    parser.add_argument('--pipeline', action='store_true', help='Order techniques by observed hit rate per cost (see fable/pipeline.py) instead of the fixed order')
+    parser.add_argument('--max-time', type=float, default=None, help='Max seconds spent on each netloc_dir')
+    parser.add_argument('--max-crawls', type=int, default=None, help='Max number of crawls on each netloc_dir')
+    parser.add_argument('--max-cdx', type=int, default=None, help='Max number of wayback CDX queries on each netloc_dir')
+    parser.add_argument('--max-searches', type=int, default=None, help='Max number of search API calls on each netloc_dir')
+    parser.add_argument('input_file', nargs=1, help='Input file for broken links (in json format)')
+    parser.add_argument('output_file', nargs=1, help='Output file for found aliases (in json format)')
+    args = parser.parse_args()
+
+    log_file = '.'.join(args.log.split('.')[:-1])
+    input_file = args.input_file[0]
+    output_file = args.output_file[0]
+    fmt = args.format
+    if fmt is None:
+        fmt = 'jsonl' if output_file.endswith('.jsonl') else 'json'
+
+    if not args.resume:
+        try:
+            os.remove(log_file + '.log')
+        except: pass
+    input_urls = json.load(open(input_file, 'r'))
+    input_order = {obj['netloc_dir']: i for i, obj in enumerate(input_urls)}
+    results = load_done(output_file, fmt) if args.resume else []
+    done = set(r['netloc_dir'] for r in results)
+    input_urls = [obj for obj in input_urls if obj['netloc_dir'] not in done]
+    if len(done) > 0:
+        print(f"Resume: skip {len(done)} finished netloc_dirs, {len(input_urls)} to go")
+
+    limits = {
+        'max_time': args.max_time,
+        'max_crawls': args.max_crawls,
+        'max_cdx': args.max_cdx,
+        'max_searches': args.max_searches
+    }
+    runner = run(input_urls, log_file, workers=args.workers, prefetch=args.prefetch, \
+                site_affinity=not args.no_site_affinity, limits=limits, pipeline=args.pipeline)
+    if fmt == 'jsonl':
+        # * Records are in input order whatever the workers/scheduling, so that resumed runs keep appending in order
+        with open(output_file, 'a' if args.resume else 'w') as f:
+            for result in in_input_order(runner):
+                append_jsonl(f, result)
+    else:
+        # * Keep all results (resumed + new) in input order
+        key = lambda r: input_order.get(r['netloc_dir'], len(input_order))
+        for _, result in runner:
+            results.append(result)
+            json.dump(sorted(results, key=key), open(output_file, 'w+'), indent=2)
+        json.dump(sorted(results, key=key), open(output_file, 'w+'), indent=2)
+    print(f"Title index built {title_inits} times for {len(schedule_by_site(input_urls))} sites")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Cost budget for finding aliases of one directory
+Techniques charge the budget on every network operation, and stop exploring once it is exhausted
+"""
+import time
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+KINDS = ['crawl', 'cdx', 'search'] # * Live crawls, wayback CDX queries, search API calls
+
+class Budget:
+    def __init__(self, max_time=None, max_crawls=None, max_cdx=None, max_searches=None):
+        """
+        max_time: Max wall-clock seconds since start()
+        max_crawls/max_cdx/max_searches: Max number of operations of each kind since start()
+        Any limit set to None is unlimited
+        """
+        self.max_time = max_time
+        self.limits = {'crawl': max_crawls, 'cdx': max_cdx, 'search': max_searches}
+        self._lock = threading.Lock()
+        self._local = threading.local() # * Technique currently running in this thread
+        self.reset()
+
+    def limited(self):
+        """Whether there is any limit set"""
+        return self.max_time is not None or any(v is not None for v in self.limits.values())
+
+    def reset(self):
+        with self._lock:
+            self.start_time = time.time()
+            self.spent = {k: 0 for k in KINDS}
+            self.technique_spent = defaultdict(lambda: {k: 0 for k in KINDS + ['time']})
+            self.exhausted_reason = None
+
+    def start(self):
+        """Start budgeting for a new directory"""
+        self.reset()
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def charge(self, kind, n=1):
+        """Charge n operations of kind to the budget (and the technique running in this thread)"""
+        technique = getattr(self._local, 'technique', None) or 'other'
+        with self._lock:
+            self.spent[kind] += n
+            self.technique_spent[technique][kind] += n
+
+    def exhausted(self):
+        """
+        Return: Whether any limit has been reached
+        """
+        if self.exhausted_reason is not None:
+            return True
+        reason = None
+        if self.max_time is not None and self.elapsed() >= self.max_time:
+            reason = 'time'
+        for kind in KINDS:
+            if self.limits[kind] is not None and self.spent[kind] >= self.limits[kind]:
+                reason = kind
+        self.exhausted_reason = reason
+        return reason is not None
+
+    @contextmanager
+    def track(self, technique):
+        """Attribute all charges (and time) within the context to technique"""
+        prev = getattr(self._local, 'technique', None)
+        self._local.technique = technique
+        start = time.time()
+        try:
+            yield self
+        finally:
+            self._local.technique = prev
+            with self._lock:
+                self.technique_spent[technique]['time'] += time.time() - start
+
+    def technique(self):
+        """Return: Technique running in this thread (None if not tracked)"""
+        return getattr(self._local, 'technique', None)
+
+    @contextmanager
+    def attribute(self, technique):
+        """
+        Attribute charges within the context to technique, without timing it
+        For worker threads doing work for a technique tracked in another thread
+        """
+        prev = getattr(self._local, 'technique', None)
+        self._local.technique = technique
+        try:
+            yield self
+        finally:
+            self._local.technique = prev
+
+    def report(self):
+        """
+        Return: {'time', 'crawl', 'cdx', 'search', 'exhausted': reason or None, 'techniques': {technique: {'time', 'crawl', 'cdx', 'search'}}}
+        """
+        self.exhausted()
+        with self._lock:
+            report = {'time': round(self.elapsed(), 3)}
+            report.update(self.spent)
+            report['exhausted'] = self.exhausted_reason
+            report['techniques'] = {t: {k: round(v, 3) if k == 'time' else v for k, v in s.items()} \
+                                        for t, s in self.technique_spent.items()}
+        return report
@@ -15,11 +15,14 @@ DEFAULT_CONFIG = {
     'mongo_user': None,
     'mongo_pwd': None,
     'localserver_port': 24680,
-    'mongo_db': 'fable'
+    'mongo_db': 'fable',
+    'storage': 'mongo', # * mongo or sqlite (local file at sqlite_path, default: {tmp_path}/fable.sqlite)
+    'crawl_codec': 'brotli', # * brotli or zstd (with trained dictionaries, see fable/utils/codec.py)
 }
 
 def config(key):
-    return var_dict.get(key)
+    """Return: value of key in config.json, else its DEFAULT_CONFIG value (None if neither)"""
+    return var_dict.get(key, DEFAULT_CONFIG.get(key))
 
 
 def set_var(key, value):
@@ -50,6 +53,12 @@ def azure_kv(vault_name, secret_name):
     return retrieved_secret
 
 def new_db():
+    if config('storage') == 'sqlite':
+        # * Local embedded storage, no MongoDB required
+        from .utils.storage import SQLiteDB
+        path = var_dict.get('sqlite_path') or os.path.join(TMP_PATH, 'fable.sqlite')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        return SQLiteDB(path)
     if 'mongo_url' not in var_dict:
         db = eval(f"MongoClient(MONGO_HOSTNAME, username=MONGO_USER, password=MONGO_PWD, authSource='admin').{MONGO_DB}")
     else:
@@ -87,9 +96,18 @@ for dc, dc_value in DEFAULT_CONFIG.items():
         locals().update({dc: dc_value})
         var_dict.update({dc: dc_value})
 
-if 'mongo_url' not in var_dict:
-    DB_CONN = eval(f"MongoClient(MONGO_HOSTNAME, username=MONGO_USER, password=MONGO_PWD, authSource='admin')")
-    DB = eval(f"MongoClient(MONGO_HOSTNAME, username=MONGO_USER, password=MONGO_PWD, authSource='admin').{MONGO_DB}")
-else:
-    DB_CONN =  eval(f"MongoClient('{MONGO_URL}')")
-    DB =  eval(f"MongoClient('{MONGO_URL}').{MONGO_DB}")
+def __getattr__(name):
+    """DB_CONN and DB are only connected on first access"""
+    global DB_CONN, DB
+    if name == 'DB_CONN':
+        if config('storage') == 'sqlite':
+            raise AttributeError('DB_CONN is not available with sqlite storage, use DB')
+        if 'mongo_url' not in var_dict:
+            DB_CONN = eval(f"MongoClient(MONGO_HOSTNAME, username=MONGO_USER, password=MONGO_PWD, authSource='admin')")
+        else:
+            DB_CONN =  eval(f"MongoClient('{MONGO_URL}')")
+        return DB_CONN
+    elif name == 'DB':
+        DB = new_db()
+        return DB
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
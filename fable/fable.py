@@ -1,37 +1,51 @@
 from email.policy import default
-from fable import histredirector, searcher, inferer, verifier, tools, neighboralias
+from fable import histredirector, searcher, inferer, verifier, tools, neighboralias, pipeline
 import os
+import time
 import logging
 from collections import defaultdict
 import math
+import copy
+from concurrent import futures
 
 from . import config
+from .budget import Budget
 from .tracer import tracer as tracing
 from .utils import url_utils, crawl, sic_transit
 
-db = config.DB
 he = url_utils.HostExtractor()
 
 
 class AliasFinder:
-    def __init__(self, use_db=True, db=db, memo=None, similar=None, proxies={}, tracer=None,\
-                classname='fable', logname=None, loglevel=logging.INFO):
+    def __init__(self, use_db=True, db=None, memo=None, similar=None, proxies={}, tracer=None,\
+                classname='fable', logname=None, loglevel=logging.INFO, prefetch=0, budget=None):
         """
+        db: db for traces. If None, config.DB
         memo: tools.Memoizer class for access cached crawls & API calls. If None, initialize one.
         similar: tools.Similar class for similarity matching. If None, initialize one.
         tracer: self-extended logger
         classname: Class (key) that the db will update data in the corresponding document
         logname: The log file name that will be output msg. If not specified, use classname
+        prefetch: Number of next untouched URLs whose candidates (hist_redir + search) are fetched 
+                  in background threads while run_order verifies the current one. 0 to disable
+        budget: budget.Budget limiting the cost spent on each directory by run_order. If None, unlimited
+                memo is charged through the same budget
         """
         self.memo = memo if memo is not None else tools.Memoizer()
         self.similar = similar if similar is not None else tools.Similar()
+        self.proxies = proxies
+        self.prefetch = prefetch
+        self.budget = budget if budget is not None else Budget()
+        self.memo.budget = self.budget
+        self.spend = None # * Budget report of the last run_order
+        self.scheduler = None # * pipeline.StageScheduler for run_pipeline, created on first use
         self.PS = crawl.ProxySelector(proxies)
-        self.histredirector = histredirector.HistRedirector(memo=self.memo,  proxies=proxies)
-        self.searcher = searcher.Searcher(memo=self.memo, similar=self.similar, proxies=proxies)
-        self.inferer = inferer.Inferer(memo=self.memo, similar=self.similar, proxies=proxies)
+        self.histredirector = histredirector.HistRedirector(memo=self.memo,  proxies=proxies, budget=self.budget)
+        self.searcher = searcher.Searcher(memo=self.memo, similar=self.similar, proxies=proxies, budget=self.budget)
+        self.inferer = inferer.Inferer(memo=self.memo, similar=self.similar, proxies=proxies, budget=self.budget)
         self.verifier = verifier.Verifier(fuzzy=1, memo=self.memo, similar=self.similar)
         self.nba = neighboralias.NeighborAlias()
-        self.db = db
+        self.db = db if db is not None else config.DB
         self.site = None
         self.url_title = {}
         self.classname = classname
@@ -52,8 +66,7 @@ class AliasFinder:
         if len(self.tracer.handlers) > 2:
             self.tracer.handlers.pop()
         formatter = logging.Formatter('%(levelname)s %(asctime)s %(message)s')
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
+        os.makedirs('logs', exist_ok=True)
         file_handler = logging.FileHandler(f'./logs/{site}.log')
         file_handler.setFormatter(formatter)
         self.tracer.addHandler(file_handler)
@@ -64,6 +77,40 @@ class AliasFinder:
         self.seen_reorg_pairs = None
         self.tracer.handlers.pop()
     
+    def _fork(self):
+        """
+        Shallow copy for running hist_redir/search in another thread
+        Memo, tracer and title caches are shared. Techniques with per-call state get their own instance
+        """
+        forked = copy.copy(self)
+        forked.similar = self.similar.fork()
+        forked.histredirector = histredirector.HistRedirector(memo=self.memo, proxies=self.proxies, budget=self.budget)
+        forked.histredirector.wayback_index_cache = self.histredirector.wayback_index_cache
+        forked.searcher = searcher.Searcher(memo=self.memo, similar=forked.similar, proxies=self.proxies, budget=self.budget)
+        forked._candidate_cache = defaultdict(lambda: defaultdict(list))
+        return forked
+
+    def _prefetch_candidates(self, url):
+        """
+        Run hist_redir + search for url on a fork
+
+        Return: ([candidates], fork's _candidate_cache)
+        """
+        forked = self._fork()
+        with self.budget.track('hist_redir'):
+            new_cands = forked.hist_redir([url])
+        with self.budget.track('search'):
+            new_cands += forked.search([url])
+        return new_cands, forked._candidate_cache
+
+    def _collect_prefetched(self, future):
+        """Wait for prefetched candidates, and merge its candidate cache as if it's run here"""
+        new_cands, candidate_cache = future.result()
+        for nd, techs in candidate_cache.items():
+            for tech, cands in techs.items():
+                self._candidate_cache[nd][tech] += cands
+        return new_cands
+
     def _get_title(self, url):
         if url in self.url_title:
             return self.url_title[url]
@@ -208,6 +255,31 @@ class AliasFinder:
                 aliases.append([url, [title,], a, r])
         return aliases
     
+    def verify_incremental(self, urls, new_candidates=[], new_neighbor_candidates=[]):
+        """
+        Incremental version of verify. Only candidates found since the last call are passed in
+        (self.verifier needs to be cleared at the start of the directory)
+        Clusters are regrouped over all candidates every round, only rules and scores of untouched clusters are reused
+        urls: All URLs touched so far. new_candidates not for urls are dropped
+
+        Return: verified [ [url, [title,], alias, reason] ]
+        """
+        cand_obj = {
+            'alias': [cand for cand in new_candidates if cand[0] in urls], 
+            'examples': list(new_neighbor_candidates)
+        }
+        self.verifier.add_candidates(cand_obj)
+        # * Always regroup clusters, as verify_url could update cluster values in place
+        # * Rules and scores of clusters not touched by new candidates are reused (see Verifier.update_clusters)
+        self.verifier.update_clusters()
+        aliases = []
+        for url in urls:
+            alias = self.verifier.verify_url(url)
+            title = self._get_title(url)
+            for a, r in alias:
+                aliases.append([url, [title,], a, r])
+        return aliases
+    
     def get_neighbors(self, urls, tss=[], status_filter='23', \
                         max_collect=5):
         """
@@ -228,9 +300,9 @@ class AliasFinder:
         tries = 0
         # * Collect URLs for finding aliases
         for _, orig_url, _ in ordered_w:
-            if tries > 2 * max_collect:
+            if tries > 2 * max_collect or self.budget.exhausted():
                 break
-            broken, reason = sic_transit.broken(orig_url, html=True, redir_home=True)
+            broken, reason = sic_transit.broken(orig_url, html=True, redir_home=True, budget=self.budget)
             title = self._get_title(orig_url)
             if broken != True:
                 print(f"URL not broken: {orig_url} {reason}")
@@ -297,8 +369,10 @@ class AliasFinder:
     def run_order(self, netloc, urls):
         """
         Main workflow func: Combine all techniques and run in order
+        Stop exploring the directory once self.budget is exhausted. Spend is left in self.spend
         Return: verified [ [url, [title,], alias, reason] ]
         """
+        self.budget.start()
         site = he.extract(f"http://{netloc}")
         self.similar._init_titles(site)
         self.histredirector.wayback_index_cache = defaultdict(list)
@@ -308,44 +382,164 @@ class AliasFinder:
         neighbor_urls = []
         neighbor_cands = []
         if len(urls) < 10:
-            neighbor_urls, neighbor_cands = self.get_neighbors(urls)
+            with self.budget.track('neighbor'):
+                neighbor_urls, neighbor_cands = self.get_neighbors(urls)
         
         all_urls = set(urls + neighbor_urls)
         url_archived = {}
+        with self.budget.track('wayback_index'):
+            url_cps = self.memo.wayback_index_many(list(all_urls))
         for url in all_urls:
-            wi = db.wayback_index.find_one({'url': url})
+            wi = url_cps[url]
             url_archived[url] = wi and len(wi.get('ts', []))
         url_warchive = [u for u in all_urls if url_archived[u]]
         url_woarchive = [u for u in all_urls if not url_archived[u]]
         all_urls = url_warchive + url_woarchive
+        self.verifier.clear(cache=True)
+        self.verifier.add_candidates({'alias': [], 'examples': neighbor_cands})
         touched_urls = set()
-        while len(touched_urls) < len(all_urls):
-            untouched_urls = [u for u in all_urls if u not in touched_urls]
-            new_url = untouched_urls[0]
-            self.tracer.info(f"Test URL: {new_url}")
-            new_cands = self.hist_redir([new_url])
-            new_cands += self.search([new_url])
-            if new_url in urls:
-                cands += new_cands
-            elif new_url in neighbor_urls:
-                neighbor_cands += new_cands
-            touched_urls.add(new_url)
-            aliases = self.verify(list(touched_urls), cands, neighbor_cands)
-            # * Skip check
-            N = min(max(2, math.ceil(len(all_urls)*0.4)), len(all_urls))
-            if len(aliases) == 0 and len(touched_urls) >= N:
-                if self._early_skip():
-                    pass
-                    # break
-            # * Inference
-            urls_seen_aliases = set([a[0] for a in aliases])
-            toinfer_urls = [u for u in all_urls if u not in urls_seen_aliases]
-            if len(toinfer_urls) > 0 and len(urls_seen_aliases) > 1:
-                infer_aliases = self.infer(toinfer_urls, aliases)
-                touched_urls.update([u[0] for u in infer_aliases])
-                aliases += infer_aliases
+        aliases = []
+        prefetched = {} # * {url: future of _prefetch_candidates}
+        executor = futures.ThreadPoolExecutor(max_workers=self.prefetch) if self.prefetch > 0 else None
+        try:
+            while len(touched_urls) < len(all_urls):
+                if self.budget.exhausted():
+                    self.tracer.info(f"run_order: Budget exhausted ({self.budget.exhausted_reason}), stop exploring {netloc}")
+                    break
+                untouched_urls = [u for u in all_urls if u not in touched_urls]
+                new_url = untouched_urls[0]
+                self.tracer.info(f"Test URL: {new_url}")
+                if new_url in prefetched:
+                    new_cands = self._collect_prefetched(prefetched.pop(new_url))
+                else:
+                    with self.budget.track('hist_redir'):
+                        new_cands = self.hist_redir([new_url])
+                    with self.budget.track('search'):
+                        new_cands += self.search([new_url])
+                new_alias, new_examples = [], []
+                if new_url in urls:
+                    cands += new_cands
+                    new_alias = new_cands
+                elif new_url in neighbor_urls:
+                    neighbor_cands += new_cands
+                    new_examples = new_cands
+                touched_urls.add(new_url)
+                # * Prefetch next untouched URLs while verifying.
+                # * Only after the directory's wayback index is cached, so forks don't populate it concurrently
+                if executor is not None and len(self.histredirector.wayback_index_cache) > 0:
+                    for url in [u for u in all_urls if u not in touched_urls][:self.prefetch]:
+                        if url not in prefetched:
+                            prefetched[url] = executor.submit(self._prefetch_candidates, url)
+                with self.budget.track('verify'):
+                    aliases = self.verify_incremental(list(touched_urls), new_alias, new_examples)
+                # * Skip check
+                N = min(max(2, math.ceil(len(all_urls)*0.4)), len(all_urls))
+                if len(aliases) == 0 and len(touched_urls) >= N:
+                    if self._early_skip():
+                        pass
+                        # break
+                # * Inference
+                urls_seen_aliases = set([a[0] for a in aliases])
+                toinfer_urls = [u for u in all_urls if u not in urls_seen_aliases]
+                if len(toinfer_urls) > 0 and len(urls_seen_aliases) > 1:
+                    with self.budget.track('inference'):
+                        infer_aliases = self.infer(toinfer_urls, aliases)
+                    touched_urls.update([u[0] for u in infer_aliases])
+                    aliases += infer_aliases
+        finally:
+            # * Prefetches of URLs resolved by inference are dropped
+            # * Running ones are waited, so that they don't outlive this directory and charge the next one's budget
+            if executor is not None:
+                for future in prefetched.values():
+                    future.cancel()
+                executor.shutdown(wait=True)
+        self.spend = self.budget.report()
         url_aliases = defaultdict(list)
         for a in aliases:
             url_aliases[a[0]].append(a)
         aliases = [v[0] for v in url_aliases.values()]
-        return aliases
\ No newline at end of file
+        return aliases
+
+    def run_pipeline(self, netloc, urls, scheduler=None):
+        """
+        Pipeline version of run_order: techniques are stages (see pipeline.py) tried in the order given by scheduler
+        For each URL, the rest of stages are skipped once it is resolved. Stop once all urls are resolved
+        scheduler: pipeline.StageScheduler. If None, use self.scheduler (stats persisted in db)
+
+        Return: verified [ [url, [title,], alias, reason] ]
+        """
+        if scheduler is None:
+            if self.scheduler is None:
+                self.scheduler = pipeline.StageScheduler(db=self.memo.db)
+            scheduler = self.scheduler
+        self.budget.start()
+        site = he.extract(f"http://{netloc}")
+        self.similar._init_titles(site)
+        self.histredirector.wayback_index_cache = defaultdict(list)
+        self.verifier.clear(cache=True)
+        ctx = {'netloc': netloc, 'urls': urls, 'neighbor_urls': [], 'aliases': [], 'inferred': []}
+
+        def _run_stage(stage, url=None):
+            start = time.time()
+            with self.budget.track(stage.name):
+                try:
+                    cands = stage.run(self, ctx, url)
+                except Exception as e:
+                    self.tracer.warn(f'run_pipeline: stage {stage.name} failed on {url}: {str(e)}')
+                    cands = []
+            return cands, time.time() - start
+
+        # * Directory stages, whose candidates are examples for the verifier
+        for stage in scheduler.order('directory'):
+            if self.budget.exhausted():
+                break
+            if not stage.applicable(self, ctx):
+                continue
+            cands, elapsed = _run_stage(stage)
+            scheduler.record(stage, len(cands) > 0, elapsed)
+            self.verifier.add_candidates({'alias': [], 'examples': cands})
+
+        all_urls = list(dict.fromkeys(urls + ctx['neighbor_urls']))
+        # * Archived URLs are tested first, their index lookups are the wayback_index stage's spend (as run_order)
+        with self.budget.track('wayback_index'):
+            url_cps = self.memo.wayback_index_many(all_urls)
+        url_archived = {u: url_cps[u] and len(url_cps[u].get('ts', [])) for u in all_urls}
+        all_urls = [u for u in all_urls if url_archived[u]] + [u for u in all_urls if not url_archived[u]]
+        touched_urls = []
+        for url in all_urls:
+            resolved = set([a[0] for a in ctx['aliases'] + ctx['inferred']])
+            if len([u for u in urls if u not in resolved]) == 0:
+                break
+            if self.budget.exhausted():
+                self.tracer.info(f"run_pipeline: Budget exhausted ({self.budget.exhausted_reason}), stop exploring {netloc}")
+                break
+            if url in resolved:
+                continue
+            self.tracer.info(f"Test URL: {url}")
+            touched_urls.append(url)
+            for stage in scheduler.order('url'):
+                if self.budget.exhausted():
+                    break
+                if not stage.applicable(self, ctx, url):
+                    continue
+                cands, elapsed = _run_stage(stage, url)
+                if stage.verified:
+                    ctx['inferred'] += cands
+                    hit = len(cands) > 0
+                else:
+                    new_alias = cands if url in urls else []
+                    new_examples = cands if url not in urls else []
+                    with self.budget.track('verify'):
+                        ctx['aliases'] = self.verify_incremental(touched_urls, new_alias, new_examples)
+                    hit = url in set([a[0] for a in ctx['aliases']])
+                scheduler.record(stage, hit, elapsed)
+                self.tracer.debug(f'run_pipeline: stage {stage.name} on {url}: hit={hit} ({elapsed:.2f}s)')
+                if hit:
+                    break
+        scheduler.save()
+        self.spend = self.budget.report()
+        url_aliases = defaultdict(list)
+        for a in ctx['aliases'] + ctx['inferred']:
+            url_aliases[a[0]].append(a)
+        aliases = [v[0] for v in url_aliases.values()]
+        return aliases
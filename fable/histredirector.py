@@ -12,6 +12,7 @@ from dateutil import parser as dparser
 import datetime
 
 from . import config, tools, tracer
+from .budget import Budget
 from .utils import crawl, url_utils, sic_transit, text_utils
 
 import logging
@@ -28,10 +29,14 @@ def _safe_dparse(ts):
         return datetime.datetime.now()
 
 class HistRedirector:
-    def __init__(self, corpus=[], proxies={}, memo=None):
+    def __init__(self, corpus=[], proxies={}, memo=None, budget=None):
+        """
+        budget: budget.Budget to charge crawls & CDX queries to. If None, unlimited
+        """
         self.corpus = corpus
         self.PS = crawl.ProxySelector(proxies)
         self.memo = memo if memo is not None else tools.Memoizer()
+        self.budget = budget if budget is not None else Budget()
         self.prefix_wayback_300s = {} # * Cache prefix searched 300 archives
         self.crawl_cache = {} # * Cache crawled response
         self.wayback_index_cache = defaultdict(list) # * Cache wayback indexed results
@@ -39,8 +44,14 @@ class HistRedirector:
     def _requests_crawl(self, url):
         if url in self.crawl_cache:
             return self.crawl_cache[url]
+        elif self.memo.negative.get(url, db=self.memo.db) is not None:
+            return None
         else:
-            resp = crawl.requests_crawl(url, raw=True)
+            self.budget.charge('crawl')
+            failure = {}
+            resp = crawl.requests_crawl(url, raw=True, failure=failure)
+            if 'kind' in failure:
+                self.memo.negative.put(url, failure['reason'], db=self.memo.db, kind=failure['kind'])
             self.crawl_cache[url] = resp
             return resp
     
@@ -59,6 +70,7 @@ class HistRedirector:
                 param_dict = {
                     'filter': ['mimetype:text/html', 'statuscode:[4][0-9]*']
                 }
+                self.budget.charge('cdx')
                 waybacks, _ = crawl.wayback_index(url, param_dict=param_dict)
                 return waybacks
 
@@ -112,7 +124,7 @@ class HistRedirector:
         # *If homepage to homepage redir, no soft-404 will be checked
         # ? If live_working == False, no need to check for breakeage
         if live_working:
-            broken, _ = sic_transit.broken(new_url, html=True, ignore_soft_404_content=homepage_redir)
+            broken, _ = sic_transit.broken(new_url, html=True, ignore_soft_404_content=homepage_redir, budget=self.budget)
             if broken: return False
             if homepage_redir: return True
         # ? End of live_working
@@ -147,6 +159,7 @@ class HistRedirector:
                     # 'limit': 1000
                 }
                 # TODO: Make this supported by cache_index
+                self.budget.charge('cdx')
                 neighbor, _ = crawl.wayback_index(url_prefix_str, param_dict=param_dict, total_link=True)
                 tracer.debug(f'Search for neighbors with query & year: {url_prefix_str} {ts_year}. Count: {len(neighbor)}')
                 self.prefix_wayback_300s[url_prefix_str] = neighbor
@@ -170,6 +183,8 @@ class HistRedirector:
         tracer.debug(neighbors[:10])
         matches = []
         for i in range(min(5, len(neighbors))):
+            if self.budget.exhausted():
+                break
             try:
                 tracer.debug(f'Choose closest neighbor: {neighbors[i][1]}')
                 response = self._requests_crawl(neighbors[i][1])
@@ -247,12 +262,16 @@ class HistRedirector:
         last_ts = wayback_ts_urls[-1][0] + datetime.timedelta(days=90)
         seen_redir_url = set()
         while url_match_count < 3 and same_redir < 5 and it >= 0:
+            if self.budget.exhausted():
+                tracer.debug(f'wayback_alias: budget exhausted ({self.budget.exhausted_reason})')
+                break
             ts, wayback_url = wayback_ts_urls[it]
             tracer.debug(f'wayback_alias iteration: ts: {ts} it: {it}')
             it -= 1
             if ts + datetime.timedelta(days=90) > last_ts: # 2 snapshots too close
                 continue
             try:
+                self.budget.charge('crawl')
                 response = crawl.requests_crawl(wayback_url, raw=True)
                 wayback_url = response.url
                 # * First match check
@@ -311,6 +330,7 @@ class HistRedirector:
                 # ? If live_working == False, no need to crawl the liveweb
                 if live_working:
                     for iu in inter_urls:
+                        self.budget.charge('crawl')
                         r = crawl.requests_crawl(iu, raw=True)
                         if isinstance(r, requests.Response) and \
                             (url_utils.url_match(r.url, inter_urls[-1]) or url_utils.url_match(r.url, live_new_url)):
@@ -355,6 +375,7 @@ class HistRedirector:
                     cur_prefix = url_prefix
             cur_prefix = cur_prefix[0] + cur_prefix[1]
             tracer.debug(f"batch_history: wayback index with prefix: {cur_prefix + '/*'}")
+            self.budget.charge('cdx')
             waybacks, _ = crawl.wayback_index(cur_prefix + '/*', param_dict=param_dict, total_link=True)
             for wayback in waybacks:
                 target_url = url_utils.filter_wayback(wayback[1])
@@ -365,6 +386,8 @@ class HistRedirector:
             alias = self.wayback_alias_history(url, require_neighbor=require_neighbor, \
                         homepage_redir=homepage_redir, strict_filter=strict_filter)
             url_history[url] = alias
+            if self.budget.exhausted():
+                break
         return url_history
 
     def wayback_alias_batch(self, urls, require_neighbor=False, homepage_redir=True, strict_filter=False):
@@ -407,6 +430,7 @@ class HistRedirector:
                     cur_prefix = url_prefix
             cur_prefix = cur_prefix[0] + cur_prefix[1]
             tracer.debug(f"batch_history: wayback index with prefix: {cur_prefix + '/*'}")
+            self.budget.charge('cdx')
             waybacks, _ = crawl.wayback_index(cur_prefix + '/*', param_dict=param_dict, total_link=True)
             for wayback in waybacks:
                 target_url = url_utils.filter_wayback(wayback[1])
@@ -417,6 +441,8 @@ class HistRedirector:
             alias = self.wayback_alias_any_history(url, require_neighbor=require_neighbor, \
                         homepage_redir=homepage_redir, strict_filter=strict_filter)
             url_any_history[url] = alias
+            if self.budget.exhausted():
+                break
         return url_any_history
 
     def na_alias(self, alias, live_working):
@@ -1,5 +1,4 @@
 from xmlrpc.client import ServerProxy
-import pandas as pd
 import numpy as np
 import pickle
 from urllib.parse import urlsplit, parse_qsl, parse_qs, unquote
@@ -12,6 +11,7 @@ import regex
 import random
 
 from . import config, tools, tracer, verifier
+from .budget import Budget
 from .utils import crawl, sic_transit, url_utils
 
 import logging
@@ -39,11 +39,15 @@ def soft_404_content(reason):
     return True
 
 class Inferer:
-    def __init__(self, proxies={}, memo=None, similar=None):
+    def __init__(self, proxies={}, memo=None, similar=None, budget=None):
+        """
+        budget: budget.Budget to charge crawls & CDX queries to. If None, unlimited
+        """
         self.PS = crawl.ProxySelector(proxies)
         self.proxy = ServerProxy(config.RPC_ADDRESS, allow_none=True)
         self.memo = memo if memo is not None else tools.Memoizer()
         self.similar = similar if similar is not None else tools.Similar()
+        self.budget = budget if budget is not None else Budget()
         self.not_workings = set() # Seen broken inferred URLs
         self.site = None
         self.url_aliases = defaultdict(set) # * Reorg pairs that have been added
@@ -163,7 +167,8 @@ class Inferer:
 
         Returns: {url: [possible reorg_url]}
         # TODO: Create more sheets with similar/same #words
-        """ 
+        """
+        import pandas as pd
         def normal(s):
             tokens = regex.split(f'_| [{VERTICAL_BAR_SET}] |[{VERTICAL_BAR_SET}]| \p{{Pd}} ', s)
             if len(tokens) > 1:
@@ -381,9 +386,12 @@ class Inferer:
         for eurl, _, ealias in examples:
             alias_match[url_norm(ealias)].add(url_norm(eurl))
         new_possible_infer = defaultdict(list)
+        if self.budget.exhausted():
+            return {}
+        cand_crawls = self.memo.crawl_many([cand for cands in possible_infer.values() for cand in cands], final_url=True)
         for infer_url, cands in possible_infer.items():
             for cand in cands:
-                cand_html, cand = self.memo.crawl(cand, final_url=True)
+                cand_html, cand = cand_crawls[cand]
                 if not cand_html:
                     continue
                 cand = crawl.get_canonical(cand, cand_html)
@@ -540,6 +548,8 @@ class Inferer:
             if urlsplit(url).path not in ['', '/'] and urlsplit(reorg_url).path in ['', '/']:
                 continue
             new_reorg = True
+            if self.budget.exhausted():
+                break
             if reorg_url in self.not_workings:
                 tracer.debug(f'Inferred URL already checked broken: {reorg_url}')
                 continue
@@ -552,7 +562,7 @@ class Inferer:
             #     working_aliases.append(reorg_url)
             # ? Try new version
             try:
-                if sic_transit.broken(reorg_url, html=True, redir_home=True)[0] != False:
+                if sic_transit.broken(reorg_url, html=True, redir_home=True, budget=self.budget)[0] != False:
                     raise
                 reorg_url_html, reorg_url = self.memo.crawl(reorg_url, final_url=True)
                 reorg_url = crawl.get_canonical(reorg_url, reorg_url_html)
@@ -636,6 +646,7 @@ class Inferer:
                 "filter": ['mimetype:text/html', 'statuscode:3[0-9]*'],
                 'collpase': 'urlkey'
             }
+            self.budget.charge('cdx')
             waybacks, _ = crawl.wayback_index(q, param_dict=param_dict)
             waybacks = [w for w in waybacks if not url_utils.url_match(w[1], url)]
             if len(waybacks) > 0:
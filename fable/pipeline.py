@@ -0,0 +1,180 @@
+"""
+Pluggable technique pipeline
+Each technique is a Stage with a declared cost and yield. StageScheduler orders stages by (smoothed) hit rate per cost,
+learnt from past runs and persisted in db.stage_stats
+"""
+import time
+import threading
+
+from . import config, tracer
+
+import logging
+logging.setLoggerClass(tracer.tracer)
+tracer = logging.getLogger('logger')
+logging.setLoggerClass(logging.Logger)
+
+PRIOR_WEIGHT = 5 # * Number of pseudo-runs the declared cost/yield are worth
+
+class Stage:
+    """
+    Base class of a technique
+    name: Key of the stage (in stats and budget reports)
+    scope: 'directory' stages run once per directory before others, 'url' stages run per URL
+    cost: Declared cost (seconds) per run
+    prior_yield: Declared rate of runs that resolve the URL
+    verified: Whether candidates are already verified (no need for verifier)
+    """
+    name = None
+    scope = 'url'
+    cost = 1
+    prior_yield = 0.5
+    verified = False
+
+    def applicable(self, finder, ctx, url=None):
+        return True
+
+    def run(self, finder, ctx, url=None):
+        """
+        ctx: {'netloc', 'urls', 'neighbor_urls', 'aliases' (verified so far), 'inferred' (aliases by verified stages)}
+
+        Return: [ [url, [title,], alias, reason] ]
+        """
+        raise NotImplementedError
+
+
+class NeighborStage(Stage):
+    """Redirection of (working) neighbors, also collects broken neighbors as examples"""
+    name = 'neighbor'
+    scope = 'directory'
+    cost = 10
+    prior_yield = 0.2
+
+    def applicable(self, finder, ctx, url=None):
+        return len(ctx['urls']) < 10
+
+    def run(self, finder, ctx, url=None):
+        neighbor_urls, neighbor_aliases = finder.get_neighbors(ctx['urls'])
+        ctx['neighbor_urls'] += [u for u in neighbor_urls if u not in ctx['urls']]
+        return list(neighbor_aliases)
+
+
+class ArchiveCanonicalStage(Stage):
+    """Canonical link on the archived copy that is still working"""
+    name = 'archive_canonical'
+    cost = 2
+    prior_yield = 0.1
+
+    def run(self, finder, ctx, url=None):
+        wayback_url = finder.memo.wayback_index(url)
+        if not wayback_url:
+            return []
+        html = finder.memo.crawl(wayback_url)
+        if not html:
+            return []
+        alias = finder.searcher._check_archive_canonical(wayback_url, html)
+        if not alias:
+            return []
+        reason = {'method': 'archive_canonical', 'type': 'archive_canonical', 'value': 'N/A'}
+        return [[url, [finder._get_title(url)], alias, reason]]
+
+
+class HistRedirStage(Stage):
+    """Archived redirections"""
+    name = 'hist_redir'
+    cost = 5
+    prior_yield = 0.3
+
+    def run(self, finder, ctx, url=None):
+        return finder.hist_redir([url])
+
+
+class SearchStage(Stage):
+    """Search engines (search_nocompare)"""
+    name = 'search'
+    cost = 15
+    prior_yield = 0.3
+
+    def run(self, finder, ctx, url=None):
+        return finder.search([url])
+
+
+class InferenceStage(Stage):
+    """Infer from verified aliases of other URLs"""
+    name = 'inference'
+    cost = 3
+    prior_yield = 0.3
+    verified = True
+
+    def applicable(self, finder, ctx, url=None):
+        return len(set([a[0] for a in ctx['aliases'] + ctx['inferred']])) > 1
+
+    def run(self, finder, ctx, url=None):
+        return finder.infer([url], ctx['aliases'] + ctx['inferred'])
+
+
+def default_stages():
+    return [NeighborStage(), ArchiveCanonicalStage(), HistRedirStage(), SearchStage(), InferenceStage()]
+
+
+class StageScheduler:
+    def __init__(self, stages=None, db=None, persist=True):
+        """
+        stages: [Stage]. If None, default_stages()
+        db: db to load/save stats (stage_stats collection). If None, config.DB
+        persist: Whether stats are loaded from & saved to db
+        """
+        self.stages = stages if stages is not None else default_stages()
+        self.persist = persist
+        self.db = db
+        self._lock = threading.Lock()
+        self.stats = {s.name: {'tries': 0, 'hits': 0, 'time': 0} for s in self.stages}
+        self._unsaved = {s.name: {'tries': 0, 'hits': 0, 'time': 0} for s in self.stages}
+        if self.persist:
+            self.load()
+
+    def load(self):
+        if self.db is None:
+            self.db = config.DB
+        try:
+            for doc in self.db.stage_stats.find({'_id': {'$in': list(self.stats.keys())}}):
+                self.stats[doc['_id']].update({k: doc.get(k, 0) for k in ['tries', 'hits', 'time']})
+        except Exception as e:
+            tracer.warn(f'StageScheduler: Cannot load stage stats: {str(e)}')
+
+    def save(self):
+        """Add stats recorded since last save to db"""
+        if not self.persist:
+            return
+        with self._lock:
+            unsaved = self._unsaved
+            self._unsaved = {name: {'tries': 0, 'hits': 0, 'time': 0} for name in self.stats}
+        for name, delta in unsaved.items():
+            if delta['tries'] == 0:
+                continue
+            try:
+                self.db.stage_stats.update_one({'_id': name}, {'$inc': delta}, upsert=True)
+            except Exception as e:
+                tracer.warn(f'StageScheduler: Cannot save stage stats: {str(e)}')
+
+    def record(self, stage, hit, elapsed):
+        with self._lock:
+            for stats in [self.stats[stage.name], self._unsaved[stage.name]]:
+                stats['tries'] += 1
+                stats['hits'] += int(hit)
+                stats['time'] += elapsed
+
+    def score(self, stage):
+        """
+        Return: Smoothed hit rate per (smoothed) cost
+        """
+        stats = self.stats[stage.name]
+        hit_rate = (stats['hits'] + stage.prior_yield * PRIOR_WEIGHT) / (stats['tries'] + PRIOR_WEIGHT)
+        cost = (stats['time'] + stage.cost * PRIOR_WEIGHT) / (stats['tries'] + PRIOR_WEIGHT)
+        return hit_rate / max(cost, 1e-3)
+
+    def order(self, scope='url'):
+        """
+        Return: [Stage] of scope, best score first (ties in declaration order)
+        """
+        stages = [s for s in self.stages if s.scope == scope]
+        return sorted(stages, key=lambda s: -self.score(s))
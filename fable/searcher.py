@@ -5,6 +5,7 @@ import re, regex, os
 from urllib.parse import urlsplit, urlunsplit
 
 from . import  tools, tracer
+from .budget import Budget
 from .utils import search, crawl, url_utils, sic_transit
 
 import logging
@@ -16,10 +17,11 @@ he = url_utils.HostExtractor()
 VERTICAL_BAR_SET = '\u007C\u00A6\u2016\uFF5C\u2225\u01C0\u01C1\u2223\u2502\u0964\u0965'
 
 class Searcher:
-    def __init__(self, use_db=True, proxies={}, memo=None, similar=None):
+    def __init__(self, use_db=True, proxies={}, memo=None, similar=None, budget=None):
         """
         At lease one of db or corpus should be provided
         # TODO: Corpus could not be necessary
+        budget: budget.Budget to charge crawls & search API calls to. If None, unlimited
 
         Return: 
             If found: URL, Trace (how copy is found, etc)
@@ -29,6 +31,7 @@ class Searcher:
         self.use_db = use_db
         self.memo = memo if memo is not None else tools.Memoizer()
         self.similar = similar if similar is not None else tools.Similar()
+        self.budget = budget if budget is not None else Budget()
         self.searched_results = {} # * URL: {title: {}, content: {}}
 
     def _check_archive_canonical(self, url, html):
@@ -42,8 +45,9 @@ class Searcher:
         canonical = crawl.get_canonical(url, html)
         if not url_utils.url_match(url, canonical, wayback=True):
             canonical = url_utils.filter_wayback(canonical)
-            if sic_transit.broken(canonical)[0] is False:
+            if sic_transit.broken(canonical, budget=self.budget)[0] is False:
                 try:
+                    self.budget.charge('crawl')
                     live_canonical = crawl.requests_crawl(canonical, raw=True)
                     live_canonical = crawl.get_canonical(live_canonical.url, live_canonical.text)
                     return live_canonical
@@ -67,16 +71,18 @@ class Searcher:
             tracer.token(url, available_tokens)
             search_results = []
             for i, token in enumerate(available_tokens):
+                if self.budget.exhausted():
+                    break
                 token = os.path.splitext(token)[0]
                 token = regex.split("[^a-zA-Z0-9]", token)
                 token = ' '.join(token)
                 if search_engine == 'bing':
                     # * Bing
-                    search_results = search.bing_search(f'{token} site:{site}', use_db=self.use_db)
+                    search_results = search.bing_search(f'{token} site:{site}', use_db=self.use_db, budget=self.budget)
                     tracer.search_results(url, 'bing', f"token_{i}", search_results)
                 else:
                     # * Google
-                    search_results = search.google_search(f'{token}', site_spec_url=site, use_db=self.use_db)
+                    search_results = search.google_search(f'{token}', site_spec_url=site, use_db=self.use_db, budget=self.budget)
                     tracer.search_results(url, 'google', f"token_{i}", search_results)
                 search_tokens = {}
                 for sr in search_results:
@@ -110,6 +116,8 @@ class Searcher:
         
         if url_utils.na_url(url):
             return None, {'reason': "Not applicable URL"}
+        if self.budget.exhausted():
+            return None, {'reason': "Budget exhausted"}
         if url not in self.searched_results:
             self.searched_results[url] ={'title': {}, 'content': {}, 'html': {}}
 
@@ -167,16 +175,21 @@ class Searcher:
             tracer.search_results(url, search_engine, typee, search_results)
             searched.update(search_results)
             searched_htmls = {}
+            working_cand = []
             for searched_url in search_cand:
                 # * Sanity check (SE could also got broken pages)
-                if sic_transit.broken(searched_url, html=True)[0] != False:
+                if self.budget.exhausted():
+                    break
+                if sic_transit.broken(searched_url, html=True, budget=self.budget)[0] != False:
                     tracer.debug(f'search_once: searched URL {searched_url} is broken')
                     continue
-                # * Use earliest archived copy if available
-                # searched_wayback = self.memo.wayback_index(searched_url, policy='earliest')
-                # searched_url_rep = searched_wayback if searched_wayback else searched_url
-                searched_url_rep = searched_url
-                searched_html, searched_url_rep = self.memo.crawl(searched_url_rep, final_url=True, proxies=self.PS.select())
+                working_cand.append(searched_url)
+            # * Use earliest archived copy if available
+            # searched_wayback = self.memo.wayback_index(searched_url, policy='earliest')
+            # searched_url_rep = searched_wayback if searched_wayback else searched_url
+            searched_crawls = self.memo.crawl_many(working_cand, final_url=True, proxies=self.PS.select())
+            for searched_url in working_cand:
+                searched_html, searched_url_rep = searched_crawls[searched_url]
                 if searched_html is None: continue
                 searched_url_rep = crawl.get_canonical(searched_url_rep, searched_html)
                 searched_htmls[searched_url_rep] = searched_html
@@ -211,7 +224,7 @@ class Searcher:
                 bing_title = ' '.join(bing_title)
                 bing_title = re.sub(r'[^\x00-\x7F]+', ' ' , bing_title)
                 tracer.debug(f'Search query: {bing_title} {site_str}')
-                search_results = search.bing_search(f'{bing_title} {site_str}', use_db=self.use_db)
+                search_results = search.bing_search(f'{bing_title} {site_str}', use_db=self.use_db, budget=self.budget)
                 if len(search_results) > 20: search_results = search_results[:20]
                 similar = search_once(search_results, typee='title_site')
                 if similar is not None: 
@@ -220,7 +233,7 @@ class Searcher:
                     else:
                         return similar
                 if len(search_results) >= 8:
-                    search_results = search.bing_search(f'+"{bing_title}" {site_str}', use_db=self.use_db)
+                    search_results = search.bing_search(f'+"{bing_title}" {site_str}', use_db=self.use_db, budget=self.budget)
                     if len(search_results) > 20: search_results = search_results[:20]
                     similar = search_once(search_results, typee='title_exact')
                     if similar is not None: 
@@ -233,7 +246,7 @@ class Searcher:
                 google_title = ' '.join(google_title)
                 google_title = re.sub(r'[^\x00-\x7F]+', ' ' , google_title)
                 # * Google Title
-                search_results = search.google_search(f'{google_title}', site_spec_url=site, use_db=self.use_db)
+                search_results = search.google_search(f'{google_title}', site_spec_url=site, use_db=self.use_db, budget=self.budget)
                 similar = search_once(search_results, typee='title_site')
                 if similar is not None: 
                     if fuzzy:
@@ -241,7 +254,7 @@ class Searcher:
                     else:
                         return similar
                 if len(search_results) >= 8:
-                    search_results = search.google_search(f'"{google_title}"', site_spec_url=site, use_db=self.use_db)
+                    search_results = search.google_search(f'"{google_title}"', site_spec_url=site, use_db=self.use_db, budget=self.budget)
                     similar = search_once(search_results, typee='title_exact')
                     if similar is not None: 
                         if fuzzy:
@@ -260,18 +273,18 @@ class Searcher:
         topN = ' '.join(topN)
         tracer.topN(url, topN)
         search_results = []
-        if len(topN) > 0:
+        if len(topN) > 0 and not self.budget.exhausted():
             if search_engine == 'bing':
                 # * Bing Content
                 if site is not None:
                     site_str = f'site:{site}'
                 else: 
                     site_str = ''
-                search_results = search.bing_search(f'{topN} {site_str}', use_db=self.use_db)
+                search_results = search.bing_search(f'{topN} {site_str}', use_db=self.use_db, budget=self.budget)
                 if len(search_results) > 20: search_results = search_results[:20]
             else:
                 # * Google Content
-                search_results = search.google_search(topN, site_spec_url=site, use_db=self.use_db)
+                search_results = search.google_search(topN, site_spec_url=site, use_db=self.use_db, budget=self.budget)
             similar = search_once(search_results, typee='topN')
             if similar is not None: 
                 if fuzzy:
@@ -301,16 +314,18 @@ class Searcher:
             tracer.token(url, available_tokens)
             search_results = []
             for i, token in enumerate(available_tokens):
+                if self.budget.exhausted():
+                    break
                 token = os.path.splitext(token)[0]
                 token = regex.split("[^a-zA-Z0-9]", token)
                 token = ' '.join(token)
                 if search_engine == 'bing':
                     # * Bing
-                    search_results = search.bing_search(f'instreamset:url:{token} site:{site}', use_db=self.use_db)
+                    search_results = search.bing_search(f'instreamset:url:{token} site:{site}', use_db=self.use_db, budget=self.budget)
                     tracer.search_results(url, 'bing', f"token_{i}", search_results)
                 else:
                     # * Google
-                    search_results = search.google_search(f'inurl:{token}', site_spec_url=site, use_db=self.use_db)
+                    search_results = search.google_search(f'inurl:{token}', site_spec_url=site, use_db=self.use_db, budget=self.budget)
                     tracer.search_results(url, 'google', f"token_{i}", search_results)
                 search_tokens = {}
                 for sr in search_results:
@@ -337,6 +352,8 @@ class Searcher:
         
         if url_utils.na_url(url):
             return [(None, {'reason': "Not applicable URL"})]
+        if self.budget.exhausted():
+            return [(None, {'reason': "Budget exhausted"})]
         if url not in self.searched_results:
             self.searched_results[url] ={'title': {}, 'content': {}, 'html': {}}
         
@@ -400,13 +417,13 @@ class Searcher:
                 bing_title = ' '.join(bing_title)
                 bing_title = re.sub(r'[^\x00-\x7F]+', ' ' , bing_title)
                 tracer.debug(f'Search query: {bing_title} {site_str}')
-                search_results = search.bing_search(f'{bing_title} {site_str}', use_db=self.use_db)
+                search_results = search.bing_search(f'{bing_title} {site_str}', use_db=self.use_db, budget=self.budget)
             else:
                 google_title = uniq_title
                 google_title = ' '.join(google_title)
                 google_title = re.sub(r'[^\x00-\x7F]+', ' ' , google_title)
                 # * Google Title
-                search_results = search.google_search(f'{google_title}', site_spec_url=site, use_db=self.use_db)
+                search_results = search.google_search(f'{google_title}', site_spec_url=site, use_db=self.use_db, budget=self.budget)
                 tracer.debug(f'Search query: {google_title}')
             similar = search_once(search_results, typee='title_site')
             if similar is not None: 
@@ -415,10 +432,10 @@ class Searcher:
             # * Title_exact
             if len(search_results) >= 8:
                 if search_engine == 'bing':
-                    search_results = search.bing_search(f'+"{bing_title}" {site_str}', use_db=self.use_db)
+                    search_results = search.bing_search(f'+"{bing_title}" {site_str}', use_db=self.use_db, budget=self.budget)
                     if len(search_results) > 20: search_results = search_results[:20]
                 else:
-                    search_results = search.google_search(f'"{google_title}"', site_spec_url=site, use_db=self.use_db)
+                    search_results = search.google_search(f'"{google_title}"', site_spec_url=site, use_db=self.use_db, budget=self.budget)
                 similar = search_once(search_results, typee='title_exact')
                 if similar is not None: 
                     fuzzy_similars += similar
@@ -433,18 +450,18 @@ class Searcher:
         topN = ' '.join(topN)
         tracer.topN(url, topN)
         search_results = []
-        if len(topN) > 0:
+        if len(topN) > 0 and not self.budget.exhausted():
             if search_engine == 'bing':
                 # * Bing Content
                 if site is not None:
                     site_str = f'site:{site}'
                 else: 
                     site_str = ''
-                search_results = search.bing_search(f'{topN} {site_str}', use_db=self.use_db)
+                search_results = search.bing_search(f'{topN} {site_str}', use_db=self.use_db, budget=self.budget)
                 if len(search_results) > 20: search_results = search_results[:20]
             else:
                 # * Google Content
-                search_results = search.google_search(topN, site_spec_url=site, use_db=self.use_db)
+                search_results = search.google_search(topN, site_spec_url=site, use_db=self.use_db, budget=self.budget)
             similar = search_once(search_results, typee='topN')
             if similar is not None: 
                 fuzzy_similars += similar
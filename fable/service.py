@@ -0,0 +1,261 @@
+"""
+Long-running alias service
+Keeps warm AliasFinders (DB clients, stemmer/analyzers, fitted tfidf) and serves {netloc_dir, urls} jobs over local HTTP/JSON
+
+Endpoints:
+    POST /jobs       body: {netloc_dir, urls} or a list of them. Return: {'ids': [job ids]}
+    GET  /jobs/<id>  Return: job (status: queued/running/done/failed, result when done)
+    POST /run        body: same as /jobs. Stream results back as NDJSON (one line per job, in finishing order)
+    GET  /health     Return: pool size and number of queued jobs
+"""
+import json
+import uuid
+import time
+import queue
+import logging
+import argparse
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import config, tools, tracer
+from .budget import Budget
+from .fable import AliasFinder
+from .tracer import tracer as tracing
+
+logging.setLoggerClass(tracer.tracer)
+tracer = logging.getLogger('logger')
+logging.setLoggerClass(logging.Logger)
+
+JOB_TTL = 3600 # * Seconds a finished job is kept for GET /jobs/<id>
+MAX_FINISHED_JOBS = 10000 # * Finished jobs kept at most, oldest evicted first
+
+
+class AliasService:
+    def __init__(self, pool=1, classname='fable_service', loglevel=logging.INFO, prefetch=0, limits={}, \
+                job_ttl=JOB_TTL, max_finished=MAX_FINISHED_JOBS):
+        """
+        pool: Number of AliasFinders (worker threads) running jobs concurrently
+        classname: See AliasFinder
+        prefetch: See AliasFinder
+        limits: kwargs of budget.Budget, applied to each job
+        job_ttl: Seconds a finished job is kept before being evicted
+        max_finished: Max number of finished jobs kept
+        """
+        self.db = config.new_db()
+        # * Only one Similar fits the tfidf. Workers use forks of it, with their own title index
+        self.similar = tools.Similar(db=self.db)
+        self.jobs = {} # * {id: job}
+        self.finished = [] # * Ids of finished jobs, in finishing order
+        self.job_ttl = job_ttl
+        self.max_finished = max_finished
+        self._jobs_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.finders = []
+        for i in range(pool):
+            # * Each finder logs through its own tracer, instead of all sharing (and adding handlers to) logger
+            logname = f'{classname}_{i}'
+            logging.setLoggerClass(tracing)
+            finder_tracer = logging.getLogger(logname)
+            logging.setLoggerClass(logging.Logger)
+            finder_tracer._set_meta(classname, logname=logname, db=self.db, loglevel=loglevel)
+            finder = AliasFinder(db=self.db, memo=tools.Memoizer(db=self.db), similar=self.similar.fork(), \
+                                classname=classname, logname=logname, tracer=finder_tracer, \
+                                prefetch=prefetch, budget=Budget(**limits))
+            self.finders.append(finder)
+        self.workers = [threading.Thread(target=self._work, args=(finder,), daemon=True) for finder in self.finders]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, netloc_dir, urls, notify=None):
+        """
+        Queue a job
+        notify: queue.Queue that gets the job id once the job finishes
+
+        Return: job id
+        """
+        job_id = uuid.uuid4().hex
+        self._evict()
+        job = {
+            'id': job_id,
+            'netloc_dir': netloc_dir,
+            'urls': urls,
+            'status': 'queued',
+            'submitted': time.time(),
+            'notify': notify
+        }
+        with self._jobs_lock:
+            self.jobs[job_id] = job
+        self.queue.put(job_id)
+        return job_id
+
+    def _evict(self):
+        """Drop finished jobs older than job_ttl, then the oldest ones beyond max_finished"""
+        now = time.time()
+        with self._jobs_lock:
+            expired = 0
+            while expired < len(self.finished) and \
+                    (len(self.finished) - expired > self.max_finished or \
+                    self.jobs[self.finished[expired]]['finished'] < now - self.job_ttl):
+                del self.jobs[self.finished[expired]]
+                expired += 1
+            self.finished = self.finished[expired:]
+
+    def get(self, job_id):
+        """Return: Job without internal fields, None if not exists"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        return {k: v for k, v in job.items() if k != 'notify'}
+
+    def _work(self, finder):
+        while True:
+            job_id = self.queue.get()
+            with self._jobs_lock:
+                job = self.jobs[job_id]
+            job['status'] = 'running'
+            try:
+                aliases = finder.run_order(job['netloc_dir'], job['urls'])
+                result = {
+                    'netloc_dir': job['netloc_dir'],
+                    'aliases': aliases
+                }
+                if finder.budget.limited():
+                    result['spend'] = finder.spend
+                job['result'] = result
+                job['status'] = 'done'
+            except Exception as e:
+                tracer.warn(f'AliasService: job {job_id} failed: {str(e)}')
+                job['error'] = str(e)
+                job['status'] = 'failed'
+            # * Drop this job's trace data, the next job on this thread starts clean
+            tracer.update_data = defaultdict(dict)
+            finder.tracer.update_data = defaultdict(dict)
+            job['finished'] = time.time()
+            with self._jobs_lock:
+                self.finished.append(job_id)
+            if job['notify'] is not None:
+                job['notify'].put(job_id)
+            self.queue.task_done()
+
+
+def _parse_jobs(body):
+    """
+    Return: [(netloc_dir, urls)]
+    """
+    objs = body if isinstance(body, list) else [body]
+    jobs = []
+    for obj in objs:
+        if not isinstance(obj, dict) or 'netloc_dir' not in obj or not isinstance(obj.get('urls'), list):
+            raise ValueError('Each job should be {"netloc_dir": str, "urls": [str]}')
+        jobs.append((obj['netloc_dir'], obj['urls']))
+    return jobs
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None # * AliasService, set by serve()
+
+    def _send_json(self, code, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_jobs(self):
+        """Return: [(netloc_dir, urls)], None if body is invalid (error already sent)"""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            return _parse_jobs(json.loads(self.rfile.read(length)))
+        except Exception as e:
+            self._send_json(400, {'error': str(e)})
+            return None
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'pool': len(self.service.finders), 'queued': self.service.queue.qsize()})
+        elif self.path.startswith('/jobs/'):
+            job = self.service.get(self.path[len('/jobs/'):])
+            if job is None:
+                self._send_json(404, {'error': 'No such job'})
+            else:
+                self._send_json(200, job)
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path not in ['/jobs', '/run']:
+            self._send_json(404, {'error': 'Not found'})
+            return
+        jobs = self._read_jobs()
+        if jobs is None:
+            return
+        if self.path == '/jobs':
+            ids = [self.service.submit(netloc_dir, urls) for netloc_dir, urls in jobs]
+            self._send_json(202, {'ids': ids})
+            return
+        # * /run: Stream each job back once it finishes. No length, connection closed at the end
+        notify = queue.Queue()
+        ids = [self.service.submit(netloc_dir, urls, notify=notify) for netloc_dir, urls in jobs]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        for _ in ids:
+            job_id = notify.get()
+            job = self.service.get(job_id)
+            if job is None:
+                line = {'id': job_id, 'error': 'Job evicted before it was sent'}
+            elif job['status'] == 'done':
+                line = job['result']
+            else:
+                line = {'netloc_dir': job['netloc_dir'], 'error': job['error']}
+            try:
+                self.wfile.write((json.dumps(line) + '\n').encode())
+                self.wfile.flush()
+            except Exception:
+                # * Client gone, jobs are still available through /jobs/<id>
+                return
+
+    def log_message(self, format, *args):
+        tracer.debug(f'AliasService: {self.address_string()} {format % args}')
+
+
+def serve(service, host='127.0.0.1', port=8000):
+    """Serve service until interrupted"""
+    handler = type('Handler', (ServiceHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f'FABLE service listening on http://{host}:{port} with {len(service.finders)} AliasFinder(s)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run FABLE as a local HTTP/JSON service')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--pool', type=int, default=1, help='Number of AliasFinders running jobs concurrently')
+    parser.add_argument('--prefetch', type=int, default=0, help='See entrypoint.py')
+    parser.add_argument('--log', default='fable_service', help='Classname (and log name) of AliasFinders')
+    parser.add_argument('--max-time', type=float, default=None, help='Max seconds spent on each job')
+    parser.add_argument('--max-crawls', type=int, default=None, help='Max number of crawls on each job')
+    parser.add_argument('--max-cdx', type=int, default=None, help='Max number of wayback CDX queries on each job')
+    parser.add_argument('--max-searches', type=int, default=None, help='Max number of search API calls on each job')
+    args = parser.parse_args()
+    limits = {
+        'max_time': args.max_time,
+        'max_crawls': args.max_crawls,
+        'max_cdx': args.max_cdx,
+        'max_searches': args.max_searches
+    }
+    service = AliasService(pool=args.pool, classname=args.log, loglevel=logging.DEBUG, \
+                            prefetch=args.prefetch, limits=limits)
+    serve(service, host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
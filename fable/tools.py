@@ -5,22 +5,30 @@ Methodologies: Content Match / Parital Match
 import pymongo
 from pymongo import MongoClient
 import brotli
-import re, os
+import re, os, sys
+import hashlib
 import regex
 import time
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import random
 import brotli
 from dateutil import parser as dparser
 import datetime
 from urllib.parse import urlsplit, urlunsplit, parse_qsl
 import bisect
+from array import array
+import copy
+import threading
+from concurrent import futures
 from bs4 import BeautifulSoup
 
 from . import config, tracer
-from .utils import text_utils, crawl, url_utils, search
+from .utils import text_utils, crawl, url_utils, search, tfidf_model
 from .utils.url_utils import url_norm
 from .utils.sic_transit import text_norm
+from .utils.singleflight import SingleFlight, flight_key
+from .utils.negative_cache import get_negative_cache
+from .utils.codec import HtmlCodec
 
 import logging
 logging.setLoggerClass(tracer.tracer)
@@ -28,6 +36,10 @@ tracer = logging.getLogger('logger')
 logging.setLoggerClass(logging.Logger)
 
 DEFAULT_CACHE = 3600*24*30
+CRAWL_CACHE_BYTES = 256 * 1024 * 1024 # * Default size of in-memory crawl cache, overwritten by config 'crawl_cache_bytes'
+MORE_CRAWLS_BATCH = 4 # * Max number of candidates get_more_crawls crawls at a time
+MORE_CRAWLS_NEEDED = 2 # * Samples get_more_crawls gathers (2 data points should be sufficient)
+TS_INDEX_SIZE = 1024 # * Number of urls whose snapshot timestamp arrays are kept in memory by Memoizer
 LEAST_SITE_URLS = 20 # Least # of urls a site must try to crawl to enable title comparison
 COMMON_TITLE_SIZE = 5 # Common prefix/suffix extraction's sample number of title
 
@@ -56,11 +68,31 @@ def title_common(titles):
     return common
 
 
-def different_page(url, meta, content, crawls, wayback=False):
+def content_near_duplicate(content, crawl, threshold, db=None):
+    """
+    text_utils.near_duplicate of content and crawl's content
+    crawl's MinHash signature is computed on first use: the stored one (crawl['minhash']) is reused, 
+    else it is computed and persisted on the crawl doc (by _id)
+    db: db to persist into. If None, not persisted
+
+    Return: bool
+    """
+    crawl_content = crawl.get('content', '')
+    if crawl_content and not text_utils.remember_minhash(crawl_content, crawl.get('minhash', b'')):
+        crawl['minhash'] = text_utils.minhash(crawl_content).tobytes()
+        if '_id' in crawl and db is not None:
+            try:
+                db.crawl.update_one({'_id': crawl['_id']}, {"$set": {'minhash': crawl['minhash']}})
+            except Exception as e: tracer.warn(f'content_near_duplicate: {str(e)}')
+    return text_utils.near_duplicate(content, crawl_content, threshold)
+
+
+def different_page(url, meta, content, crawls, wayback=False, db=None):
     """
     Return pages with differnt content in crawls, that has closest title to it
     meta: metadata to identify index, title if not wayback, ts otherwise
     wayback: Whether to consider ts
+    db: db where MinHash signatures of crawls are persisted (see content_near_duplicate)
     """
     if not wayback:
         crawl_meta = [c['title'] for c in crawls]
@@ -70,25 +102,25 @@ def different_page(url, meta, content, crawls, wayback=False):
     if left_idx >= len(crawls): left_idx -= 1
     right_idx = left_idx + 1
     left, right = left_idx >= 0, right_idx < len(crawls)
-    max_content_simi = 0
+    seen_similar = False # * Whether any crawl so far has similar content (near_duplicate at 0.9)
     while left or right:
         if left:
             crawl_left = crawls[left_idx]
-            # TODO: Content comparison slows the process a lot
-            content_simi = text_utils.k_shingling(content, crawl_left.get('content', ''))
+            # * Compared by MinHash signatures (computed once per content)
+            similar = content_near_duplicate(content, crawl_left, 0.9, db=db)
             if not url_utils.url_match(url, crawl_left['url']) \
-              and (content_simi < 0.9 or max_content_simi >= 0.9): # * If three pages all have similar content, something wrong
+              and (not similar or seen_similar): # * If three pages all have similar content, something wrong
                 return crawl_left
-            max_content_simi = max(max_content_simi, content_simi)
+            seen_similar = seen_similar or similar
             left_idx -= 1
             left = left_idx >= 0
         if right:
             crawl_right = crawls[right_idx]
-            content_simi = text_utils.k_shingling(content, crawl_right.get('content', ''))
+            similar = content_near_duplicate(content, crawl_right, 0.9, db=db)
             if not url_utils.url_match(url, crawl_right['url']) \
-              and (content_simi < 0.9 or max_content_simi >= 0.9): # * If three pages all have similar content, something wrong
+              and (not similar or seen_similar): # * If three pages all have similar content, something wrong
                 return crawl_right
-            max_content_simi = max(max_content_simi, content_simi)
+            seen_similar = seen_similar or similar
             right_idx += 1
             right = right_idx < len(crawls)
     
@@ -107,7 +139,7 @@ def title_prepare(crawls, wayback=False):
     for ut in crawls:
         if 'content' not in ut:
             try:
-                html = brotli.decompress(ut['html']).decode()
+                html = memo.codec.decompress(ut)
                 ut['content'] = memo.extract_content(html, version='boilerpipe', handle_exception=False)
             except: pass
         if wayback:
@@ -141,11 +173,12 @@ def token_intersect(title1_token, title2_token):
         return set(title1_token[0].split()).intersection(title2_token[0].split())
 
 
-def unique_title(url, title, content, site_url_meta, wayback=False, return_common_part=False):
+def unique_title(url, title, content, site_url_meta, wayback=False, return_common_part=False, db=None):
     """
     Eliminate common suffix/prefix of certain site for liveweb
     url: full url (if wayback, url including web.archive.org)
     site_url_meta: [[netloc_dir, [crawls]]] sorted in netloc_dir
+    db: See different_page
     
     Returns: prefix/suffix filtered title, prefix/suffix if return_common_part is True
     """
@@ -175,7 +208,7 @@ def unique_title(url, title, content, site_url_meta, wayback=False, return_commo
     while (upgoing or downgoing) and len(diffs) < 7:
         tocheck = []
         if upgoing:
-            upcrawl = different_page(url, meta, content, site_url_meta[upidx][1], wayback=wayback)
+            upcrawl = different_page(url, meta, content, site_url_meta[upidx][1], wayback=wayback, db=db)
             if upcrawl:
                 upurl, uptitle = upcrawl['url'], upcrawl['title']
                 upurl = url_utils.url_norm(upurl)
@@ -183,7 +216,7 @@ def unique_title(url, title, content, site_url_meta, wayback=False, return_commo
                 if abs(uptd) <= 3 and not url_utils.url_match(upurl, url):
                     tocheck.append((uptd, upurl, uptitle))
         if downgoing:
-            downcrawl = different_page(url, meta, content, site_url_meta[downidx][1], wayback=wayback)
+            downcrawl = different_page(url, meta, content, site_url_meta[downidx][1], wayback=wayback, db=db)
             if downcrawl:
                 downurl, downtitle = downcrawl['url'], downcrawl['title']
                 downurl = url_utils.url_norm(downurl)
@@ -241,66 +274,171 @@ def date_parse(date):
             pass
     return datetime.datetime.now()
 
+class CrawlCache:
+    """
+    Thread-safe LRU of decompressed crawls in front of db.crawl, bounded by bytes
+    Entries expire with the same ttl as the db (wayback crawls never expire)
+    """
+    def __init__(self, max_bytes=CRAWL_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data = OrderedDict() # * {url: (html, final_url, ttl, size)}
+        self.size = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def _entry_size(self, url, html, final_url):
+        return sys.getsizeof(html) + sys.getsizeof(url) + (sys.getsizeof(final_url) if final_url else 0)
+
+    def _pop(self, url):
+        _, _, _, size = self._data.pop(url)
+        self.size -= size
+
+    def get(self, url, final_url=False):
+        """
+        final_url: Whether final url is required. Entries without final url are misses
+
+        Return: (html, final_url) if cached and valid, else None
+        """
+        with self._lock:
+            entry = self._data.get(url)
+            if entry is not None and entry[2] <= time.time() and 'web.archive.org/web' not in url:
+                self._pop(url)
+                entry = None
+            if entry is None or (final_url and entry[1] is None):
+                self.misses += 1
+                return None
+            self._data.move_to_end(url)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, url, html, final_url=None, ttl=None):
+        if html is None:
+            return
+        ttl = ttl if ttl is not None else time.time() + DEFAULT_CACHE
+        size = self._entry_size(url, html, final_url)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if url in self._data:
+                # * Keep known final url if the new crawl doesn't come with one
+                final_url = final_url if final_url is not None else self._data[url][1]
+                self._pop(url)
+            self._data[url] = (html, final_url, ttl, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                old_url = next(iter(self._data))
+                self._pop(old_url)
+                self.evictions += 1
+
+    def invalidate(self, url):
+        with self._lock:
+            if url in self._data:
+                self._pop(url)
+
+    def clear(self):
+        with self._lock:
+            self._data = OrderedDict()
+            self.size = 0
+
+    def stats(self):
+        """
+        Return: {'hits', 'misses', 'evictions', 'entries', 'bytes'}
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, \
+                    'entries': len(self._data), 'bytes': self.size}
+
+def html_digest(html):
+    """Digest of raw html, key of extractions"""
+    return hashlib.sha1(html.encode()).hexdigest()
+
+crawl_cache = None # * Shared by all Memoizers in the process
+def get_crawl_cache():
+    global crawl_cache
+    if crawl_cache is None:
+        max_bytes = config.config('crawl_cache_bytes')
+        crawl_cache = CrawlCache(max_bytes=max_bytes if max_bytes is not None else CRAWL_CACHE_BYTES)
+    return crawl_cache
+
+# * Coalesce concurrent crawls/CDX queries of all Memoizers in the process (and across processes by db.leases)
+flight = SingleFlight()
+
+
 class Memoizer:
     """
     Class for reducing crawl and wayback indexing
     """
-    def __init__(self, use_db=True, db=None, proxies={}):
+    def __init__(self, use_db=True, db=None, proxies={}, cache=None, coalesce=True, negative_cache=None, codec=None):
         """
         # TODO: Implement non-db version. (In mem version)
+        codec: HtmlCodec of html in db.crawl. If None, config 'crawl_codec' (default brotli)
+        cache: CrawlCache in front of db.crawl. If None, use the one shared in the process
+        negative_cache: NegativeCache of failed crawls. If None, use the one shared in the process
+        coalesce: Whether concurrent crawls/CDX queries of the same URL (also from other processes) are issued only once
         """
         self.use_db = use_db
         if use_db:
             self.db = config.new_db() if not db else db
         self.PS = crawl.ProxySelector(proxies)
+        self.cache = cache if cache is not None else get_crawl_cache()
+        self.negative = negative_cache if negative_cache is not None else get_negative_cache()
+        self.codec = codec if codec is not None else HtmlCodec(db=self.db if use_db else None)
+        self.budget = None # * budget.Budget to charge live crawls & CDX queries to. Set by AliasFinder
+        self.coalesce = coalesce
+        self._ts_index = OrderedDict() # * {(url, field, #snapshots, first ts, last ts): array of ts}
+        self._ts_lock = threading.Lock()
     
-    def crawl(self, url, final_url=False, max_retry=0, **kwargs):
+    def _charge(self, kind):
+        if self.budget is not None:
+            self.budget.charge(kind)
+    
+    def _fetch(self, url, max_retry=0, validators={}, **kwargs):
         """
-        final_url: Whether also return final redirected URLS
-        max_retry: Number of max retry times
-        TODO: non-db version
+        Crawl url from the web (no cache/db)
+        validators: {'etag', 'last_modified'} of the expired crawl. If set, send a conditional request
+
+        Return: (html, final_url, ttl, meta), #requests issued
+            meta: {'etag', 'last_modified'} of the response, 'not_modified': True if the crawl is still fresh (html is None)
+                  {'failed': reason} if failed (others are None), with 'negative': kind if worth remembering (see negative_cache)
         """
-        is_wayback = 'web.archive.org/web' in url
-        if not final_url:
-            html = self.db.crawl.find_one({'_id': url})
-        else:
-            html = self.db.crawl.find_one({'_id': url, 'final_url': {"$exists": True}})
-        if html and (html['ttl'] > time.time() or is_wayback):
-            tracer.debug(f'memo.crawl: db has the valid crawl')
-            if not final_url:
-                return brotli.decompress(html['html']).decode()
-            else:
-                return brotli.decompress(html['html']).decode(), html['final_url']  
-        elif html:
-            try:
-                self.db.crawl.update_one({'_id': url}, {'$unset': {'title': '', 'content': ''}}) 
-            except: pass
         retry = 0
-        resp = crawl.requests_crawl(url, raw=True, **kwargs)
+        cond_headers = {}
+        if validators.get('etag'): cond_headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'): cond_headers['If-Modified-Since'] = validators['last_modified']
+        if len(cond_headers) > 0: kwargs['headers'] = cond_headers
+        failure = {}
+        resp = crawl.requests_crawl(url, raw=True, failure=failure, **kwargs)
         if isinstance(resp, tuple) and resp[0] is None:
             tracer.info(f'requests_crawl: Blocked url {url}, {resp[1]}')
-            if not final_url:
-                return None
-            else:
-                return None, None
+            meta = {'failed': resp[1]}
+            if 'kind' in failure: meta['negative'] = failure['kind']
+            return (None, None, None, meta), 1
 
         # Retry if get bad crawl
         while retry < max_retry and resp is None:
             retry += 1
             time.sleep(5)
-            resp = crawl.requests_crawl(url, raw=True, **kwargs)
+            failure = {}
+            resp = crawl.requests_crawl(url, raw=True, failure=failure, **kwargs)
         if resp is None:
             tracer.info(f'requests_crawl: Unable to get HTML of {url}')
-            if not final_url:
-                return None
-            else:
-                return None, None
-        html = resp.text
-        if final_url:
-            fu = resp.url
+            meta = {'failed': failure.get('reason', 'Unable to get HTML')}
+            if 'kind' in failure: meta['negative'] = failure['kind']
+            return (None, None, None, meta), retry + 1
+
+        meta = {}
+        if resp.headers.get('etag'): meta['etag'] = resp.headers['etag']
+        if resp.headers.get('last-modified'): meta['last_modified'] = resp.headers['last-modified']
+        ttl = self._cache_ttl(resp.headers)
+        if resp.status_code == 304:
+            tracer.debug(f'memo.crawl: {url} not modified')
+            meta['not_modified'] = True
+            return (None, resp.url, ttl, meta), retry + 1
+        return (resp.text, resp.url, ttl, meta), retry + 1
 
-        # Calculate cache expire date
-        headers = {k.lower(): v.lower() for k, v in resp.headers.items()}
+    def _cache_ttl(self, headers):
+        """Return: Expire time of a crawl with response headers"""
+        headers = {k.lower(): v.lower() for k, v in headers.items()}
         cache_age = DEFAULT_CACHE
         if 'cache-control' in headers:
             v = headers['cache-control']
@@ -315,24 +453,230 @@ class Memoizer:
                     cache_age = DEFAULT_CACHE
             elif pp_in:
                 cache_age = DEFAULT_CACHE
-        ttl = time.time() + cache_age
+        return time.time() + cache_age
+
+    def _validators(self, doc):
+        """Return: {'etag', 'last_modified'} of an expired crawl doc (for conditional requests)"""
+        if not doc:
+            return {}
+        return {k: doc[k] for k in ['etag', 'last_modified'] if doc.get(k)}
+
+    def _crawl_update(self, url, html, fu, ttl, meta, final_url=False):
+        """
+        Return: Update on db.crawl for a fresh crawl
+        Extractions of the old html (if any) are unset
+        """
+        obj = self._crawl_obj(url, html, fu, ttl, meta=meta, final_url=final_url)
+        unset = {'title': '', 'content': '', 'title_version': '', 'content_version': '', 'minhash': ''}
+        if 'dict_id' not in obj: unset['dict_id'] = ''
+        return {"$set": obj, "$unset": unset}
+
+    def _revalidate_update(self, ttl, meta):
+        """Return: Update on db.crawl for a crawl that is not modified (extractions kept)"""
+        return {"$set": {'ttl': ttl, **{k: v for k, v in meta.items() if k != 'not_modified'}}}
+
+    def _crawl_obj(self, url, html, fu, ttl, meta={}, final_url=False):
+        """Return: crawl doc to be upserted"""
+        site = he.extract(url, wayback='web.archive.org/web' in url)
+        obj = {
+            "_id": url,
+            "url": url,
+            "site": site,
+            **self.codec.compress(html, site=site),
+            "digest": html_digest(html),
+            "ttl": ttl
+        }
+        if final_url: obj.update({'final_url': fu})
+        obj.update({k: v for k, v in meta.items() if k in ['etag', 'last_modified']})
+        return obj
+
+    def _valid_crawl(self, url, doc):
+        """
+        Whether doc from db.crawl can be used (not expired). Put valid ones into cache
+
+        Return: html if valid, else None
+        """
+        if doc and (doc['ttl'] > time.time() or 'web.archive.org/web' in url):
+            html_text = self.codec.decompress(doc)
+            self.cache.put(url, html_text, final_url=doc.get('final_url'), ttl=doc['ttl'])
+            return html_text
+        return None
 
+    def crawl(self, url, final_url=False, max_retry=0, **kwargs):
+        """
+        final_url: Whether also return final redirected URLS
+        max_retry: Number of max retry times
+        TODO: non-db version
+        """
+        cached = self.cache.get(url, final_url=final_url)
+        if cached is not None:
+            return cached if final_url else cached[0]
+        if not final_url:
+            html = self.db.crawl.find_one({'_id': url})
+        else:
+            html = self.db.crawl.find_one({'_id': url, 'final_url': {"$exists": True}})
+        html_text = self._valid_crawl(url, html)
+        if html_text is not None:
+            tracer.debug(f'memo.crawl: db has the valid crawl')
+            if not final_url:
+                return html_text
+            else:
+                return html_text, html['final_url']  
+        elif html and not self._validators(html):
+            try:
+                self.db.crawl.update_one({'_id': url}, {'$unset': {'title': '', 'content': '', 'title_version': '', 'content_version': ''}}) 
+            except: pass
+        if self.negative.get(url, db=self.db) is not None:
+            return (None, None) if final_url else None
+        return self._crawl_live(url, final_url=final_url, max_retry=max_retry, doc=html, **kwargs)
+
+    def _fetch_lookup(self, url):
+        """Return: Valid crawl in db (same form as _fetch()), None if not exists"""
         try:
-            obj = {
-                "_id": url,
-                "url": url,
-                "site": he.extract(url, wayback=is_wayback),
-                "html": brotli.compress(html.encode()),
-                "ttl": ttl
-            }
-            if final_url: obj.update({'final_url': fu})
-            self.db.crawl.update_one({'_id': url}, {"$set": obj}, upsert=True)
+            doc = self.db.crawl.find_one({'_id': url})
+        except: return None
+        html_text = self._valid_crawl(url, doc)
+        if html_text is None:
+            return None
+        return (html_text, doc.get('final_url', url), doc['ttl'], {}), 0
+
+    def _fetch_shared(self, url, max_retry=0, validators={}, **kwargs):
+        """
+        _fetch coalesced with concurrent crawl/crawl_many of url with the same options (also in other processes)
+
+        Return: _fetch's result, whether this call issued the requests (and should charge & store them)
+        """
+        if not self.coalesce:
+            return self._fetch(url, max_retry=max_retry, validators=validators, **kwargs), True
+        issued = []
+        def fetch():
+            issued.append(True)
+            return self._fetch(url, max_retry=max_retry, validators=validators, **kwargs)
+        result = flight.do(flight_key('crawl', url, {'max_retry': max_retry, **kwargs}), fetch, \
+                        lookup=lambda: self._fetch_lookup(url), lease_db=self.db, \
+                        failed=lambda r: r[0][0] is None and not r[0][3].get('not_modified'), \
+                        default=((None, None, None, {'failed': 'Failed in another process'}), 0))
+        return result, len(issued) > 0
+
+    def _crawl_live(self, url, final_url=False, max_retry=0, doc=None, **kwargs):
+        """
+        Crawl url from the web, and upsert into db & cache
+        doc: Expired crawl in db. Revalidated with its etag/last_modified if there are
+        Concurrent crawls of url are coalesced, only the one issuing the requests charges & stores them
+        """
+        ((html, fu, ttl, meta), requests), issued = self._fetch_shared(url, max_retry=max_retry, validators=self._validators(doc), **kwargs)
+        for _ in range(requests if issued else 0):
+            self._charge('crawl')
+        if html is None and meta.get('not_modified'):
+            # * Only extend ttl, extractions of the html are still valid
+            html, fu = self.codec.decompress(doc), doc.get('final_url', fu)
+            if issued:
+                try:
+                    self.db.crawl.update_one({'_id': url}, self._revalidate_update(ttl, meta))
+                except Exception as e: tracer.warn(f'crawl: {url} {str(e)}')
+                self.cache.put(url, html, final_url=doc.get('final_url'), ttl=ttl)
+            return (html, fu) if final_url else html
+        if html is None:
+            if issued and meta.get('negative'):
+                self.negative.put(url, meta['failed'], db=self.db, kind=meta['negative'])
+            if not final_url:
+                return None
+            else:
+                return None, None
+        if not issued:
+            return (html, fu) if final_url else html
+
+        try:
+            self.db.crawl.update_one({'_id': url}, self._crawl_update(url, html, fu, ttl, meta, final_url=final_url), upsert=True)
         except Exception as e: tracer.warn(f'crawl: {url} {str(e)}')
+        self.cache.put(url, html, final_url=fu if final_url else None, ttl=ttl)
         tracer.debug(f'memo.crawl: upsert crawl {url}')
         if not final_url:
             return html
         else:
             return html, fu
+
+    def crawl_many(self, urls, final_url=False, max_concurrency=8, per_host=2, max_retry=0, **kwargs):
+        """
+        Batch version of crawl
+        Cache & db are checked at once, misses are crawled concurrently and upserted with one bulk_write
+        max_concurrency: Max number of crawls in flight
+        per_host: Max number of crawls in flight to the same host (politeness)
+
+        Return: {url: html} or {url: (html, final_url)} if final_url, in the order of urls. Failed crawls are None/(None, None)
+        """
+        results = {}
+        misses = []
+        for url in urls:
+            if url in results or url is None:
+                continue
+            cached = self.cache.get(url, final_url=final_url)
+            if cached is not None:
+                results[url] = cached if final_url else cached[0]
+            else:
+                results[url] = None
+                misses.append(url)
+        if len(misses) > 0:
+            query = {'_id': {'$in': misses}}
+            if final_url: query['final_url'] = {"$exists": True}
+            try:
+                docs = {doc['_id']: doc for doc in self.db.crawl.find(query)}
+            except Exception as e:
+                tracer.warn(f'crawl_many: {str(e)}')
+                docs = {}
+            expired = []
+            fetch_urls = []
+            for url in misses:
+                html_text = self._valid_crawl(url, docs.get(url))
+                if html_text is not None:
+                    results[url] = (html_text, docs[url]['final_url']) if final_url else html_text
+                elif self.negative.get(url, db=self.db) is None:
+                    if url in docs: expired.append(url)
+                    fetch_urls.append(url)
+            tracer.debug(f'memo.crawl_many: {len(urls)} urls, {len(fetch_urls)} to crawl')
+            expired = [url for url in expired if not self._validators(docs[url])]
+            if len(expired) > 0:
+                try:
+                    self.db.crawl.update_many({'_id': {'$in': expired}}, {'$unset': {'title': '', 'content': '', 'title_version': '', 'content_version': ''}})
+                except: pass
+            # * Crawl misses concurrently, bounded per host
+            host_sems = {urlsplit(url).netloc: threading.Semaphore(max(per_host, 1)) for url in fetch_urls}
+            def fetch(url):
+                validators = self._validators(docs.get(url))
+                with host_sems[urlsplit(url).netloc]:
+                    return self._fetch_shared(url, max_retry=max_retry, validators=validators, **kwargs)
+            ops = []
+            with futures.ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(fetch_urls)))) as executor:
+                fetched = executor.map(fetch, fetch_urls)
+                for url, (((html, fu, ttl, meta), requests), issued) in zip(fetch_urls, fetched):
+                    # * Charged from this thread, so that spend is attributed to the running technique
+                    for _ in range(requests if issued else 0):
+                        self._charge('crawl')
+                    if html is None and meta.get('not_modified'):
+                        doc = docs[url]
+                        html = self.codec.decompress(doc)
+                        results[url] = (html, doc.get('final_url', fu)) if final_url else html
+                        if issued:
+                            self.cache.put(url, html, final_url=doc.get('final_url'), ttl=ttl)
+                            ops.append(pymongo.UpdateOne({'_id': url}, self._revalidate_update(ttl, meta)))
+                        continue
+                    if html is None:
+                        if issued and meta.get('negative'):
+                            self.negative.put(url, meta['failed'], db=self.db, kind=meta['negative'])
+                        continue
+                    results[url] = (html, fu) if final_url else html
+                    # * Coalesced crawls are stored by the one that issued them
+                    if not issued:
+                        continue
+                    self.cache.put(url, html, final_url=fu if final_url else None, ttl=ttl)
+                    ops.append(pymongo.UpdateOne({'_id': url}, self._crawl_update(url, html, fu, ttl, meta, final_url=final_url), upsert=True))
+            if len(ops) > 0:
+                try:
+                    self.db.crawl.bulk_write(ops, ordered=False)
+                except Exception as e: tracer.warn(f'crawl_many: {str(e)}')
+        if final_url:
+            return {url: (r if r is not None else (None, None)) for url, r in results.items()}
+        return results
     
     def wayback_index(self, url, policy='latest-rep', ts=None, all_none_400=False, **kwargs):
         """
@@ -355,73 +699,63 @@ class Memoizer:
             wayback_url = self.db.wayback_rep.find_one(wayback_q)
             if wayback_url:
                 return wayback_url['wayback_url']
-        param_dict = {
-            "filter": ['statuscode:[23][0-9]*', 'mimetype:text/html'],
-            "collapse": "timestamp:8"
-        }
         nb_map = {True: 'ts_nb', False: 'ts'}
         cps = self.db.wayback_index.find_one({'_id': url})
         if not cps:
-            cps, status = crawl.wayback_index(url, param_dict=param_dict, total_link=True, **kwargs)
-            tracer.debug('Wayback Index (tools.py): Get wayback query response')
-            if len(cps) == 0: # No snapshots
-                tracer.info(f"Wayback Index: No snapshots {status}")
+            cps = self._wayback_index_fetch(url, **kwargs)
+            if cps is None: # No snapshots
                 return None if policy not in ['all'] else []
-            cps.sort(key=lambda x: x[0])
-            update_dict = {
-                'url': url,
-                'ts': [c[0] for c in cps if str(c[2])[0] == '2'],
-                'ts_nb': [c[0] for c in cps]
-            }
-            try:
-                self.db.wayback_index.update_one({"_id": url}, {'$set': update_dict}, upsert=True)
-            except: pass
-            cps = update_dict
         else:
             tracer.debug('Wayback Index (tools.py): db has wayback_index')
         
-        cps = [(c, url_utils.constr_wayback(url, c)) for c in cps[nb_map[all_none_400]]]
-        if len(cps) == 0:
+        tss = self._ts_array(url, cps, nb_map[all_none_400])
+        if len(tss) == 0:
             return None if policy not in ['all'] else []
+        # * Wayback URLs are only constructed for returned snapshots
+        wayback = lambda t: url_utils.constr_wayback(url, str(t))
 
         if policy == 'closest':
-            sec_diff = lambda x: (date_parse(str(x)) - date_parse(str(ts))).total_seconds()
-            cps_close = [(cp, abs(sec_diff(cp[0]))) for cp in cps]
-            return sorted(cps_close, key=lambda x: x[1])[0][0][1]
+            # * Closest in time is one of the neighbors of ts
+            ts_date = date_parse(str(ts))
+            idx = bisect.bisect_left(tss, int(ts_date.strftime('%Y%m%d%H%M%S')))
+            neighbors = [tss[i] for i in [idx-1, idx] if 0 <= i < len(tss)]
+            sec_diff = lambda x: abs((date_parse(str(x)) - ts_date).total_seconds())
+            return wayback(min(neighbors, key=sec_diff))
         elif policy == 'closest-later':
-            cps_later = [cp for cp in cps if int(cp[0]) >= int(ts)]
-            return cps_later[0][1] if len(cps_later) > 0 else cps[-1][1]
+            idx = bisect.bisect_left(tss, int(ts))
+            return wayback(tss[idx] if idx < len(tss) else tss[-1])
         elif policy == 'closest-earlier':
-            cps_earlier = [cp for cp in cps if int(cp[0]) <= int(ts)]
-            return cps_earlier[-1][1] if len(cps_earlier) > 0 else cps[0][1]
+            idx = bisect.bisect_right(tss, int(ts)) - 1
+            return wayback(tss[idx] if idx >= 0 else tss[0])
         elif policy == 'earliest':
-            return cps[0][1]
+            return wayback(tss[0])
         elif policy == 'latest':
-            return cps[-1][1]
+            return wayback(tss[-1])
         elif policy == 'all':
-            return cps
+            return [(str(t), wayback(t)) for t in tss]
         elif policy == 'latest-rep':
             # Get latest 6 snapshots, and random sample 3 for finding representative results
-            cps_sample = cps[-3:] if len(cps) >= 3 else cps
+            cps_sample = [(str(t), wayback(t)) for t in tss[-3:]]
             cps_sample = [(cp[0], cp[1]) for cp in cps_sample if (date_parse(cps_sample[-1][0]) - date_parse(cp[0])).days <= 180]
+            # * Snapshots are crawled & extracted concurrently
+            htmls = self.crawl_many([wu for _, wu in cps_sample], proxies=self.PS.select())
+            cps_sample_html = [(ts, wu) for ts, wu in cps_sample if htmls[wu] is not None]
+            with futures.ThreadPoolExecutor(max_workers=max(1, len(cps_sample_html))) as executor:
+                stats = list(executor.map(lambda cp: self.snapshot_stats(htmls[cp[1]]), cps_sample_html))
             cps_dict = {}
-            for ts, wayback_url in cps_sample:
-                html = self.crawl(wayback_url, proxies=self.PS.select())
-                if html is None: continue
-                # TODO: Domditiller vs Boilerpipe --> Acc vs Speed?
-                content = text_utils.extract_body(html, version='boilerpipe')
-                # title = text_utils.extract_title(html, version='newspaper')
-                cps_dict[ts] = (ts, wayback_url, content)
+            for (ts, wayback_url), stat in zip(cps_sample_html, stats):
+                cps_dict[ts] = (ts, wayback_url, stat)
             if len(cps_dict) > 0:
-                rep = sorted(cps_dict.values(), key=lambda x: len(x[2].split()))[int((len(cps_dict)-1)/2)]
+                rep = sorted(cps_dict.values(), key=lambda x: x[2]['words'])[int((len(cps_dict)-1)/2)]
             else:
-                rep = cps_sample[-1]
+                rep = (*cps_sample[-1], {})
             try:
                 self.db.wayback_rep.insert_one({
                     "url": url,
                     "ts": rep[0],
                     "wayback_url": rep[1],
-                    'policy': 'latest-rep'
+                    'policy': 'latest-rep',
+                    **rep[2]
                 })
             except Exception as e: pass
             return rep[1]
@@ -429,24 +763,146 @@ class Memoizer:
             tracer.error(f'Wayback Index: Reach non existed policy')
             raise
     
+    def _wayback_index_fetch(self, url, **kwargs):
+        """
+        Query CDX for url's snapshots, and store into db.wayback_index
+
+        Return: {'url', 'ts', 'ts_nb'}, None if there is no snapshot
+        """
+        if not self.coalesce:
+            return self._wayback_index_live(url, **kwargs)
+        def lookup():
+            try:
+                return self.db.wayback_index.find_one({'_id': url})
+            except: return None
+        return flight.do(flight_key('cdx', url, kwargs), lambda: self._wayback_index_live(url, **kwargs), lookup=lookup, lease_db=self.db, \
+                        failed=lambda cps: cps is None)
+
+    def _ts_array(self, url, cps, field):
+        """
+        cps: wayback_index doc of url
+        field: ts or ts_nb
+
+        Return: Sorted array('q') of snapshot timestamps (kept in memory for recent urls)
+        """
+        # * Docs are re-read from db, so key on contents: re-indexed snapshots change length or ends
+        raw = cps[field]
+        key = (url, field, len(raw), raw[0] if raw else None, raw[-1] if raw else None)
+        with self._ts_lock:
+            tss = self._ts_index.get(key)
+            if tss is not None:
+                self._ts_index.move_to_end(key)
+                return tss
+        tss = array('q', sorted(int(t) for t in raw))
+        with self._ts_lock:
+            self._ts_index[key] = tss
+            while len(self._ts_index) > TS_INDEX_SIZE:
+                self._ts_index.popitem(last=False)
+        return tss
+
+    def _wayback_index_live(self, url, **kwargs):
+        param_dict = {
+            "filter": ['statuscode:[23][0-9]*', 'mimetype:text/html'],
+            "collapse": "timestamp:8"
+        }
+        self._charge('cdx')
+        cps, status = crawl.wayback_index(url, param_dict=param_dict, total_link=True, **kwargs)
+        tracer.debug('Wayback Index (tools.py): Get wayback query response')
+        if len(cps) == 0: # No snapshots
+            tracer.info(f"Wayback Index: No snapshots {status}")
+            return None
+        cps.sort(key=lambda x: int(x[0]))
+        # * Stored sorted, as the CDX timestamp strings other readers expect. _ts_array converts them to ints
+        update_dict = {
+            'url': url,
+            'ts': [str(c[0]) for c in cps if str(c[2])[0] == '2'],
+            'ts_nb': [str(c[0]) for c in cps]
+        }
+        try:
+            self.db.wayback_index.update_one({"_id": url}, {'$set': update_dict}, upsert=True)
+        except: pass
+        return update_dict
+
+    def wayback_index_many(self, urls, max_concurrency=8, **kwargs):
+        """
+        Bulk version of getting wayback_index entries for urls
+        One query for entries already in db, missing ones are fetched from CDX concurrently
+        max_concurrency: Max number of CDX queries on the fly
+
+        Return: {url: {'url', 'ts', 'ts_nb'} or None if no snapshots}
+        """
+        urls = list(dict.fromkeys(urls))
+        url_cps = {url: None for url in urls}
+        for cps in self.db.wayback_index.find({'_id': {'$in': urls}}):
+            url_cps[cps['_id']] = cps
+        missing = [url for url, cps in url_cps.items() if not cps]
+        tracer.debug(f'wayback_index_many: {len(urls)-len(missing)} in db, {len(missing)} to query')
+        if len(missing) > 0:
+            # * CDX queries are charged in workers, attributed to the technique running in this thread
+            budget = self.budget
+            technique = budget.technique() if budget is not None else None
+            def fetch(url):
+                if budget is None:
+                    return self._wayback_index_fetch(url, **kwargs)
+                with budget.attribute(technique):
+                    return self._wayback_index_fetch(url, **kwargs)
+            with futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                for url, cps in zip(missing, executor.map(fetch, missing)):
+                    url_cps[url] = cps
+        return url_cps
+
+    def _extraction(self, html, kind, extractor, extract, crawl_fields=[]):
+        """
+        Content-addressed cache of extractions, keyed by digest of html + kind + extractor version
+        extractor: Name (or list) of extractor, versioned by text_utils.EXTRACTOR_VERSIONS
+        Look up db.extractions first, then crawls (with the same digest) that already have crawl_fields
+        extract: func on cache miss. Return: (value, whether to cache value)
+        crawl_fields: Fields on crawl docs holding the value (also updated, for Similar's title index)
+            Each field f is stored with f_version (extractor version), only reused for the same version
+
+        Return: value
+        """
+        digest = html_digest(html)
+        version = text_utils.extractor_version(extractor)
+        key = f'{digest}:{kind}:{version}'
+        try:
+            doc = self.db.extractions.find_one({'_id': key})
+        except: 
+            doc = None
+        if doc:
+            return doc['value']
+        if len(crawl_fields) > 0:
+            try:
+                doc = self.db.crawl.find_one({'digest': digest, **{f'{f}_version': version for f in crawl_fields}}, 
+                                            {f: True for f in crawl_fields})
+            except: 
+                doc = None
+            if doc:
+                value = doc[crawl_fields[0]] if len(crawl_fields) == 1 else tuple(doc[f] for f in crawl_fields)
+                return value
+        value, cache = extract()
+        if not cache:
+            return value
+        try:
+            self.db.extractions.update_one({'_id': key}, {"$set": {'digest': digest, 'kind': kind, 'version': version, 'value': value}}, upsert=True)
+            if len(crawl_fields) > 0:
+                values = [value] if len(crawl_fields) == 1 else value
+                update = dict(zip(crawl_fields, values))
+                update.update({f'{f}_version': version for f in crawl_fields})
+                self.db.crawl.update_many({'digest': digest}, {"$set": update})
+        except Exception as e: tracer.warn(f'extract {kind}: {str(e)}')
+        return value
+
     def extract_content(self, html, **kwargs):
         if html is None:
             if kwargs.get('handle_exception', True):
                 return ''
             else:
                 raise
-        html_bin = brotli.compress(html.encode())
-        try:
-            content = self.db.crawl.find_one({'html': html_bin, 'content': {"$exists": True}})
-        except: 
-            content = None
-        if content:
-            return content['content']
-        content = text_utils.extract_body(html, **kwargs)
-        try:
-            self.db.crawl.update_one({'html': html_bin}, {"$set": {'content': content}})
-        except Exception as e: tracer.warn(f'extract content: {str(e)}')
-        return content
+        def extract():
+            content = text_utils.extract_body(html, **kwargs)
+            return content, True
+        return self._extraction(html, 'content', kwargs.get('version', 'domdistiller'), extract, crawl_fields=['content'])
     
     def extract_title(self, html, **kwargs):
         if html is None:
@@ -454,21 +910,11 @@ class Memoizer:
                 return ''
             else:
                 raise
-        html_bin = brotli.compress(html.encode())
-        try:
-            title = self.db.crawl.find_one({'html': html_bin, 'title': {"$exists": True}})
-        except: 
-            title = None
-        if title:
-            return title['title']
-        # Require to be extracted next time
-        title = text_utils.extract_title(html, **kwargs)
-        if title == "":
-            return title
-        try:
-            self.db.crawl.update_one({'html': html_bin}, {"$set": {'title': title}})
-        except Exception as e: tracer.warn(f'extract title: {str(e)}')
-        return title
+        def extract():
+            title = text_utils.extract_title(html, **kwargs)
+            # Require to be extracted next time
+            return title, title != ""
+        return self._extraction(html, 'title', kwargs.get('version', 'mine'), extract, crawl_fields=['title'])
     
     def extract_title_content(self, html, **kwargs):
         if html is None:
@@ -476,22 +922,26 @@ class Memoizer:
                 return ''
             else:
                 raise
-        html_bin = brotli.compress(html.encode())
-        try:
-            title_content = self.db.crawl.find_one({'html': html_bin, 'title': {"$exists": True}, 'content': {'$exists': True}})
-        except: 
-            title_content = None
-        if title_content:
-            return title_content['title'], title_content['content']
-        # Require to be extracted next time
-        title, content = text_utils.extract_title_body(html, **kwargs)
-        if title == "" or content == "":
-            return title, content
-        try:
-            self.db.crawl.update_one({'html': html_bin}, {"$set": {'title': title, 'content': content}})
-        except Exception as e: tracer.warn(f'extract title content: {str(e)}')
+        def extract():
+            title, content = text_utils.extract_title_body(html, **kwargs)
+            # Require to be extracted next time
+            return (title, content), title != "" and content != ""
+        title, content = self._extraction(html, 'title_content', 'title_body', extract, crawl_fields=['title', 'content'])
         return title, content
-    
+
+    def snapshot_stats(self, html):
+        """
+        Stats of (boilerpipe) content of a snapshot, for choosing representative snapshots
+        Cached by html digest, so snapshots shared by URLs are only extracted once
+
+        Return: {'words': #words of content, 'content_digest': sha1 of content}
+        """
+        def extract():
+            # TODO: Domditiller vs Boilerpipe --> Acc vs Speed?
+            content = text_utils.extract_body(html, version='boilerpipe')
+            return {'words': len(content.split()), 'content_digest': hashlib.sha1(content.encode()).hexdigest()}, True
+        return self._extraction(html, 'snapshot_stats', 'boilerpipe', extract)
+
     def get_more_crawls(self, url, html=None, year_range=None, wayback=False):
         """
         Getting more samples from the same netloc_dir with url
@@ -514,29 +964,31 @@ class Memoizer:
 
         if html:
             outlinks = crawl.outgoing_links(url, html, wayback=wayback)
-            for outlink in outlinks:
-                ond = url_utils.netloc_dir(outlink)
-                if ond != nd or url_utils.url_match(outlink, url) or outlink in seen_urls:
-                    continue
-                if url_utils.na_url(outlink):
-                    continue
-                try:
-                    out_html = self.crawl(outlink)
-                    out_title = self.extract_title(out_html, version='mine', handle_exception=False)
-                    out_content = self.extract_content(out_html, handle_exception=False)
-                except: continue
-                tracer.debug(f"get_more_crawls: Got new sample from outlinks: {outlink} {out_title}")
-                new_crawl = {
-                    'url': outlink,
-                    'html': out_html,
-                    'title': out_title,
-                    'content': out_content
-                }
-                new_crawls.append(new_crawl)
-                seen_urls.add(outlink)
-                # * Gather 2 data points should be sufficient
-                if len(new_crawls) > 1:
-                    return new_crawls
+            outlinks = [o for o in outlinks if url_utils.netloc_dir(o) == nd and not url_utils.url_match(o, url) \
+                            and not url_utils.na_url(o)]
+            outlinks = list(OrderedDict.fromkeys(outlinks))
+            i = 0
+            while i < len(outlinks):
+                # * Only crawl as many as samples still needed
+                batch = outlinks[i: i+min(MORE_CRAWLS_BATCH, MORE_CRAWLS_NEEDED - len(new_crawls))]
+                i += len(batch)
+                out_crawls = self.crawl_many(batch)
+                for outlink, out_html in out_crawls.items():
+                    try:
+                        out_title = self.extract_title(out_html, version='mine', handle_exception=False)
+                        out_content = self.extract_content(out_html, handle_exception=False)
+                    except: continue
+                    tracer.debug(f"get_more_crawls: Got new sample from outlinks: {outlink} {out_title}")
+                    new_crawl = {
+                        'url': outlink,
+                        'html': out_html,
+                        'title': out_title,
+                        'content': out_content
+                    }
+                    new_crawls.append(new_crawl)
+                    seen_urls.add(outlink)
+                    if len(new_crawls) >= MORE_CRAWLS_NEEDED:
+                        return new_crawls
         
         url_prefix = ''.join(nd)
         if not year_range:
@@ -557,53 +1009,68 @@ class Memoizer:
             'collapse': 'urlkey',
             'limit': 100
         }
+        self._charge('cdx')
         wayback_urls, _ = crawl.wayback_index(url_prefix + '/*', param_dict=param, total_link=True)
         wayback_urls = [wu[1] for wu in wayback_urls if not url_utils.url_match(wu[1], url, wayback=wayback) and url_utils.netloc_dir(wu[1]) == nd]
         # * Also looking for its direct parent if no siblings is archived
         if len(wayback_urls) == 0:
+            self._charge('cdx')
             wayback_urls, _ = crawl.wayback_index(url_prefix, param_dict=param, total_link=True)
             wayback_urls = [wu[1] for wu in wayback_urls if not url_utils.url_match(wu[1], url, wayback=wayback)]
         if wayback:
             cand_urls = sorted(wayback_urls, key=lambda x: int(url_utils.get_ts(x)))
         else:
             cand_urls = [url_utils.filter_wayback(wu) for wu in wayback_urls]
-        for cand_url in cand_urls:
-            if cand_url in seen_urls or url_utils.url_match(url, cand_url):
-                continue
-            try:
-                cand_html = self.crawl(cand_url)
-                cand_title = self.extract_title(cand_html, version='mine', handle_exception=False)
-                cand_content = self.extract_content(cand_html, handle_exception=False)
-            except: continue
-            tracer.debug(f"get_more_crawls: Got new sample from wayback")
-            new_crawl = {
-                'url': cand_url,
-                'html': cand_html,
-                'title': cand_title,
-                'content': cand_content
-            }
-            new_crawls.append(new_crawl)
-            seen_urls.add(cand_url)
-            # * Gather 2 data points should be sufficient
-            if len(new_crawls) > 1:
-                return new_crawls
+        cand_urls = [c for c in cand_urls if c not in seen_urls and not url_utils.url_match(url, c)]
+        i = 0
+        while i < len(cand_urls):
+            # * Only crawl as many as samples still needed
+            batch = cand_urls[i: i+min(MORE_CRAWLS_BATCH, MORE_CRAWLS_NEEDED - len(new_crawls))]
+            i += len(batch)
+            cand_crawls = self.crawl_many(batch)
+            for cand_url, cand_html in cand_crawls.items():
+                if cand_url in seen_urls:
+                    continue
+                try:
+                    cand_title = self.extract_title(cand_html, version='mine', handle_exception=False)
+                    cand_content = self.extract_content(cand_html, handle_exception=False)
+                except: continue
+                tracer.debug(f"get_more_crawls: Got new sample from wayback")
+                new_crawl = {
+                    'url': cand_url,
+                    'html': cand_html,
+                    'title': cand_title,
+                    'content': cand_content
+                }
+                new_crawls.append(new_crawl)
+                seen_urls.add(cand_url)
+                if len(new_crawls) >= MORE_CRAWLS_NEEDED:
+                    return new_crawls
         
         # TODO: Implement search if necessary
         return new_crawls
 
 
 class Similar:
-    def __init__(self, use_db=True, db=None, corpus=[], threshold=0.8, short_threshold=None, corpus_size=10000):
+    def __init__(self, use_db=True, db=None, corpus=[], threshold=0.8, short_threshold=None, corpus_size=10000, model=None):
         """
         corpus_size: size of corpus to sample on: (0-250k)
+        model: Path of tfidf model built by fable.utils.tfidf_model. If None, config 'tfidf_model' (default {tmp_path}/tfidf_model)
+            Loaded if exists (and corpus is not given), instead of sampling corpus from db
         """
-        if not use_db and len(corpus) == 0:
+        tfidf = tfidf_model.load(model) if len(corpus) == 0 else None
+        if not use_db and len(corpus) == 0 and tfidf is None:
             raise Exception("Corpus is requred for tfidf if db is not set")
         self.use_db = use_db
         self.threshold = threshold
         self.short_threshold = short_threshold if short_threshold else self.threshold - 0.1
         if use_db:
             self.db =  config.new_db() if not db else db
+        if tfidf is not None:
+            tracer.debug(f'Similar: Loaded tfidf model {tfidf.meta["version"]}')
+            self.tfidf = tfidf
+        elif use_db:
+            tracer.warn('Similar: No tfidf model built (python -m fable.utils.tfidf_model build), sampling corpus')
             corpus = self.db.corpus.aggregate([
                 {'$match':  {'$or': [{'src': 'realweb'}, {'usage': re.compile('represent')}]}},
                 {'$project': {'content': True}},
@@ -616,6 +1083,18 @@ class Similar:
             self.tfidf = text_utils.TFidfStatic(corpus)
         self.site = None
         self.separable = None
+        self.init_count = 0 # * Number of times title index is built
+        self._lock = threading.RLock() # * Guard title structures shared with forks
+
+    def fork(self):
+        """
+        Shallow copy for using from another thread
+        Title structures (and the fitted corpus) are shared, tfidf workingset and separable are not
+        """
+        forked = copy.copy(self)
+        forked.tfidf = copy.copy(self.tfidf)
+        forked.tfidf._clear_workingset()
+        return forked
 
     def match_url_sig(self, old_linked_sig, new_sigs):
         """
@@ -636,15 +1115,19 @@ class Similar:
             for s in sig:
                 if s != '': corpus.append(s)
         self.tfidf.add_corpus(corpus)
-        for lws in new_sigs:
+        # * Anchors: 1 x N, sigs: (old sigs) x (all new sigs), each link takes max over its own columns
+        anchor_simi = self.tfidf.similar_many(old_linked_sig[1], [anchor for _, anchor, _ in new_sigs])
+        all_nsigs = [nsig for _, _, sig in new_sigs for nsig in sig]
+        sig_grid = self.tfidf.similar_matrix(list(old_linked_sig[2]), all_nsigs) if len(old_linked_sig[2]) > 0 and len(all_nsigs) > 0 else None
+        col = 0
+        for i, lws in enumerate(new_sigs):
             link, anchor, sig = lws
             link = url_utils.filter_wayback(link)
-            simi = self.tfidf.similar(old_linked_sig[1], anchor)
-            anchor_simis[link].append((link, anchor, simi))
+            anchor_simis[link].append((link, anchor, anchor_simi[i]))
             sig_simi = 0
-            for osig in old_linked_sig[2]:
-                for nsig in sig:
-                    sig_simi = max(self.tfidf.similar(osig, nsig), sig_simi)
+            if sig_grid is not None and len(sig) > 0:
+                sig_simi = max(sig_grid[:, col:col+len(sig)].max(), sig_simi)
+            col += len(sig)
             sig_simis[link].append((link, sig, sig_simi))
         simis["anchor"] = {k: max(v, key=lambda x: x[2]) for k, v in anchor_simis.items()}
         simis["sig"] = {k: max(v, key=lambda x: x[2]) for k, v in sig_simis.items()}
@@ -663,8 +1146,8 @@ class Similar:
         if init:
             self.tfidf._clear_workingset()
             self.tfidf.add_corpus([target_content] + candidates_contents)
-        for c in candidates_contents:
-            simi = self.tfidf.similar(target_content, c)
+        simis = self.tfidf.similar_many(target_content, candidates_contents)
+        for c, simi in zip(candidates_contents, simis):
             if simi > max_simi:
                 max_simi = simi
                 max_content = c
@@ -686,6 +1169,7 @@ class Similar:
             return False
         new_site = he.extract(new_site)
         self.site = (site, new_site)
+        self.init_count += 1
         tracer.info(f'_init_titles {self.site}')
         # self.lw_titles = defaultdict(set) # *{title: set(path)}
         # self.wb_titles = defaultdict(set)
@@ -726,7 +1210,7 @@ class Similar:
                         'site': site, 
                         '_id': new_url, 
                         'url': new_url, 
-                        'html': brotli.compress(html.encode()),
+                        **memo.codec.compress(html, site=site),
                         'title': title,
                         'content': content
                     })
@@ -793,44 +1277,45 @@ class Similar:
 
     def _add_crawl(self, url, title, content, html=None):
         """Add new crawls into similar comparison"""
-        is_wayback = 'web.archive.org/web' in url
-        if is_wayback and url_norm(url_utils.filter_wayback(url)) in self.wb_seen:
-            return
-        elif not is_wayback and url_norm(url) in self.lw_seen:
-            return
-        elif not title:
-            return
-        if is_wayback:
-            ts, url = url_utils.get_ts(url), url_utils.filter_wayback(url)
-        nd = url_utils.netloc_dir(url)
-        toadd = {
-            'url': url,
-            'html': html,
-            'title': title,
-            'content': content,
-            'netloc_dir': nd
-        }
-        if is_wayback:
-            toadd.update({'ts': ts})
-            self.wb_titles[title].append(toadd)
-            nd_idx = bisect.bisect_left(self.wb_meta, [nd, []])
-            if nd_idx >= len(self.wb_meta) or self.wb_meta[nd_idx][0] != nd:
-                self.wb_meta.insert(nd_idx, [nd, [toadd]])
-            else:
-                tss = [int(obj['ts']) for obj in self.wb_meta[nd_idx][1]]
-                ts_idx = bisect.bisect_right(tss, int(ts))
-                self.wb_meta[nd_idx][1].insert(ts_idx, toadd)
-            self.wb_seen.add(url_norm(url))
-        else:
-            self.lw_titles[title].append(toadd)
-            nd_idx = bisect.bisect_left(self.lw_meta, [nd, []])
-            if nd_idx >= len(self.lw_meta) or self.lw_meta[nd_idx][0] != nd:
-                self.lw_meta.insert(nd_idx, [nd, [toadd]])
+        with self._lock:
+            is_wayback = 'web.archive.org/web' in url
+            if is_wayback and url_norm(url_utils.filter_wayback(url)) in self.wb_seen:
+                return
+            elif not is_wayback and url_norm(url) in self.lw_seen:
+                return
+            elif not title:
+                return
+            if is_wayback:
+                ts, url = url_utils.get_ts(url), url_utils.filter_wayback(url)
+            nd = url_utils.netloc_dir(url)
+            toadd = {
+                'url': url,
+                'html': html,
+                'title': title,
+                'content': content,
+                'netloc_dir': nd
+            }
+            if is_wayback:
+                toadd.update({'ts': ts})
+                self.wb_titles[title].append(toadd)
+                nd_idx = bisect.bisect_left(self.wb_meta, [nd, []])
+                if nd_idx >= len(self.wb_meta) or self.wb_meta[nd_idx][0] != nd:
+                    self.wb_meta.insert(nd_idx, [nd, [toadd]])
+                else:
+                    tss = [int(obj['ts']) for obj in self.wb_meta[nd_idx][1]]
+                    ts_idx = bisect.bisect_right(tss, int(ts))
+                    self.wb_meta[nd_idx][1].insert(ts_idx, toadd)
+                self.wb_seen.add(url_norm(url))
             else:
-                titles = [obj['title'] for obj in self.lw_meta[nd_idx][1]]
-                title_idx = bisect.bisect_right(titles, toadd['title'])
-                self.lw_meta[nd_idx][1].insert(title_idx, toadd)
-            self.lw_seen.add(url_norm(url))
+                self.lw_titles[title].append(toadd)
+                nd_idx = bisect.bisect_left(self.lw_meta, [nd, []])
+                if nd_idx >= len(self.lw_meta) or self.lw_meta[nd_idx][0] != nd:
+                    self.lw_meta.insert(nd_idx, [nd, [toadd]])
+                else:
+                    titles = [obj['title'] for obj in self.lw_meta[nd_idx][1]]
+                    title_idx = bisect.bisect_right(titles, toadd['title'])
+                    self.lw_meta[nd_idx][1].insert(title_idx, toadd)
+                self.lw_seen.add(url_norm(url))
 
     def shorttext_match(self, text1, text2):
         """
@@ -858,6 +1343,26 @@ class Similar:
         simi = self.tfidf.similar(text1, text2)
         # tracer.debug(f'shorttext_match: simi between "{text1}" vs. "{text2}": {simi}')
         return simi
+
+    def shorttext_match_many(self, text, candidates):
+        """
+        shorttext_match of text with each of candidates, similarities in one batch
+
+        Returns: [similarity] (0 if not match)
+        """
+        if len(candidates) == 0:
+            return []
+        tokenize = lambda t: set(text_utils.tokenize(t) if isinstance(t, str) else t)
+        text_token = tokenize(text)
+        subset = []
+        for c in candidates:
+            c_token = tokenize(c)
+            subset.append(text_token <= c_token or c_token <= text_token)
+            if not subset[-1]:
+                tracer.debug(f'shorttext_match: one text not a subset of another: "{text}" vs. "{c}"')
+        matched = [c for c, sub in zip(candidates, subset) if sub]
+        simis = iter(self.tfidf.similar_many(text, matched)) if len(matched) > 0 else iter([])
+        return [next(simis) if sub else 0 for sub in subset]
         
     def _is_title_unique(self, url, title, content, wayback=False):
         """
@@ -882,7 +1387,7 @@ class Similar:
                         continue
                     # TODO: Can actually also compare content to not consider canonical here
                     if not url_utils.url_match(lw_url, site_crawl['url']) and \
-                            text_utils.k_shingling(content, site_crawl.get('content', '')) < 0.9:
+                            not content_near_duplicate(content, site_crawl, 0.9, db=self.db if self.use_db else None):
                         tracer.debug(f"_is_title_unique: title {title} is not unique amoung site with {site_crawl['url']}")
                         return False
             return True
@@ -913,7 +1418,7 @@ class Similar:
             for more_crawl in more_crawls:
                 self._add_crawl(more_crawl['url'], more_crawl['title'], more_crawl['content'], more_crawl['html'])
         site_url_meta = self.lw_meta if not wayback else self.wb_meta
-        return unique_title(url, title, content, site_url_meta, wayback)
+        return unique_title(url, title, content, site_url_meta, wayback, db=self.db if self.use_db else None)
 
     def title_similar(self, target_url, target_title, target_content, candidates_titles, candidates_contents, shorttext=True, fixed=True):
         """
@@ -934,12 +1439,13 @@ class Similar:
 
         self.tfidf._clear_workingset()
         # * Extract Unique Titles for both wb urls and lw urls
-        tgt_uniq_title = unique_title(target_url, target_title, target_content, self.wb_meta, wayback=True)
-        cand_uniq_titles = {url: unique_title(url, title, candidates_contents.get(url, ''), self.lw_meta, wayback=False) \
+        db = self.db if self.use_db else None
+        tgt_uniq_title = unique_title(target_url, target_title, target_content, self.wb_meta, wayback=True, db=db)
+        cand_uniq_titles = {url: unique_title(url, title, candidates_contents.get(url, ''), self.lw_meta, wayback=False, db=db) \
              for url, title in candidates_titles.items()}
         self.tfidf.add_corpus([tgt_uniq_title] + [ct for ct in cand_uniq_titles.values()])
 
-        simi_cand = []
+        uniq_cands = []
         for url in cand_uniq_titles:
             c, uniq_c = candidates_titles[url], cand_uniq_titles[url]
             site = he.extract(url)
@@ -948,10 +1454,13 @@ class Similar:
             if not self._is_title_unique(url, c, candidates_contents.get(url, ''), wayback=False):
                 tracer.debug(f"title_similar: cand_url's title '{c}' is not unique")
                 continue
-            if shorttext:
-                simi = self.shorttext_match(tgt_uniq_title, uniq_c)
-            else:
-                simi = self.tfidf.similar(tgt_uniq_title, uniq_c)
+            uniq_cands.append((url, uniq_c))
+        if shorttext:
+            simis = self.shorttext_match_many(tgt_uniq_title, [uniq_c for _, uniq_c in uniq_cands])
+        else:
+            simis = self.tfidf.similar_many(tgt_uniq_title, [uniq_c for _, uniq_c in uniq_cands])
+        simi_cand = []
+        for (url, _), simi in zip(uniq_cands, simis):
             tracer.debug(f'similarity title, (value/url): ({simi}/{url})')
             simi_cand.append((url, simi))
         
@@ -969,8 +1478,8 @@ class Similar:
         self.tfidf._clear_workingset()
         self.tfidf.add_corpus([target_content] + list(candidates_contents.values()))
         simi_cand = []
-        for url, c in candidates_contents.items():
-            simi = self.tfidf.similar(target_content, c)
+        simis = self.tfidf.similar_many(target_content, list(candidates_contents.values()))
+        for url, simi in zip(candidates_contents, simis):
             tracer.debug(f'similarity content, (value/url): ({simi}/{url})')
             simi_cand.append((url, simi))
         
@@ -991,8 +1500,8 @@ class Similar:
                     more_crawls = memo.get_more_crawls(cand, html, year_range=('20210101', '20211231'))
                     more_contents = {c['url']: c['content'] for c in more_crawls}
                     self.tfidf.add_corpus([target_content] + list(more_contents.values()))
-                    for u, c in more_contents.items():
-                        u_simi = self.tfidf.similar(target_content, c)
+                    u_simis = self.tfidf.similar_many(target_content, list(more_contents.values()))
+                    for u, u_simi in zip(more_contents, u_simis):
                         simi_cand.append((u, u_simi))
         
         return sorted(simi_cand, key=lambda x: x[1], reverse=True)
@@ -1010,14 +1519,19 @@ class Similar:
             all_tokens += tokens
         self.tfidf._clear_workingset()
         self.tfidf.add_corpus(all_tokens)
+        # * All candidates' tokens scored in one batch, then each candidate takes its max
+        flat_tokens = all_tokens[1:]
+        if shorttext:
+            flat_simis = self.shorttext_match_many(target_token, flat_tokens)
+        else:
+            flat_simis = self.tfidf.similar_many(target_token, flat_tokens)
         simi_cand = []
+        i = 0
         for can, tokens in candidates_tokens.items():
             max_token = (can, 0, '')
             for t in tokens:
-                if shorttext:
-                    simi = self.shorttext_match(target_token, t)
-                else:
-                    simi = self.tfidf.similar(target_token, t)
+                simi = flat_simis[i]
+                i += 1
                 tracer.debug(f'similarity title, (value/url): ({simi}/{target_token} vs. {t})')
                 if simi > max_token[1]:
                     max_token = (can, simi, t)
@@ -1122,7 +1636,7 @@ def is_canonical(url1, url2, resp1=None, resp2=None):
         content2 = soup2.get_text(separator=' ')
     except:
         content2 = resp2.text
-    if text_utils.k_shingling(text_norm(content1), text_norm(content2)) >= 0.95:
+    if text_utils.near_duplicate(text_norm(content1), text_norm(content2), 0.95):
         return True
     return False
 
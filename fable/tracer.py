@@ -4,24 +4,35 @@ Global tracer for recording the metadata gathered during finding aliases
 import re, os, sys
 from collections import defaultdict
 import logging
+import threading
 import inspect
 
 from . import config
 
-db = config.DB
-
 default_name = 'fable'
 
 class tracer(logging.Logger):
-    def __init__(self, name=default_name, db=db):
+    def __init__(self, name=default_name, db=None):
         """
         name: name of the trace
-        update_data: {url: update data} for updating the database
+        db: db to update traces into. If None, config.DB (connected on first use)
+        update_data: {url: update data} for updating the database. Each thread has its own
         """
         logging.Logger.__init__(self, name)
         self.name = name
-        self.db = db
-        self.update_data = defaultdict(dict)
+        self._db = db
+        self._local = threading.local()
+
+    @property
+    def update_data(self):
+        # * Scoped per thread, so that finders running in different threads don't mix (or flush) each other's traces
+        if not hasattr(self._local, 'update_data'):
+            self._local.update_data = defaultdict(dict)
+        return self._local.update_data
+
+    @update_data.setter
+    def update_data(self, update_data):
+        self._local.update_data = update_data
     
     def _init_logger(self, loglevel):
         """
@@ -38,10 +49,24 @@ class tracer(logging.Logger):
         self.addHandler(std_handler)
         # return logger
     
-    def _set_meta(self, attr_name, logname=None, db=db, loglevel=logging.INFO):
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = config.DB
+        return self._db
+
+    @db.setter
+    def db(self, db):
+        self._db = db
+
+    def _set_meta(self, attr_name, logname=None, db=None, loglevel=logging.INFO):
         self.attr_name = attr_name
         self.logname = logname if logname else self.attr_name
         self.db = db
+        # * Setting meta again replaces the handlers, instead of stacking duplicates
+        for handler in self.handlers:
+            handler.close()
+        self.handlers = []
         self._init_logger(loglevel=loglevel)
     
     def _unset_meta(self):
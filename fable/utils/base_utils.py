@@ -5,6 +5,7 @@ from subprocess import call, check_output, Popen
 from .. import config
 import os, re, sys
 import signal
+from urllib import request
 
 
 NULL = open('/dev/null', 'w')
@@ -26,6 +27,14 @@ class timeout:
 
 tmp_path = config.TMP_PATH
 port = config.LOCALSERVER_PORT
+
+def _serving_domdistiller(PORT):
+    """Whether the local server at PORT already serves domdistiller.js (e.g. started by another worker)"""
+    try:
+        return request.urlopen(f'http://localhost:{PORT}/domdistiller.js', timeout=2).status == 200
+    except:
+        return False
+
 def localserver(PORT):
     """
     Create tmp dir at $PROJ_HOME, copy domdistiller.js into the repo
@@ -36,6 +45,8 @@ def localserver(PORT):
     if not os.path.exists(os.path.join(tmp_path, 'utils', 'domdistiller.js')):
         call(['cp', os.path.join(cur_path, 'domdistiller.js'), tmp_path])
     port_occupied = re.compile(":{}".format(port)).findall(check_output(['netstat', '-nlt']).decode())
+    if len(port_occupied) > 0 and _serving_domdistiller(port):
+        return
     if len(port_occupied) > 0:
         # * Try kill http-server once 
         call(['pkill', 'http-server'])
@@ -0,0 +1,240 @@
+"""
+Codecs of html stored in db.crawl
+Each crawl doc records its codec ("codec" field, missing means brotli), so docs written with different codecs all read.
+zstd can use dictionaries trained on stored pages (per site, or global), which share boilerplate across pages of a site.
+Dictionaries live in db.zstd_dicts. Retraining adds a new dictionary (new docs use the latest one), old ones are kept for docs compressed with them
+
+Train dictionaries: python -m fable.utils.codec train [--sites a.com b.com] [--recompress]
+Benchmark codecs on stored pages: python benchmarks/bench_codec.py [--samples 2000]
+"""
+import time
+import argparse
+import threading
+import brotli
+from collections import defaultdict
+
+from .. import config, tracer
+
+import logging
+logging.setLoggerClass(tracer.tracer)
+tracer = logging.getLogger('logger')
+logging.setLoggerClass(logging.Logger)
+
+CODECS = ['brotli', 'zstd']
+ZSTD_LEVEL = 3
+DICT_SIZE = 112 * 1024 # * Bytes of a trained dictionary
+DICT_SAMPLES = 500 # * Max pages sampled to train one dictionary
+MIN_DICT_SAMPLES = 20 # * Sites with fewer stored pages use the global dictionary
+GLOBAL_DICT = 'global'
+
+
+def _zstd():
+    import zstandard
+    return zstandard
+
+
+class HtmlCodec:
+    def __init__(self, codec=None, db=None, level=ZSTD_LEVEL, use_dict=True):
+        """
+        codec: Codec for new docs (brotli/zstd). If None, config 'crawl_codec' (default brotli)
+        db: db with zstd_dicts collection. If None, config.DB (on first use)
+        use_dict: Whether zstd uses trained dictionaries (site's, else global) when available
+        """
+        codec = codec or config.config('crawl_codec') or 'brotli'
+        if codec == 'zstd':
+            try:
+                _zstd()
+            except ImportError:
+                tracer.warn('HtmlCodec: zstandard is not installed, use brotli')
+                codec = 'brotli'
+        assert(codec in CODECS)
+        self.codec = codec
+        self.level = level
+        self.use_dict = use_dict
+        self.db = db
+        self._lock = threading.Lock()
+        self._dicts = {} # * {dict_id: zstandard.ZstdCompressionDict or None (not exists)}
+        self._latest = {} # * {key (site:{site} or global): latest dict_id or None}
+        self._local = threading.local() # * (De)compressors are not thread-safe
+
+    def _db(self):
+        if self.db is None:
+            self.db = config.DB
+        return self.db
+
+    def _dict(self, dict_id):
+        """Return: ZstdCompressionDict of dict_id, None if not exists"""
+        with self._lock:
+            if dict_id in self._dicts:
+                return self._dicts[dict_id]
+        try:
+            doc = self._db().zstd_dicts.find_one({'_id': dict_id})
+        except Exception as e:
+            tracer.warn(f'HtmlCodec: {str(e)}')
+            doc = None
+        d = _zstd().ZstdCompressionDict(doc['data']) if doc else None
+        with self._lock:
+            self._dicts[dict_id] = d
+        return d
+
+    def _latest_dict_id(self, key):
+        """Return: Latest dict_id trained for key, None if not exists"""
+        with self._lock:
+            if key in self._latest:
+                return self._latest[key]
+        try:
+            doc = self._db().zstd_dicts.find_one({'key': key}, {'_id': True}, sort=[('created', -1)])
+        except Exception as e:
+            tracer.warn(f'HtmlCodec: {str(e)}')
+            doc = None
+        with self._lock:
+            self._latest[key] = doc['_id'] if doc else None
+        return self._latest[key]
+
+    def _site_dict_id(self, site):
+        """Return: dict_id to compress pages of site with, None if no dictionary"""
+        if not self.use_dict:
+            return None
+        for key in [f'site:{site}', GLOBAL_DICT] if site else [GLOBAL_DICT]:
+            dict_id = self._latest_dict_id(key)
+            if dict_id is not None:
+                return dict_id
+        return None
+
+    def _compressor(self, dict_id):
+        compressors = getattr(self._local, 'compressors', None)
+        if compressors is None:
+            compressors = self._local.compressors = {}
+        if dict_id not in compressors:
+            zstd = _zstd()
+            d = self._dict(dict_id) if dict_id else None
+            compressors[dict_id] = zstd.ZstdCompressor(level=self.level, dict_data=d) if d else zstd.ZstdCompressor(level=self.level)
+        return compressors[dict_id]
+
+    def _decompressor(self, dict_id):
+        decompressors = getattr(self._local, 'decompressors', None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        if dict_id not in decompressors:
+            zstd = _zstd()
+            d = self._dict(dict_id) if dict_id else None
+            if dict_id and d is None:
+                raise ValueError(f'zstd dictionary {dict_id} not found')
+            decompressors[dict_id] = zstd.ZstdDecompressor(dict_data=d) if d else zstd.ZstdDecompressor()
+        return decompressors[dict_id]
+
+    def compress(self, html, site=None):
+        """
+        site: Site of the page, to pick its dictionary
+
+        Return: fields of crawl doc {'html', 'codec', ('dict_id')}
+        """
+        if self.codec == 'brotli':
+            return {'html': brotli.compress(html.encode()), 'codec': 'brotli'}
+        dict_id = self._site_dict_id(site)
+        fields = {'html': self._compressor(dict_id).compress(html.encode()), 'codec': 'zstd'}
+        if dict_id: fields['dict_id'] = dict_id
+        return fields
+
+    def decompress(self, doc):
+        """
+        doc: crawl doc (with html, codec, dict_id)
+
+        Return: html
+        """
+        codec = doc.get('codec', 'brotli')
+        if codec == 'brotli':
+            return brotli.decompress(doc['html']).decode()
+        elif codec == 'zstd':
+            return self._decompressor(doc.get('dict_id')).decompress(doc['html']).decode()
+        raise ValueError(f'Unknown codec {codec}')
+
+    def train(self, htmls, key, size=DICT_SIZE):
+        """
+        Train a zstd dictionary on htmls, as the latest one of key (site:{site} or global)
+
+        Return: dict_id
+        """
+        zstd = _zstd()
+        samples = [h.encode() for h in htmls]
+        d = zstd.train_dictionary(size, samples, level=self.level)
+        created = time.time()
+        dict_id = f'{key}:{int(created * 1000)}'
+        self._db().zstd_dicts.insert_one({'_id': dict_id, 'key': key, 'data': d.as_bytes(), 'samples': len(samples), 'created': created})
+        with self._lock:
+            self._dicts[dict_id] = d
+            self._latest[key] = dict_id
+        return dict_id
+
+
+def sample_htmls(db, c, site=None, limit=DICT_SAMPLES):
+    """Return: [html] of sampled crawls of site (any site if None)"""
+    query = {'html': {'$exists': True}}
+    if site: query['site'] = site
+    htmls = []
+    for doc in db.crawl.aggregate([{'$match': query}, {'$sample': {'size': limit}}], allowDiskUse=True):
+        try:
+            htmls.append(c.decompress(doc))
+        except Exception as e:
+            tracer.debug(f'sample_htmls: {str(e)}')
+    return htmls
+
+
+def train_dictionaries(db, sites=None, recompress=False, size=DICT_SIZE):
+    """
+    Train the global dictionary, and per site dictionaries for sites with enough stored pages
+    sites: Sites to train on. If None, all sites in db.crawl
+    recompress: Also rewrite crawls of these sites with zstd + their dictionaries
+    """
+    c = HtmlCodec(codec='zstd', db=db)
+    def train(htmls, key):
+        try:
+            print(f'{c.train(htmls, key, size=size)}: trained on {len(htmls)} pages')
+        except Exception as e:
+            tracer.warn(f'train_dictionaries: Cannot train {key}: {str(e)}')
+    htmls = sample_htmls(db, c)
+    if len(htmls) >= MIN_DICT_SAMPLES:
+        train(htmls, GLOBAL_DICT)
+    all_sites = sites is None
+    if all_sites:
+        counts = defaultdict(int)
+        for doc in db.crawl.find({}, {'site': True}):
+            counts[doc.get('site')] += 1
+        sites = [s for s, count in counts.items() if s and count >= MIN_DICT_SAMPLES]
+    for site in sites:
+        htmls = sample_htmls(db, c, site=site)
+        if len(htmls) < MIN_DICT_SAMPLES:
+            continue
+        train(htmls, f'site:{site}')
+    if not recompress:
+        return
+    import pymongo
+    query = {} if all_sites else {'site': {'$in': sites}}
+    ops = []
+    for doc in db.crawl.find(query, {'html': True, 'codec': True, 'dict_id': True, 'site': True}):
+        try:
+            fields = c.compress(c.decompress(doc), site=doc.get('site'))
+        except Exception as e:
+            tracer.debug(f'train_dictionaries: {str(e)}')
+            continue
+        update = {'$set': fields}
+        if 'dict_id' not in fields: update['$unset'] = {'dict_id': ''}
+        ops.append(pymongo.UpdateOne({'_id': doc['_id']}, update))
+        if len(ops) >= 1000:
+            db.crawl.bulk_write(ops, ordered=False)
+            ops = []
+    if len(ops) > 0:
+        db.crawl.bulk_write(ops, ordered=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train zstd dictionaries for html in db.crawl')
+    parser.add_argument('command', choices=['train'])
+    parser.add_argument('--sites', nargs='*', default=None, help='Sites to train dictionaries for. Default: all sites with enough crawls')
+    parser.add_argument('--size', type=int, default=DICT_SIZE, help='Bytes of each dictionary')
+    parser.add_argument('--recompress', action='store_true', help='Rewrite crawls with zstd and the trained dictionaries')
+    args = parser.parse_args()
+    train_dictionaries(config.DB, sites=args.sites, recompress=args.recompress, size=args.size)
+
+if __name__ == '__main__':
+    main()
@@ -31,6 +31,7 @@ sys.path.append('../')
 from .. import config
 from .. import tracer
 from .url_utils import filter_wayback, is_prefix
+from .singleflight import SingleFlight
 
 import logging
 # if not isinstance(logging.getLoggerClass(), tracer.tracer):
@@ -115,6 +116,7 @@ class RobotParser:
         return allow
 
 rp = RobotParser()
+cdx_flight = SingleFlight()
 
 
 def chrome_crawl(url, timeout=120, screenshot=False, ID='', proxy=None):
@@ -158,11 +160,19 @@ def chrome_crawl(url, timeout=120, screenshot=False, ID='', proxy=None):
 def wayback_index(url, param_dict={}, wait=True, total_link=False, proxies={}):
     """
     Get the wayback machine index of certain url by querying the CDX
+    Concurrent queries with the same url & params (in this process) are coalesced into one
     wait: wait unitl not getting block
     total_link: Returned url are in full(wayback) links
 
     return: ( [(timestamp, url, stauts_code)], SUCCESS/EMPTY/ERROR_MSG)
     """
+    key = json.dumps(['cdx', url, param_dict, wait, total_link], sort_keys=True, default=str)
+    r, status = cdx_flight.do(key, lambda: _wayback_index(url, param_dict=param_dict, wait=wait, total_link=total_link, proxies=proxies))
+    # * Callers could modify the list in place
+    return list(r), status
+
+
+def _wayback_index(url, param_dict={}, wait=True, total_link=False, proxies={}):
     wayback_home = 'http://web.archive.org/web/'
     params = {
         'output': 'json',
@@ -282,25 +292,29 @@ def alternative_request(url, timeout=15):
         r._content = response.read()
         return r
 
-def requests_crawl(url, timeout=20, wait=True, html=True, proxies={}, raw=False):
+def requests_crawl(url, timeout=20, wait=True, html=True, proxies={}, raw=False, headers={}, failure=None):
     """
     Use requests to get the page
     Return None if fails to get the content
     html: Only return html if set to true
     wait: Will wait if get block
     raw: Return raw response instead of html if set to True
+    headers: Extra request headers (e.g. If-None-Match). A 304 response is returned as is if raw
+    failure: dict. If the crawl fails in a way worth remembering (see negative_cache), failure is set to {'kind', 'reason'}
+        kind: transport (timeout, connection error, 408/429/5xx), http (other 4xx), robots, non_html
 
     Return:
         If good crawl: str/response
         Elif bad crawl: None
         Else (not applicable): (None, Reason)
     """
-    requests_header = {'user-agent': config.config('user_agent')}
+    requests_header = {'user-agent': config.config('user_agent'), **headers}
     filter_ext = ['.pdf']
     if os.path.splitext(url)[1] in filter_ext: 
         return None, 'Filtered ext'
     count = 0
     if not rp.allowed(url, requests_header['user-agent']):
+        if failure is not None: failure.update({'kind': 'robots', 'reason': 'Not Allowed by Robot.txt'})
         return None, "Not Allowed by Robot.txt"
     while True:
         try:
@@ -317,6 +331,7 @@ def requests_crawl(url, timeout=20, wait=True, html=True, proxies={}, raw=False)
                 proxies = {}
             else:
                 logger.warn(f"There is an ConnectionError exception with requests_crawl")
+                if failure is not None: failure.update({'kind': 'transport', 'reason': 'ConnectionError'})
                 return
         except requests.exceptions.TooManyRedirects:
             logger.warn(f'requests too many redirects, try alternative crawl')
@@ -324,18 +339,34 @@ def requests_crawl(url, timeout=20, wait=True, html=True, proxies={}, raw=False)
                 r = alternative_request(url, timeout=timeout)
                 break
             except Exception as e:
+                if failure is not None: failure.update({'kind': 'transport', 'reason': 'TooManyRedirects'})
                 return
+        except requests.exceptions.Timeout:
+            logger.warn(f"Timeout with requests_crawl")
+            if failure is not None: failure.update({'kind': 'transport', 'reason': 'Timeout'})
+            return
         except Exception as e:
             logger.warn(f"There is an exception with requests_crawl: {str(e)}")
+            if failure is not None and isinstance(e, requests.exceptions.RequestException):
+                failure.update({'kind': 'transport', 'reason': type(e).__name__})
             return
+    if r.status_code == 304:
+        # * Not modified since the validators in headers
+        logger.debug(f'requests_crawl: {url} not modified')
+        return r if raw else None
     if r.status_code >= 400:
         if r.status_code in [401, 403, 404]: logger.debug(f'requests_crawl: {url} Get status code {r.status_code}')
+        if failure is not None:
+            # * Rate limits and server errors are transient
+            kind = 'transport' if r.status_code >= 500 or r.status_code in [408, 429] else 'http'
+            failure.update({'kind': kind, 'reason': f'HTTP {r.status_code}'})
         return
     logger.debug(f'requests_crawl: got response {url}')
     headers = {k.lower(): v.lower() for k, v in r.headers.items()}
     content_type = headers['content-type'] if 'content-type' in headers else ''
     if html and 'html' not in content_type:
         logger.debug('requests_crawl: No html in content-type')
+        if failure is not None: failure.update({'kind': 'non_html', 'reason': 'Not HTML'})
         return
     try:
         r.encoding = r.apparent_encoding
@@ -10,6 +10,9 @@ db = config.DB
 
 db.crawl.create_index([('html', pymongo.HASHED)])
 db.crawl.create_index([('site', pymongo.ASCENDING), ('url', pymongo.ASCENDING)], unique=True)
+db.crawl.create_index([('digest', pymongo.ASCENDING)])
+
+db.extractions.create_index([('digest', pymongo.ASCENDING)])
 
 
 db.searched.create_index([('query', pymongo.ASCENDING), ('engine', pymongo.ASCENDING)])
@@ -19,4 +22,23 @@ db.wayback_rep.create_index([('site', pymongo.ASCENDING), ('url', pymongo.ASCEND
 
 db.wayback_index.create_index([('url', pymongo.ASCENDING)], unique=True)
 
-db.traces.create_index([('url', pymongo.ASCENDING)], unique=True)
\ No newline at end of file
+db.traces.create_index([('url', pymongo.ASCENDING)], unique=True)
+
+def backfill_digest(batch=1000):
+    """Add digest to crawls stored before extractions were content-addressed"""
+    from fable.tools import html_digest
+    from fable.utils.codec import HtmlCodec
+    c = HtmlCodec(db=db)
+    ops = []
+    for doc in db.crawl.find({'digest': {'$exists': False}, 'html': {'$exists': True}}, {'html': True, 'codec': True, 'dict_id': True}):
+        try:
+            html = c.decompress(doc)
+        except: continue
+        ops.append(pymongo.UpdateOne({'_id': doc['_id']}, {'$set': {'digest': html_digest(html)}}))
+        if len(ops) >= batch:
+            db.crawl.bulk_write(ops, ordered=False)
+            ops = []
+    if len(ops) > 0:
+        db.crawl.bulk_write(ops, ordered=False)
+
+backfill_digest()
@@ -0,0 +1,127 @@
+"""
+Negative cache of failed/blocked crawls
+URLs that failed recently are not requested again until the entry expires. Each kind of failure has its own TTL:
+    transport (timeouts, connection errors, 408/429/5xx) is likely transient and expires soon,
+    http (other 4xx, e.g. 404 of dead search results and inferred URLs), robots and non_html rarely change and are kept longer.
+Each caller has its own namespace (e.g. crawl, status), so a failure only replays the result its own caller produced.
+Entries are kept in memory and in db.crawl_failed, so that other processes also skip them. Lookups that miss are also kept in memory for a short while
+"""
+import time
+import threading
+from collections import OrderedDict
+
+from .. import config, tracer
+
+import logging
+logging.setLoggerClass(tracer.tracer)
+tracer = logging.getLogger('logger')
+logging.setLoggerClass(logging.Logger)
+
+NEGATIVE_TTLS = { # * Seconds a failure is remembered by kind, overwritten by config 'negative_cache_ttl'
+    'transport': 300,
+    'http': 3600,
+    'robots': 3600,
+    'non_html': 3600
+}
+MISS_TTL = 30 # * Seconds a lookup without failure is remembered (no db query)
+MAX_ENTRIES = 100000 # * Max entries kept in memory
+
+
+class NegativeCache:
+    def __init__(self, ttl=None, db=None, max_entries=MAX_ENTRIES):
+        """
+        ttl: Seconds a failure is remembered, either one number for all kinds or {kind: seconds}
+            If None, config 'negative_cache_ttl'. Kinds not given use NEGATIVE_TTLS
+        db: db with crawl_failed collection. If None, config.DB (on first use)
+        """
+        if ttl is None:
+            ttl = config.config('negative_cache_ttl')
+        if isinstance(ttl, dict):
+            self.ttls = {**NEGATIVE_TTLS, **ttl}
+        else:
+            self.ttls = {kind: ttl if ttl is not None else default for kind, default in NEGATIVE_TTLS.items()}
+        self.db = db
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # * {namespace:url: (reason or None if no failure, expire)}
+        self.hits = 0
+
+    def _db(self, db=None):
+        if db is not None:
+            return db
+        if self.db is None:
+            self.db = config.DB
+        return self.db
+
+    def get(self, url, db=None, namespace='crawl'):
+        """
+        db: db to look up crawl_failed in, instead of self.db
+        namespace: Caller of the request (crawl/status)
+
+        Return: reason if url failed recently, else None
+        """
+        now = time.time()
+        key = f'{namespace}:{url}'
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                del self._entries[key]
+                entry = None
+        if entry is None:
+            try:
+                doc = self._db(db).crawl_failed.find_one({'_id': key})
+            except Exception as e:
+                tracer.warn(f'NegativeCache: {str(e)}')
+                doc = None
+            if not doc or doc['ttl'] <= now:
+                self._remember(key, (None, now + min([MISS_TTL] + list(self.ttls.values()))))
+                return None
+            entry = (doc['reason'], doc['ttl'])
+            self._remember(key, entry)
+        if entry[0] is None:
+            return None
+        self.hits += 1
+        tracer.debug(f'NegativeCache: {url} failed recently: {entry[0]}')
+        return entry[0]
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, url, reason, db=None, namespace='crawl', kind='transport'):
+        """
+        Remember url failed with reason
+        reason: What the caller returns for url until the entry expires
+        kind: Kind of failure (transport/http/robots/non_html), decides the TTL
+        """
+        ttl = self.ttls.get(kind, self.ttls['transport'])
+        if ttl <= 0:
+            return
+        reason = str(reason)
+        key = f'{namespace}:{url}'
+        expire = time.time() + ttl
+        self._remember(key, (reason, expire))
+        try:
+            self._db(db).crawl_failed.update_one({'_id': key}, {'$set': {'url': url, 'namespace': namespace, 'kind': kind, 'reason': reason, 'ttl': expire}}, upsert=True)
+        except Exception as e:
+            tracer.warn(f'NegativeCache: {str(e)}')
+
+    def invalidate(self, url, db=None, namespace='crawl'):
+        key = f'{namespace}:{url}'
+        with self._lock:
+            self._entries.pop(key, None)
+        try:
+            self._db(db).crawl_failed.delete_one({'_id': key})
+        except Exception as e:
+            tracer.warn(f'NegativeCache: {str(e)}')
+
+
+negative_cache = None # * Shared in the process
+def get_negative_cache():
+    global negative_cache
+    if negative_cache is None:
+        negative_cache = NegativeCache()
+    return negative_cache
@@ -57,12 +57,13 @@ def get_title(html):
     return get_headers(html)
 
 
-def google_search(query, end=0, param_dict={}, site_spec_url=None, use_db=False):
+def google_search(query, end=0, param_dict={}, site_spec_url=None, use_db=False, budget=None):
     """
     Search using google
     If get 403, return None
     site_spec_url: If set, will only search within the site
     use_db: If set, will query db before calling API, and update results to db
+    budget: budget.Budget to charge API calls to (db hits are free)
     """
     google_query_dict = {
         "q": None,
@@ -73,6 +74,7 @@ def google_search(query, end=0, param_dict={}, site_spec_url=None, use_db=False)
     if site_spec_url:
         try:
             if '://' not in site_spec_url: site_spec_url = f'http://{site_spec_url}'
+            if budget is not None: budget.charge('crawl')
             r = requests.get(site_spec_url, headers=crawl.requests_header, timeout=10, proxies=bypass_proxy)
             site = host_extractor.extract(r.url)
             param_dict.update({'siteSearch': site})
@@ -87,6 +89,7 @@ def google_search(query, end=0, param_dict={}, site_spec_url=None, use_db=False)
             # print("Search hit on db")
             return result['results']
     while True:
+        if budget is not None: budget.charge('search')
         try:
             r = requests.get(google_url, params=google_query_dict, proxies=bypass_proxy)
             status_code = r.status_code
@@ -116,9 +119,10 @@ def google_search(query, end=0, param_dict={}, site_spec_url=None, use_db=False)
         return results
 
 
-def bing_search(query, end=0, param_dict={}, site_spec_url=None, use_db=False):
+def bing_search(query, end=0, param_dict={}, site_spec_url=None, use_db=False, budget=None):
     """
     Search using bing
+    budget: budget.Budget to charge API calls to (db hits are free)
     """
     bing_query_dict = {
         "q": None
@@ -132,6 +136,7 @@ def bing_search(query, end=0, param_dict={}, site_spec_url=None, use_db=False):
         if result is not None:
             # print("Search hit on db")
             return result['results']
+    if budget is not None: budget.charge('search')
     try:
         r = requests.get(bing_url, params=bing_query_dict, headers=headers, proxies=bypass_proxy)
         r = r.json()
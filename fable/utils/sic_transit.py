@@ -15,6 +15,7 @@ from bs4 import BeautifulSoup
 from fable import config
 from . import text_utils, url_utils, crawl
 from .crawl import rp 
+from .negative_cache import get_negative_cache
 import logging
 logger = logging.getLogger('logger')
 
@@ -34,14 +35,54 @@ def alternative_request(url, timeout=15):
         r._content = response.read()
         return r
 
-def send_request(url, timeout=15):
-    """Only fetch for response body when content-type is HTML"""
+TRANSPORT_ERRORS = ['ReadTimeout', 'Timeout', 'ConnectionError', 'ConnectionError_DNSLookupError', 'TooManyRedirects', 'RequestException']
+
+def _remember_response(url, resp):
+    """
+    Negative-cache a response that does not need its body to be judged: 4xx/5xx, or non-HTML
+    Stored as "HTTP {status} {content-type}", replayed by _replay_response
+    """
+    content_type = resp.headers.get('content-type', '')
+    if resp.status_code >= 400:
+        kind = 'transport' if resp.status_code >= 500 or resp.status_code in [408, 429] else 'http'
+    elif 'html' not in content_type.lower():
+        kind = 'non_html'
+    else:
+        return
+    get_negative_cache().put(url, f'HTTP {resp.status_code} {content_type}'.strip(), namespace='status', kind=kind)
+
+def _replay_response(url, reason):
+    """Return: Response with the status and content-type of the remembered response (no body)"""
+    _, status_code, content_type = (reason.split(' ', 2) + [''])[:3]
+    r = requests.Response()
+    r.status_code = int(status_code)
+    r.url = url
+    r.headers = {'content-type': content_type} if content_type else {}
+    r._content = b''
+    return r
+
+def send_request(url, timeout=15, budget=None, negative=True):
+    """
+    Only fetch for response body when content-type is HTML
+    budget: budget.Budget to charge the crawl to
+    negative: Whether to skip urls that failed recently (and remember such failures), see negative_cache
+        Transport errors are replayed as the same error, 4xx/5xx and non-HTML responses as a Response without body
+        Robots-disallowed urls are not remembered, as rp already caches robots.txt and is checked first
+    """
     resp = None
     requests_header = {'user-agent': config.config('user_agent')}
 
     req_failed = True
     if not rp.allowed(url, requests_header['user-agent']):
         return None, 'Not Allowed'
+    if negative:
+        reason = get_negative_cache().get(url, namespace='status')
+        if reason is not None and reason.startswith('HTTP '):
+            return _replay_response(url, reason), 'SUCCESSFUL'
+        elif reason is not None:
+            return None, reason
+    if budget is not None:
+        budget.charge('crawl')
     try:
         resp = requests.get(url, headers=requests_header, timeout=timeout, stream=True)
         # resp = requests.get(url, headers=requests_header, timeout=timeout, stream=True, verify=False)
@@ -83,8 +124,12 @@ def send_request(url, timeout=15):
         error_msg = 'ERROR_REQUEST_EXCEPTION_OCCURRED'
 
     if req_failed:
+        # * Only transport level failures are remembered, replayed as the same error_msg
+        if negative and error_msg in TRANSPORT_ERRORS:
+            get_negative_cache().put(url, error_msg, namespace='status')
         return resp, error_msg
-
+    if negative:
+        _remember_response(url, resp)
     return resp, 'SUCCESSFUL'
 
 
@@ -230,17 +275,18 @@ def text_norm(text):
 
 
 def broken(url, html=False, ignore_soft_404=False, ignore_soft_404_content=False,
-            redir_home=False):
+            redir_home=False, budget=None):
     """
     Entry func: detect whether this url is broken
     html: Require the url to be html.
     ignore_soft_404: Whether soft-404 detection will be ignored
     ignore_soft_404_content: Ignore only content comparison soft-404
     redir_home: If the redir is non-home page to homepage: consider wrong
+    budget: budget.Budget to charge requests to. Stop guessing random URLs once exhausted
 
     Return: True/False/"N/A", reason
     """
-    resp, msg = send_request(url)
+    resp, msg = send_request(url, budget=budget)
     if msg == 'Not Allowed':
         return 'N/A', msg
     status, _ = get_status(url, resp, msg)
@@ -281,7 +327,7 @@ def broken(url, html=False, ignore_soft_404=False, ignore_soft_404_content=False
     for random_url in random_urls:
         # print(random_url)
         # * If original request no timeout issue, so should be this one
-        random_resp, msg = send_request(random_url, timeout=15)
+        random_resp, msg = send_request(random_url, timeout=15, negative=False)
         if msg == 'Not Allowed':
             continue
         random_status, _ = get_status(random_url, random_resp, msg)
@@ -322,7 +368,7 @@ def broken(url, html=False, ignore_soft_404=False, ignore_soft_404_content=False
             try:
                 random_content = BeautifulSoup(random_resp.text, 'lxml').get_text(separator=' ')
             except: random_content = random_resp.text
-            if text_utils.k_shingling(text_norm(url_content), text_norm(random_content)) >= 0.9:
+            if text_utils.near_duplicate(text_norm(url_content), text_norm(random_content), 0.9):
                 # print(text_norm(url_content), text_norm(random_content))
                 broken_decision.append(True)
                 reasons.append("Similar soft 404 content")
@@ -330,6 +376,8 @@ def broken(url, html=False, ignore_soft_404=False, ignore_soft_404_content=False
         broken_decision.append(False)
         reasons.append("no features match")
         break
+    if len(reasons) == 0 and budget is not None and budget.exhausted():
+        return 'N/A', 'Budget exhausted'
     if len(reasons) == 0:
         return 'N/A', 'Guess URLs not allowed'
     else:
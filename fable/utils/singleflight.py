@@ -0,0 +1,183 @@
+"""
+Single-flight request coalescing
+Concurrent calls with the same key collapse into one: the first caller (leader) runs it, others wait for its result.
+Across processes, the leader holds a lease record (db.leases), other processes wait for the lease to go and read the result the leader stored
+A failed (or empty) result is not stored by the leader, so it is remembered under the key for the lease TTL instead:
+in this process, and as a failed lease other processes see
+"""
+import os
+import json
+import time
+import socket
+import hashlib
+import threading
+import pymongo.errors
+
+from . import storage
+from .. import tracer
+
+import logging
+logging.setLoggerClass(tracer.tracer)
+tracer = logging.getLogger('logger')
+logging.setLoggerClass(logging.Logger)
+
+LEASE_TTL = 120 # * Seconds a lease is valid for, then taken over (the holder might have died)
+POLL_INTERVAL = 0.2 # * Seconds between checks on other process's lease
+FAILED_SIZE = 10000 # * Failed keys remembered in process at most
+
+
+def flight_key(kind, url, options={}):
+    """
+    Key of a call on url. Calls with different options (proxies, retries, ...) are not coalesced
+
+    Return: kind:url[:digest of options]
+    """
+    if not options:
+        return f'{kind}:{url}'
+    digest = hashlib.sha1(json.dumps(options, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f'{kind}:{url}:{digest}'
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, lease_ttl=LEASE_TTL, poll=POLL_INTERVAL):
+        self.lease_ttl = lease_ttl
+        self.poll = poll
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{id(self)}'
+        self._lock = threading.Lock()
+        self._calls = {} # * {key: _Call} on the fly in this process
+        self._failed = {} # * {key: (expire, failed result)}
+        self.stats = {'leader': 0, 'coalesced': 0, 'lease_waits': 0, 'failed': 0}
+
+    def do(self, key, fn, lookup=None, lease_db=None, failed=None, default=None):
+        """
+        Run fn once for all concurrent callers of key
+        lookup: Get fn's result stored by another process (after its lease is gone). None if not stored
+        lease_db: db holding leases. If None (or no lookup), only coalesce within this process
+            The lease is only taken when there is no call of key on the fly (or failed recently) in this process
+        failed: func(result) -> whether fn failed (nothing stored for lookup). Failures are remembered for lease_ttl
+        default: Result for callers when fn failed in another process
+
+        Return: fn's result (or lookup's, or default)
+        """
+        with self._lock:
+            recent = self._failed.get(key)
+            if recent is not None:
+                if recent[0] > time.time():
+                    self.stats['failed'] += 1
+                    return recent[1]
+                del self._failed[key]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.stats['leader'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            if lease_db is None or lookup is None:
+                call.result = fn()
+            else:
+                call.result = self._run_leased(key, fn, lookup, lease_db, failed, default)
+            if failed is not None and failed(call.result):
+                self._remember_failed(key, call.result)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def _remember_failed(self, key, result):
+        now = time.time()
+        with self._lock:
+            if len(self._failed) >= FAILED_SIZE:
+                self._failed = {k: v for k, v in self._failed.items() if v[0] > now}
+                while len(self._failed) >= FAILED_SIZE:
+                    del self._failed[next(iter(self._failed))]
+            self._failed[key] = (now + self.lease_ttl, result)
+
+    def _run_leased(self, key, fn, lookup, db, failed=None, default=None):
+        while True:
+            if self._acquire(db, key):
+                fn_failed = False
+                try:
+                    result = fn()
+                    fn_failed = failed is not None and failed(result)
+                    return result
+                finally:
+                    if fn_failed:
+                        self._mark_failed(db, key)
+                    else:
+                        self._release(db, key)
+            # * Another process is on it
+            self.stats['lease_waits'] += 1
+            if self._wait(db, key):
+                return default
+            result = lookup()
+            if result is not None:
+                return result
+
+    def _acquire(self, db, key):
+        """Return: Whether lease of key is acquired (also when db is not available)"""
+        now = time.time()
+        lease = {'owner': self.owner, 'expire': now + self.lease_ttl}
+        try:
+            db.leases.insert_one({'_id': key, **lease})
+            return True
+        except (pymongo.errors.DuplicateKeyError, storage.DuplicateKeyError):
+            pass
+        except Exception as e:
+            tracer.warn(f'SingleFlight: Cannot acquire lease {key}: {str(e)}')
+            return True
+        # * Take over expired lease (or failed mark)
+        try:
+            r = db.leases.update_one({'_id': key, 'expire': {'$lt': now}}, {'$set': lease, '$unset': {'failed': ''}})
+            return r.modified_count > 0
+        except Exception as e:
+            tracer.warn(f'SingleFlight: Cannot acquire lease {key}: {str(e)}')
+            return True
+
+    def _release(self, db, key):
+        try:
+            db.leases.delete_one({'_id': key, 'owner': self.owner})
+        except Exception as e:
+            tracer.warn(f'SingleFlight: Cannot release lease {key}: {str(e)}')
+
+    def _mark_failed(self, db, key):
+        """Keep the lease as a failed mark until lease_ttl, so other processes don't run key again meanwhile"""
+        try:
+            db.leases.update_one({'_id': key, 'owner': self.owner}, {'$set': {'failed': True, 'expire': time.time() + self.lease_ttl}})
+        except Exception as e:
+            tracer.warn(f'SingleFlight: Cannot mark lease {key} failed: {str(e)}')
+
+    def _wait(self, db, key):
+        """
+        Wait until lease of key is released, expired or marked failed
+
+        Return: Whether key failed in the leading process
+        """
+        while True:
+            try:
+                lease = db.leases.find_one({'_id': key})
+            except:
+                return False
+            if lease is None or lease['expire'] < time.time():
+                return False
+            if lease.get('failed'):
+                return True
+            time.sleep(self.poll)
@@ -0,0 +1,675 @@
+"""
+Local embedded storage backend (SQLite in WAL mode), in place of MongoDB
+SQLiteDB mimics the subset of pymongo's Database/Collection API used by FABLE
+(crawl, wayback_index, wayback_rep, searched, corpus, traces, extractions, stage_stats ...)
+
+Each collection is a table of (_id, doc), with doc stored as JSON (bytes as {"$binary": base64}).
+Top-level equality, $in and prefix regexes on indexed fields are pushed down to SQLite, the rest of the query is matched in python.
+Fields FABLE looks up by (DEFAULT_INDEXES) are indexed as expressions on json_extract when a collection is first used.
+Fields dropped by the projection (and not queried) are removed in SQLite, so e.g. html is not decoded when not asked for.
+Connections are per thread. Writes run in IMMEDIATE transactions, so read-modify-write updates ($inc, upsert) are atomic across threads and processes.
+"""
+import re
+import json
+import uuid
+import base64
+import random
+import sqlite3
+import threading
+from types import SimpleNamespace
+
+ASCENDING = 1
+DESCENDING = -1
+HASHED = 'hashed'
+
+_name_re = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# * Indexes created on first use of each collection, same fields as db_index.py (one index per field, so that each can be used alone)
+DEFAULT_INDEXES = {
+    'crawl': [['site'], ['url'], ['digest']],
+    'extractions': [['digest']],
+    'searched': [['query', 'engine']],
+    'wayback_rep': [['site'], ['url']],
+    'wayback_index': [['url']],
+    'traces': [['url']]
+}
+LARGE_FIELDS = ['html'] # * Removed in SQLite when an inclusion projection does not ask for them
+
+class DuplicateKeyError(Exception):
+    pass
+
+
+def _default(obj):
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return {'$binary': base64.b64encode(bytes(obj)).decode()}
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not storable')
+
+def _object_hook(obj):
+    if len(obj) == 1 and '$binary' in obj:
+        return base64.b64decode(obj['$binary'])
+    return obj
+
+def encode(obj):
+    return json.dumps(obj, default=_default, ensure_ascii=False)
+
+def decode(s):
+    return json.loads(s, object_hook=_object_hook)
+
+
+_missing = object()
+
+def _get(doc, path):
+    """
+    Return: Value at dotted path, _missing if not exists
+    """
+    for key in path.split('.'):
+        if isinstance(doc, dict) and key in doc:
+            doc = doc[key]
+        elif isinstance(doc, list) and key.isdigit() and int(key) < len(doc):
+            doc = doc[int(key)]
+        else:
+            return _missing
+    return doc
+
+def _set(doc, path, value):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        doc = doc.setdefault(key, {})
+    doc[keys[-1]] = value
+
+def _unset(doc, path):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        doc = doc.get(key)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(keys[-1], None)
+
+
+def _compare(value, op, target):
+    try:
+        if op == '$lt': return value < target
+        if op == '$lte': return value <= target
+        if op == '$gt': return value > target
+        if op == '$gte': return value >= target
+    except TypeError:
+        return False
+
+def _equal(value, target):
+    """Mongo equality: arrays also match if any element equals"""
+    if value is _missing:
+        return target is None
+    if isinstance(target, re.Pattern):
+        values = value if isinstance(value, list) else [value]
+        return any(isinstance(v, str) and target.search(v) for v in values)
+    if value == target:
+        return True
+    return isinstance(value, list) and target in value
+
+def _match_cond(value, cond):
+    """Match value against condition of one field"""
+    if not isinstance(cond, dict) or not any(k.startswith('$') for k in cond):
+        return _equal(value, cond)
+    for op, target in cond.items():
+        if op == '$eq':
+            ok = _equal(value, target)
+        elif op == '$ne':
+            ok = not _equal(value, target)
+        elif op == '$in':
+            ok = any(_equal(value, t) for t in target)
+        elif op == '$nin':
+            ok = not any(_equal(value, t) for t in target)
+        elif op == '$exists':
+            ok = (value is not _missing) == bool(target)
+        elif op in ['$lt', '$lte', '$gt', '$gte']:
+            values = value if isinstance(value, list) else [value]
+            ok = any(v is not _missing and _compare(v, op, target) for v in values)
+        elif op == '$regex':
+            pattern = re.compile(target, _regex_flags(cond.get('$options', '')))
+            ok = _equal(value, pattern)
+        elif op == '$options':
+            continue
+        elif op == '$not':
+            ok = not _match_cond(value, target)
+        elif op == '$size':
+            ok = isinstance(value, list) and len(value) == target
+        else:
+            raise ValueError(f'Unsupported query operator: {op}')
+        if not ok:
+            return False
+    return True
+
+def _regex_flags(options):
+    flags = 0
+    for o in options:
+        flags |= {'i': re.I, 'm': re.M, 's': re.S, 'x': re.X}.get(o, 0)
+    return flags
+
+def match(doc, query):
+    """
+    Return: Whether doc matches query (mongo query language)
+    """
+    for key, cond in (query or {}).items():
+        if key == '$or':
+            if not any(match(doc, q) for q in cond): return False
+        elif key == '$and':
+            if not all(match(doc, q) for q in cond): return False
+        elif key == '$nor':
+            if any(match(doc, q) for q in cond): return False
+        elif not _match_cond(_get(doc, key), cond):
+            return False
+    return True
+
+
+def project(doc, projection):
+    if not projection:
+        return doc
+    projection = dict(projection)
+    keep_id = projection.pop('_id', True)
+    if len(projection) > 0 and all(projection.values()):
+        new_doc = {}
+        for path in projection:
+            value = _get(doc, path)
+            if value is not _missing:
+                _set(new_doc, path, value)
+    else:
+        new_doc = _copy(doc)
+        for path in projection:
+            _unset(new_doc, path)
+    if keep_id and '_id' in doc:
+        new_doc['_id'] = doc['_id']
+    elif not keep_id:
+        new_doc.pop('_id', None)
+    return new_doc
+
+def _query_fields(query):
+    """Return: Top-level fields referenced by query"""
+    fields = set()
+    for key, cond in (query or {}).items():
+        if key in ['$or', '$and', '$nor']:
+            for q in cond: fields |= _query_fields(q)
+        else:
+            fields.add(key.split('.')[0])
+    return fields
+
+def _omitted(projection, query, sort=[]):
+    """
+    Return: Top-level fields that can be removed from docs before decoding: dropped by projection, not used by query/sort
+    """
+    if not projection:
+        return []
+    projection = {k: v for k, v in dict(projection).items() if k != '_id'}
+    if len(projection) > 0 and all(projection.values()):
+        fields = [f for f in LARGE_FIELDS if not any(p.split('.')[0] == f for p in projection)]
+    else:
+        fields = [p for p in projection if '.' not in p]
+    used = _query_fields(query) | set(k.split('.')[0] for k, _ in sort)
+    return [f for f in fields if _name_re.match(f) and f not in used]
+
+_regex_meta = set('.^$*+?{}[]|()')
+
+def _regex_prefix(pattern):
+    """
+    Return: Literal prefix every match of pattern (anchored by ^) starts with, '' if none
+    """
+    if not pattern.startswith('^'):
+        return ''
+    # * Top-level alternation (^a|b) does not anchor all branches
+    depth, escaped = 0, False
+    for c in pattern:
+        if escaped: escaped = False
+        elif c == '\\': escaped = True
+        elif c == '(': depth += 1
+        elif c == ')': depth -= 1
+        elif c == '|' and depth == 0: return ''
+    prefix, i = [], 1
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern) and not pattern[i+1].isalnum():
+            literal, i = pattern[i+1], i + 2
+        elif c == '\\' or c in _regex_meta:
+            break
+        else:
+            literal, i = c, i + 1
+        # * Optional literal (a?, a*, a{0,}) is not part of the prefix
+        if i < len(pattern) and pattern[i] in '?*{':
+            break
+        prefix.append(literal)
+    return ''.join(prefix)
+
+def _copy(doc):
+    if isinstance(doc, dict):
+        return {k: _copy(v) for k, v in doc.items()}
+    if isinstance(doc, list):
+        return [_copy(v) for v in doc]
+    return doc
+
+
+def apply_update(doc, update):
+    """
+    Apply update ($set/$unset/$inc/$push/$addToSet, $setOnInsert only on upsert) on doc in place
+    A update without operators replaces doc (except _id)
+    """
+    if not any(k.startswith('$') for k in update):
+        _id = doc.get('_id')
+        doc.clear()
+        doc.update(_copy(update))
+        if _id is not None:
+            doc['_id'] = _id
+        return
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == '$set':
+                _set(doc, path, _copy(value))
+            elif op == '$unset':
+                _unset(doc, path)
+            elif op == '$inc':
+                old = _get(doc, path)
+                _set(doc, path, (0 if old is _missing else old) + value)
+            elif op == '$push':
+                old = _get(doc, path)
+                values = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                _set(doc, path, ([] if old is _missing else old) + _copy(values))
+            elif op == '$addToSet':
+                old = _get(doc, path)
+                old = [] if old is _missing else old
+                values = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                _set(doc, path, old + [v for v in _copy(values) if v not in old])
+            elif op == '$setOnInsert':
+                continue
+            else:
+                raise ValueError(f'Unsupported update operator: {op}')
+
+def _upsert_doc(query, update):
+    """New doc from equality conditions in query + update"""
+    doc = {}
+    for key, cond in query.items():
+        if key.startswith('$'):
+            continue
+        if isinstance(cond, dict) and any(k.startswith('$') for k in cond):
+            if '$eq' in cond: _set(doc, key, _copy(cond['$eq']))
+            continue
+        if not isinstance(cond, re.Pattern):
+            _set(doc, key, _copy(cond))
+    if not any(k.startswith('$') for k in update):
+        doc = {'_id': doc['_id']} if '_id' in doc else {}
+    apply_update(doc, update)
+    for path, value in update.get('$setOnInsert', {}).items():
+        _set(doc, path, _copy(value))
+    return doc
+
+
+def sort_docs(docs, sort):
+    """
+    sort: [(key, direction)]. Docs without key go first (ascending)
+    """
+    docs = list(docs)
+    for key, direction in reversed(sort):
+        present = [d for d in docs if _get(d, key) is not _missing]
+        absent = [d for d in docs if _get(d, key) is _missing]
+        present.sort(key=lambda d: _get(d, key), reverse=direction == DESCENDING)
+        docs = absent + present if direction == ASCENDING else present + absent
+    return docs
+
+
+class Cursor:
+    """Lazily evaluated result of find()"""
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=ASCENDING):
+        self._sort = [(key, direction)] if isinstance(key, str) else list(key)
+        return self
+
+    def skip(self, n):
+        self._skip = n
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def __iter__(self):
+        docs = self._collection._find(self._query, omit=_omitted(self._projection, self._query, self._sort))
+        if self._sort:
+            docs = sort_docs(docs, self._sort)
+        count = 0
+        for i, doc in enumerate(docs):
+            if i < self._skip:
+                continue
+            if self._limit and count >= self._limit:
+                break
+            count += 1
+            yield project(doc, self._projection)
+
+
+class SQLiteCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        # * Fields whose equality can be pushed down to SQLite. Indexed fields are expected to be scalars
+        # * (SQLite equality misses array fields matching by element)
+        self._indexed = set(['_id'])
+        self._ready = False
+
+    @property
+    def _conn(self):
+        conn = self.database._conn
+        if not self._ready:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.name}" (_id TEXT PRIMARY KEY, doc TEXT NOT NULL)')
+            for fields in DEFAULT_INDEXES.get(self.name, []):
+                columns = ', '.join(f"json_extract(doc, '$.{f}')" for f in fields)
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "{"_".join([self.name] + fields)}" ON "{self.name}" ({columns})')
+            for (sql,) in conn.execute("SELECT sql FROM sqlite_master WHERE type='index' AND tbl_name=?", (self.name,)):
+                self._indexed.update(re.findall(r"json_extract\(doc, '\$\.(\w+)'\)", sql or ''))
+            self._ready = True
+        return conn
+
+    def _prefix_range(self, key, cond):
+        """
+        Return: [lower, upper) bounds of values matching cond if it is a case-sensitive prefix regex, else None
+        """
+        if isinstance(cond, re.Pattern):
+            pattern, flags = cond.pattern, cond.flags
+        elif isinstance(cond, dict) and '$regex' in cond and set(cond.keys()) <= set(['$regex', '$options']):
+            pattern, flags = cond['$regex'], _regex_flags(cond.get('$options', ''))
+            if isinstance(pattern, re.Pattern):
+                pattern, flags = pattern.pattern, flags | pattern.flags
+        else:
+            return None
+        prefix = _regex_prefix(pattern) if isinstance(pattern, str) and not flags & re.I else ''
+        if key == '_id' and prefix:
+            prefix = encode(prefix)[:-1] # * _id is stored encoded: '"prefix'
+        if not prefix or ord(prefix[-1]) >= 0x10FFFF:
+            return None
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def _where(self, query):
+        """
+        Push top-level equality, $in and prefix regexes on indexed fields down to SQLite
+
+        Return: (where clause, params)
+        """
+        clauses, params = [], []
+        for key, cond in (query or {}).items():
+            if key not in self._indexed:
+                continue
+            column = '_id' if key == '_id' else f"json_extract(doc, '$.{key}')"
+            if isinstance(cond, dict) and list(cond.keys()) == ['$in'] \
+                    and all(isinstance(c, (str, int, float)) and not isinstance(c, bool) for c in cond['$in']):
+                values = [encode(c) if key == '_id' else c for c in cond['$in']]
+                if len(values) == 0:
+                    return '0', []
+                clauses.append(f"{column} IN ({','.join('?' * len(values))})")
+                params += values
+            elif isinstance(cond, (str, int, float)) and not isinstance(cond, bool):
+                clauses.append(f'{column} = ?')
+                params.append(encode(cond) if key == '_id' else cond)
+            elif self._prefix_range(key, cond) is not None:
+                clauses.append(f'{column} >= ? AND {column} < ?')
+                params += list(self._prefix_range(key, cond))
+        return ' AND '.join(clauses) if clauses else '1', params
+
+    def _rows(self, query, conn=None, omit=[]):
+        """
+        omit: Top-level fields removed from docs (not used by query)
+
+        Return: [(_id key, doc)] matching query
+        """
+        conn = conn or self._conn
+        where, params = self._where(query)
+        column = f"json_remove(doc, {', '.join(repr(f'$.{f}') for f in omit)})" if omit else 'doc'
+        # * Fetch all first, so that writes within the iteration do not run into the open statement
+        rows = conn.execute(f'SELECT _id, {column} FROM "{self.name}" WHERE {where}', params).fetchall()
+        for key, doc in rows:
+            doc = decode(doc)
+            if match(doc, query):
+                yield key, doc
+
+    def _find(self, query, omit=[]):
+        for _, doc in self._rows(query, omit=omit):
+            yield doc
+
+    def find(self, filter=None, projection=None, **kwargs):
+        cursor = Cursor(self, filter or {}, projection)
+        if 'sort' in kwargs and kwargs['sort']: cursor.sort(kwargs['sort'])
+        if 'skip' in kwargs: cursor.skip(kwargs['skip'])
+        if 'limit' in kwargs: cursor.limit(kwargs['limit'])
+        return cursor
+
+    def find_one(self, filter=None, projection=None, **kwargs):
+        for doc in self.find(filter, projection, **kwargs).limit(1):
+            return doc
+        return None
+
+    def count_documents(self, filter=None, **kwargs):
+        return sum(1 for _ in self._rows(filter or {}))
+
+    def distinct(self, key, filter=None):
+        values = []
+        for doc in self._find(filter or {}):
+            value = _get(doc, key)
+            for v in (value if isinstance(value, list) else [value]):
+                if v is not _missing and v not in values:
+                    values.append(v)
+        return values
+
+    def _write(self, func):
+        """Run func(conn) in a write transaction"""
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = func(conn)
+            conn.execute('COMMIT')
+            return result
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _insert(self, conn, doc):
+        if '_id' not in doc:
+            doc['_id'] = uuid.uuid4().hex
+        try:
+            conn.execute(f'INSERT INTO "{self.name}" (_id, doc) VALUES (?, ?)', (encode(doc['_id']), encode(doc)))
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f'{self.name}: {str(e)}')
+        return doc['_id']
+
+    def _replace(self, conn, key, doc):
+        try:
+            conn.execute(f'UPDATE "{self.name}" SET doc = ? WHERE _id = ?', (encode(doc), key))
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f'{self.name}: {str(e)}')
+
+    def _update(self, conn, filter, update, upsert=False, multi=False):
+        matched, upserted_id = 0, None
+        for key, doc in list(self._rows(filter, conn=conn)):
+            matched += 1
+            apply_update(doc, update)
+            self._replace(conn, key, doc)
+            if not multi:
+                break
+        if matched == 0 and upsert:
+            upserted_id = self._insert(conn, _upsert_doc(filter, update))
+        return SimpleNamespace(matched_count=matched, modified_count=matched, upserted_id=upserted_id, acknowledged=True)
+
+    def _delete(self, conn, filter, multi=False):
+        deleted = 0
+        for key, _ in list(self._rows(filter, conn=conn)):
+            conn.execute(f'DELETE FROM "{self.name}" WHERE _id = ?', (key,))
+            deleted += 1
+            if not multi:
+                break
+        return SimpleNamespace(deleted_count=deleted, acknowledged=True)
+
+    def insert_one(self, document, **kwargs):
+        inserted_id = self._write(lambda conn: self._insert(conn, document))
+        return SimpleNamespace(inserted_id=inserted_id, acknowledged=True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        inserted_ids = self._write(lambda conn: [self._insert(conn, d) for d in documents])
+        return SimpleNamespace(inserted_ids=inserted_ids, acknowledged=True)
+
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        return self._write(lambda conn: self._update(conn, filter, update, upsert=upsert))
+
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        return self._write(lambda conn: self._update(conn, filter, update, upsert=upsert, multi=True))
+
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        replacement = {k: v for k, v in replacement.items() if k != '_id'}
+        return self._write(lambda conn: self._update(conn, filter, replacement, upsert=upsert))
+
+    def delete_one(self, filter, **kwargs):
+        return self._write(lambda conn: self._delete(conn, filter))
+
+    def delete_many(self, filter, **kwargs):
+        return self._write(lambda conn: self._delete(conn, filter, multi=True))
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        """
+        requests: pymongo's InsertOne/UpdateOne/UpdateMany/ReplaceOne/DeleteOne/DeleteMany
+        Whole batch is one transaction. Unordered batch skips duplicates instead of failing
+        """
+        def run(conn):
+            counts = {'inserted_count': 0, 'matched_count': 0, 'modified_count': 0, 'deleted_count': 0, 'upserted_count': 0}
+            for req in requests:
+                op = type(req).__name__
+                try:
+                    if op == 'InsertOne':
+                        self._insert(conn, req._doc)
+                        counts['inserted_count'] += 1
+                        continue
+                    if op in ['DeleteOne', 'DeleteMany']:
+                        r = self._delete(conn, req._filter, multi=op == 'DeleteMany')
+                        counts['deleted_count'] += r.deleted_count
+                        continue
+                    if op == 'ReplaceOne':
+                        update = {k: v for k, v in req._doc.items() if k != '_id'}
+                    elif op in ['UpdateOne', 'UpdateMany']:
+                        update = req._doc
+                    else:
+                        raise ValueError(f'Unsupported bulk operation: {op}')
+                    r = self._update(conn, req._filter, update, upsert=req._upsert, multi=op == 'UpdateMany')
+                    counts['matched_count'] += r.matched_count
+                    counts['modified_count'] += r.modified_count
+                    counts['upserted_count'] += int(r.upserted_id is not None)
+                except DuplicateKeyError:
+                    if ordered: raise
+            return SimpleNamespace(acknowledged=True, **counts)
+        return self._write(run)
+
+    def aggregate(self, pipeline, **kwargs):
+        """Support $match, $project, $sample, $sort, $skip, $limit"""
+        stages = list(pipeline)
+        docs = None
+        if len(stages) > 0 and '$match' in stages[0]:
+            docs = self._find(stages.pop(0)['$match'])
+        else:
+            docs = self._find({})
+        for stage in stages:
+            (op, arg), = stage.items()
+            if op == '$match':
+                docs = [d for d in docs if match(d, arg)]
+            elif op == '$project':
+                docs = [project(d, arg) for d in docs]
+            elif op == '$sample':
+                docs = list(docs)
+                docs = random.sample(docs, min(arg['size'], len(docs)))
+            elif op == '$sort':
+                docs = sort_docs(docs, list(arg.items()))
+            elif op == '$skip':
+                docs = list(docs)[arg:]
+            elif op == '$limit':
+                docs = list(docs)[:arg]
+            else:
+                raise ValueError(f'Unsupported aggregation stage: {op}')
+        return iter(list(docs))
+
+    def create_index(self, keys, unique=False, name=None, **kwargs):
+        """
+        keys: field name or [(field, direction)]. Direction only matters to mongo
+        Indexed fields have their equality queries pushed down to SQLite
+        Hashed indexes are skipped: here they would copy the whole field (e.g. html) into the index
+        """
+        keys = [(keys, ASCENDING)] if isinstance(keys, str) else list(keys)
+        if any(d == HASHED for _, d in keys):
+            return name or '_'.join([self.name] + [k for k, _ in keys])
+        fields = [k for k, _ in keys]
+        for field in fields:
+            if not _name_re.match(field):
+                raise ValueError(f'Only top-level fields can be indexed: {field}')
+        name = name or '_'.join([self.name] + fields)
+        if fields == ['_id']:
+            return name
+        columns = ', '.join(f"json_extract(doc, '$.{f}')" for f in fields)
+        try:
+            self._conn.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS "{name}" ON "{self.name}" ({columns})')
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f'{self.name}: {str(e)}')
+        self._indexed.update(fields)
+        return name
+
+    def drop(self):
+        self._conn.execute(f'DROP TABLE IF EXISTS "{self.name}"')
+        self._indexed = set(['_id'])
+        self._ready = False
+
+
+class SQLiteDB:
+    """
+    Drop-in for pymongo's Database: db.<collection> / db[collection]
+    path: SQLite file. Shared by threads and processes (WAL)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.name = path
+        self._local = threading.local()
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    @property
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # * Autocommit: transactions are explicit (BEGIN IMMEDIATE) in writes
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def __getitem__(self, name):
+        if not _name_re.match(name):
+            raise ValueError(f'Invalid collection name: {name}')
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = SQLiteCollection(self, name)
+            return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_collection_names(self):
+        return [r[0] for r in self._conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+
+    def drop_collection(self, name):
+        self[name].drop()
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
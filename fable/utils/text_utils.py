@@ -3,84 +3,39 @@ Utils for text
 """
 from os.path import join, dirname, abspath, splitext
 from subprocess import call
-import re, os, time
+import re, os, time, math
 import sys, copy
 import multiprocessing as mp
 from multiprocessing import Process
-import scipy.sparse as sp
 import numpy as np
-from collections import defaultdict
-import functools
+from collections import defaultdict, OrderedDict, Counter
+import threading
 from subprocess import Popen, PIPE
 import requests
 
-from langcodes import Language
-from langdetect import detect_langs
-
-import justext
-from goose3 import Goose
-from newspaper import Article
-
 import textwrap
 from dateutil import parser as dparser
-from dateparser.search import search_dates
-import dateparser, difflib
+import difflib
 
 import brotli
 import bs4
 from bs4 import BeautifulSoup
 
-from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import nltk
-from nltk.corpus import stopwords
-from nltk.stem.snowball import SnowballStemmer
-from nltk.stem import WordNetLemmatizer
-
 from .. import config
+from . import tokenizer
 
 sys.setrecursionlimit(1500)
 tmp_path = config.TMP_PATH
 
-def prepare_nltk():
-    try:
-        nltk.data.find('tokenizers/punkt')
-    except:
-        nltk.download('punkt')
-    try:
-        nltk.data.find('corpora/stopwords')
-    except:
-        nltk.download('stopwords')
-
-prepare_nltk()
-stemmer = SnowballStemmer('english')
-lemmatizer = WordNetLemmatizer()
+# * Heavy dependencies (sklearn, nltk, langdetect, extractors) are imported on first use
 
-stem_cache = {}
 def tokenize(texts):
     """
-    Simple function for tokenizing a text. Extracted from sklearn src code
+    Simple function for tokenizing a text (english stop words removed, stemmed). See tokenizer.tokenize
     
     Returns: list of features in the original order
     """
-    texts = texts.replace('_', ' ')
-    # # ? Tokenize: Scikit-Learn version
-    cv = CountVectorizer(stop_words='english', token_pattern=r"(?u)\b\w+\b") # TODO: Not necessary english
-    analyze = cv.build_analyzer()
-    texts = analyze(texts)
-    # ? Tokenize: nltk version
-    # texts = nltk.word_tokenize(texts)
-    def cached_transform(t, func, cache):
-        if t in cache:
-            return cache[t]
-        tt = func(t)
-        cache[t] = tt
-        return tt
-    # * Stemming
-    texts = [cached_transform(t, stemmer.stem, stem_cache) for t in texts]
-    # * Lemmatization
-    # texts = [lemmatizer.lemmatize(t) for t in texts]
-    return texts
+    return tokenizer.tokenize(texts)
 
 vectorizer_kwargs = {
     # 'stop_words': [stemmer.stem(s) for s in stopwords.words('english')], 
@@ -93,6 +48,7 @@ class TFidfDynamic:
         """
         Re calculated the tfidf from the self.corpus
         """
+        from sklearn.feature_extraction.text import TfidfVectorizer
         print("re_init")
         # self.vectorizer = TfidfVectorizer()
         self.tfidf = self.vectorizer.fit_transform(self.corpus)
@@ -100,6 +56,7 @@ class TFidfDynamic:
         # print(f"Takes {(time.time()-begin):.2f}s")
 
     def __init__(self, corpus):
+        from sklearn.feature_extraction.text import TfidfVectorizer
         corpus = list(set(corpus))
         self.idx = {c: i for i, c in enumerate(corpus)}
         self.corpus = corpus
@@ -112,6 +69,7 @@ class TFidfDynamic:
         Get similarity of 2 text
         If any of the text is not in the corpus, TFIDF matrix will be recalculated
         """
+        from sklearn.metrics.pairwise import cosine_similarity
         idx1, idx2 = self.idx[text1], self.idx[text2]
         return cosine_similarity(self.tfidf[idx1], self.tfidf[idx2])[0,0]
     
@@ -137,6 +95,7 @@ class TFidfDynamic:
     def _gen_pair_simi(self):
         """Generate all pairwise documents' similarity"""
         if self.pairwise_simi is not None: return
+        from sklearn.metrics.pairwise import cosine_similarity
         self.pairwise_simi = cosine_similarity(self.tfidf)
 
     def top_similar(self, text, N=10):
@@ -144,6 +103,7 @@ class TFidfDynamic:
         N: Number of documents returned
         Return: [(document, similarity)] for top similar documents to text.
         """
+        from sklearn.metrics.pairwise import cosine_similarity
         # self._gen_pair_simi()
         idx = self.idx[text]
         array = cosine_similarity(self.tfidf[idx], self.tfidf)[0]
@@ -151,93 +111,248 @@ class TFidfDynamic:
         idxes = array.argsort()[-N-1:]
         return [(self.corpus[i], array[i]) for i in reversed(idxes) if i != idx]
 
+TFIDF_VECTOR_CACHE = 4096 # * Vectorized texts kept by TFidfStatic (shared by its forks)
+TFIDF_MODEL_FORMAT = 1 # * Format of saved TFidfStatic models
+
+class _TFidfVector:
+    """Counts of a text, split into terms in the corpus vocabulary and unseen ones"""
+    __slots__ = ('weights', 'sq', 'overlay', 'cols', 'vals')
+    def __init__(self, weights, sq, overlay):
+        self.weights = weights # * {column: count * idf}
+        self.sq = sq # * Squared norm of weights
+        self.overlay = overlay # * {unseen term: count}, idf depends on workingset
+        # * weights as arrays, for similar_matrix
+        self.cols = np.fromiter(weights.keys(), dtype=np.int64, count=len(weights))
+        self.vals = np.fromiter(weights.values(), dtype=np.float64, count=len(weights))
+
+
 class TFidfStatic:
     def __init__(self, corpus):
+        """
+        IDF is fitted on corpus once. Similarities are calculated within a workingset of texts (add_corpus)
+        Terms unseen in corpus get IDF as if the workingset were added to corpus (with corpus' #docs)
+        Texts are vectorized against corpus vocabulary once (cached), so only new texts are tokenized
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
         corpus = list(set(corpus))
         self.corpus = corpus
         self.vectorizer = TfidfVectorizer(**vectorizer_kwargs)
         self.vectorizer.fit(corpus)
-        self.tfidf = self.vectorizer.transform(corpus)
-        self.workingset_vec = None
-        self.workingset_tfidf = None
-        self.idx = None
-    
-    def _init_workingset(self, inputs):
+        self.meta = {}
+        self._init_model(self.vectorizer.idf_, self.vectorizer.vocabulary_, len(corpus))
+
+    def _init_model(self, idf, vocab, num_docs):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        self.num_docs = num_docs
+        self.idf = idf
+        self.vocab = vocab
+        self.analyzer = TfidfVectorizer(**vectorizer_kwargs).build_analyzer()
+        self.terms = None # * Column -> term, built on first topN
+        self._vectors = OrderedDict() # * {text: _TFidfVector} LRU
+        self._vectors_lock = threading.Lock()
+        self._clear_workingset()
+
+    def save(self, path, meta={}):
         """
-        Get tfidf within inputs. 
-        TFIDF value will be based on the previous corpus instead of the input
+        Save fitted model to directory path:
+            idf.npy (memory-mappable), terms.txt (term of each column), stem_cache.json, meta.json
+        meta: Extra fields in meta.json
         """
-        inputs = list(set(inputs))
-        self.idx = {i: c for c, i in enumerate(inputs)}
-        # Get vocabulary from inputs
-        idf = self.vectorizer.idf_
-        # vocab = defaultdict(None, self.vectorizer.vocabulary_)
-        vocab = self.vectorizer.vocabulary_.copy()
-        vsize = len(vocab)
-        # vocab.default_factory = vocab.__len__
-        inputs_tfidf = TfidfVectorizer(**vectorizer_kwargs)
-        inputs_matrix = inputs_tfidf.fit_transform(inputs)
-        # Add unseen vocab to existed corpus
-        num_docs = inputs_matrix.shape[0]
-        inputs_idf = inputs_tfidf.idf_
-        inputs_vocab = inputs_tfidf.vocabulary_
-        for word in inputs_vocab.keys():
-            # Added with proper index if not in vocabulary
-            if word not in vocab:
-                vocab[word] = vsize
-                vsize += 1
-                df = (num_docs + 1) / np.exp(inputs_idf[inputs_vocab[word]] - 1) - 1
-                df = np.log((self.tfidf.shape[0] + 1) / (df + 1)) + 1
-                idf = np.append(idf, [df])
-        # Construct workingset
-        self.workingset_vec = TfidfVectorizer(vocabulary=vocab, **vectorizer_kwargs)
-        def my_validate_vocab(self):
-            self.vocabulary_ = self.vocabulary
-        self.workingset_vec._validate_vocabulary = functools.partial(my_validate_vocab, self.workingset_vec)
-        self.fixed_vocabulary_ = True       
-        self.workingset_vec.idf_ = idf
-        # self.workingset_vec._idf_diag = sp.diags(idf, offsets=0,
-        #                                 shape=(idf.shape[0], idf.shape[0]),
-        #                                 format='csr',
-        #                                 dtype=np.float64)
-        self.workingset_tfidf = self.workingset_vec.transform(inputs)
-    
+        import json, hashlib, sklearn
+        os.makedirs(path, exist_ok=True)
+        terms = [None] * len(self.vocab)
+        for term, col in self.vocab.items():
+            terms[col] = term
+        idf = np.ascontiguousarray(self.idf, dtype=np.float64)
+        digest = hashlib.sha1('\n'.join(terms).encode())
+        digest.update(idf.tobytes())
+        meta = {
+            'format': TFIDF_MODEL_FORMAT,
+            'version': digest.hexdigest()[:16],
+            'num_docs': self.num_docs,
+            'num_terms': len(terms),
+            'sklearn': sklearn.__version__,
+            'created': time.time(),
+            **meta
+        }
+        # * Write to temporary files then rename, so that loaders never see partial model
+        np.save(os.path.join(path, 'idf.tmp.npy'), idf)
+        with open(os.path.join(path, 'terms.txt.tmp'), 'w') as f:
+            f.write('\n'.join(terms))
+        with open(os.path.join(path, 'stem_cache.json.tmp'), 'w') as f:
+            json.dump(dict(tokenizer.stem_cache.items()), f)
+        with open(os.path.join(path, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(os.path.join(path, 'idf.tmp.npy'), os.path.join(path, 'idf.npy'))
+        for name in ['terms.txt', 'stem_cache.json', 'meta.json']:
+            os.replace(os.path.join(path, f'{name}.tmp'), os.path.join(path, name))
+        self.meta = meta
+        return meta
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load model saved by save(). IDF is memory-mapped (shared by processes), stemming cache is merged into tokenizer.stem_cache
+
+        Return: TFidfStatic (without corpus)
+        """
+        import json
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('format') != TFIDF_MODEL_FORMAT:
+            raise ValueError(f'Unsupported tfidf model format {meta.get("format")} at {path}')
+        idf = np.load(os.path.join(path, 'idf.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'terms.txt')) as f:
+            terms = f.read().split('\n')
+        if len(terms) != meta['num_terms'] or len(terms) != idf.shape[0]:
+            raise ValueError(f'Corrupted tfidf model at {path}')
+        try:
+            with open(os.path.join(path, 'stem_cache.json')) as f:
+                tokenizer.stem_cache.update(json.load(f))
+        except FileNotFoundError: pass
+        tfidf = cls.__new__(cls)
+        tfidf.corpus = []
+        tfidf.vectorizer = None
+        tfidf.meta = meta
+        tfidf._init_model(idf, {term: col for col, term in enumerate(terms)}, meta['num_docs'])
+        tfidf.terms = terms
+        return tfidf
+
+    def _vectorize(self, text):
+        with self._vectors_lock:
+            vec = self._vectors.get(text)
+            if vec is not None:
+                self._vectors.move_to_end(text)
+                return vec
+        weights, overlay = {}, {}
+        for term, count in Counter(self.analyzer(text)).items():
+            col = self.vocab.get(term)
+            if col is None:
+                overlay[term] = count
+            else:
+                weights[col] = count * self.idf[col]
+        vec = _TFidfVector(weights, sum(w * w for w in weights.values()), overlay)
+        with self._vectors_lock:
+            self._vectors[text] = vec
+            while len(self._vectors) > TFIDF_VECTOR_CACHE:
+                self._vectors.popitem(last=False)
+        return vec
+
+    def _overlay_idf(self, term):
+        """IDF of a term unseen in corpus, by its df within workingset"""
+        return math.log((self.num_docs + 1) / (self.workingset_df[term] + 1)) + 1
+
+    def _add_workingset(self, inputs):
+        for text in inputs:
+            if text in self.workingset:
+                continue
+            vec = self._vectorize(text)
+            self.workingset[text] = vec
+            for term in vec.overlay:
+                self.workingset_df[term] += 1
+
     def _clear_workingset(self):
-        self.idx = None
-        self.workingset_vec = None
-        self.workingset_tfidf = None
-    
+        # * Reassigned (not cleared), so that forks (shallow copies) do not share workingset
+        self.workingset = {} # * {text: _TFidfVector}
+        self.workingset_df = defaultdict(int) # * {unseen term: df within workingset}
+
     def similar(self, text1, text2):
+        """Cosine similarity of 2 texts. Texts not in workingset are added to it"""
         if text1 == "" or text2 == "": return 0
-        if self.workingset_vec is None:
-            inputs_tfidf = TfidfVectorizer(**vectorizer_kwargs)
-            try:
-                _ = inputs_tfidf.fit_transform([text1, text2])
-            except: return 0
-            self._init_workingset([text1, text2])
-        idx1, idx2 = self.idx[text1], self.idx[text2]
-        return cosine_similarity(self.workingset_tfidf[idx1], self.workingset_tfidf[idx2])[0,0]
-    
+        self._add_workingset([text1, text2])
+        vec1, vec2 = self.workingset[text1], self.workingset[text2]
+        if len(vec1.weights) > len(vec2.weights):
+            vec1, vec2 = vec2, vec1
+        w2 = vec2.weights
+        dot = sum(w * w2[col] for col, w in vec1.weights.items() if col in w2)
+        sq1, sq2 = vec1.sq, vec2.sq
+        if vec1.overlay or vec2.overlay:
+            o2 = vec2.overlay
+            for term, count in vec1.overlay.items():
+                idf = self._overlay_idf(term)
+                sq1 += (count * idf) ** 2
+                if term in o2: dot += count * o2[term] * idf * idf
+            for term, count in o2.items():
+                sq2 += (count * self._overlay_idf(term)) ** 2
+        if sq1 == 0 or sq2 == 0:
+            return 0
+        return float(dot / math.sqrt(sq1 * sq2))
+
+    def similar_matrix(self, texts1, texts2):
+        """
+        Cosine similarities of texts1 x texts2, in one sparse matrix product. Texts not in workingset are added to it
+        Columns of terms unseen in corpus are put after corpus vocabulary
+
+        Return: np.array of shape (len(texts1), len(texts2))
+        """
+        import scipy.sparse as sp
+        self._add_workingset([t for t in texts1 + texts2 if t != ""])
+        vsize, overlay_cols, overlay_idf = len(self.vocab), {}, {}
+        def matrix(texts):
+            """Return: (data, indices, indptr) of l2 normalized rows"""
+            data, indices, indptr = [], [], [0]
+            for text in texts:
+                vec = self.workingset.get(text) if text != "" else None
+                if vec is None:
+                    indptr.append(indptr[-1])
+                    continue
+                cols, vals, sq = vec.cols, vec.vals, vec.sq
+                if vec.overlay:
+                    ocols, ovals = [], []
+                    for term, count in vec.overlay.items():
+                        if term not in overlay_cols:
+                            overlay_cols[term] = vsize + len(overlay_cols)
+                            overlay_idf[term] = self._overlay_idf(term)
+                        w = count * overlay_idf[term]
+                        ocols.append(overlay_cols[term])
+                        ovals.append(w)
+                        sq += w * w
+                    cols, vals = np.concatenate([cols, ocols]), np.concatenate([vals, ovals])
+                if sq == 0:
+                    indptr.append(indptr[-1])
+                    continue
+                indices.append(cols)
+                data.append(vals / math.sqrt(sq))
+                indptr.append(indptr[-1] + len(cols))
+            if len(data) == 0:
+                return np.zeros(0), np.zeros(0, dtype=np.int64), indptr
+            return np.concatenate(data), np.concatenate(indices).astype(np.int64), indptr
+        m1, m2 = matrix(texts1), matrix(texts2)
+        shape = vsize + len(overlay_cols)
+        m1 = sp.csr_matrix(m1, shape=(len(texts1), shape))
+        m2 = sp.csr_matrix(m2, shape=(len(texts2), shape))
+        return (m1 @ m2.T).toarray()
+
+    def similar_many(self, text, candidates):
+        """
+        Cosine similarities of text with each of candidates
+
+        Return: np.array of shape (len(candidates),)
+        """
+        if len(candidates) == 0:
+            return np.zeros(0)
+        return self.similar_matrix([text], list(candidates))[0]
+
     def topN(self, text, N=7):
-        if self.workingset_vec is None:
-            inputs_tfidf = TfidfVectorizer(**vectorizer_kwargs)
-            try:
-                _ = inputs_tfidf.fit_transform([text])
-            except: return ''
-            self._init_workingset([text])
-        array = self.workingset_tfidf[self.idx[text]].toarray()[0]
-        idxes = array.argsort()[-N:]
-        words = self.workingset_vec.get_feature_names()
-        return [words[i] for i in reversed(idxes)]
+        """Highest weighted (at most) N terms of text"""
+        self._add_workingset([text])
+        vec = self.workingset[text]
+        if not vec.weights and not vec.overlay:
+            return ''
+        if self.terms is None:
+            terms = [None] * len(self.vocab)
+            for term, col in self.vocab.items():
+                terms[col] = term
+            self.terms = terms
+        weighted = [(w, self.terms[col]) for col, w in vec.weights.items()]
+        weighted += [(count * self._overlay_idf(term), term) for term, count in vec.overlay.items()]
+        weighted.sort(key=lambda x: x[0], reverse=True)
+        return [term for _, term in weighted[:N]]
 
     def add_corpus(self, inputs):
-        if self.workingset_vec is not None:
-            self._clear_workingset()
-        inputs_tfidf = TfidfVectorizer(**vectorizer_kwargs)
-        try:
-            _ = inputs_tfidf.fit_transform(inputs)
-        except: return
-        self._init_workingset(inputs)
+        """Set workingset to inputs"""
+        self._clear_workingset()
+        self._add_workingset(inputs)
 
 
 def find_complement_string(A, B):
@@ -259,6 +374,7 @@ def article_date(html, url=""):
     Get the publish date of a webpage using article library
     Return datetime.datetime
     """
+    from newspaper import Article
     article = Article(url=url)
     article.download(input_html=html)
     article.parse()
@@ -269,6 +385,7 @@ def mine_date(html, url=""):
     """
     Mine way of trying to get date
     """
+    import dateparser
     soup = BeautifulSoup(html, 'lxml')
     wm_ipp = soup.find_all('div', id='wm-ipp-base')
     if len(wm_ipp) > 0: wm_ipp[0].decompose()
@@ -345,6 +462,8 @@ def brotli_decompree(compressed):
 
 
 def goose_extract(html, lang=None):
+    from goose3 import Goose
+    from langdetect import detect_langs
     if not lang:
         g = Goose()
     else:
@@ -358,6 +477,9 @@ def goose_extract(html, lang=None):
 
 
 def justext_extract(html, lang=None):
+    import justext
+    from langcodes import Language
+    from langdetect import detect_langs
     lang_code = detect_langs(html)[0].lang if not lang else lang
     lang = Language.make(language=lang_code).language_name()
     try:
@@ -373,6 +495,8 @@ def justext_extract(html, lang=None):
 
 
 def newspaper_extract(html, lang=None):
+    from newspaper import Article
+    from langdetect import detect_langs
     lang_code = detect_langs(html)[0].lang if not lang else lang
     article = Article(url='', language=lang_code) # Dummy urls to initialize the obj Can be anything able to wget
     article.download(input_html=html)
@@ -537,6 +661,7 @@ def _lang_meta(resp):
         return None
 
 def _fuzzy_lang(resp):
+    from langdetect import detect_langs
     if isinstance(resp, requests.Response):
         resp = resp.text
     try:
@@ -553,6 +678,27 @@ def detect_lan(resp, fuzzy=False):
         if lan: return lan
     return _lang_meta(resp)
     
+# * Output version of each extractor (title & body extractors of the same name share one), part of the key of cached extractions
+# * Bump it when the extractor's output changes (library upgrade, post-processing), so that its cached extractions are redone
+EXTRACTOR_VERSIONS = {
+    'domdistiller': 1,
+    'boilerpipe': 1,
+    'justext': 1,
+    'goose': 1,
+    'newspaper': 1,
+    'mine': 1,
+    'title_body': 1
+}
+
+def extractor_version(extractor):
+    """
+    extractor: name, or list of names (tried without backup)
+
+    Return: e.g. domdistiller@1, boilerpipe@1+justext@1
+    """
+    extractors = extractor if isinstance(extractor, list) else [extractor]
+    return '+'.join(f'{e}@{EXTRACTOR_VERSIONS.get(e, 0)}' for e in extractors)
+
 def extract_body(html, version='domdistiller', handle_exception=True):
     """
     Wrapper functions for different version of html body extraction
@@ -590,6 +736,8 @@ def extract_body(html, version='domdistiller', handle_exception=True):
 
 
 def newspaper_title_extract(html, lang=None):
+    from newspaper import Article
+    from langdetect import detect_langs
     lang_code = detect_langs(html)[0].lang if not lang else lang
     article = Article('https://google.com', language=lang_code) # Dummy urls to initialize the obj Can be anything able to wget
     article.download(input_html=html)
@@ -802,17 +950,88 @@ def extract_title_body(html, handle_exception=True):
         return title, content
 
 
+def shingles(text, k=5):
+    """Return: set of k-shingles (tuples of tokens) of text"""
+    tokens = tokenize(text)
+    if len(tokens) < k:
+        return {tuple(tokens)}
+    return {tuple(tokens[i: i+k]) for i in range(len(tokens)-(k-1))}
+
+
 def k_shingling(text1, text2, k=5):
-    text1 = tokenize(text1)
-    text2 = tokenize(text2)
-    if len(text1) < k:
-        shingle1 = [tuple(text1)]
-    else:
-        shingle1 = [tuple(text1[i: i+k]) for i in range(len(text1)-(k-1))]
-    if len(text2) < k:
-        shingle2 = [tuple(text2)]
-    else:
-        shingle2 = [tuple(text2[i: i+k]) for i in range(len(text2)-(k-1))]
+    """Return: Jaccard similarity of k-shingles of 2 texts"""
+    shingle1, shingle2 = shingles(text1, k=k), shingles(text2, k=k)
     if len(shingle1) + len(shingle2) <= 0: return 1
-    return len(set(shingle1).intersection(set(shingle2))) / len(set(shingle1).union(set(shingle2)))
+    return len(shingle1.intersection(shingle2)) / len(shingle1.union(shingle2))
+
+
+MINHASH_K = 5 # * Shingle size, same as k_shingling
+MINHASH_PERM = 128 # * Number of permutations (uint32) of a signature
+MINHASH_MARGIN = 0.1 # * Estimates closer than this to threshold are checked with exact k_shingling
+MINHASH_CACHE_SIZE = 20000 # * Signatures kept in memory
+_MERSENNE = (1 << 61) - 1
+minhash_cache = tokenizer.LRUCache(MINHASH_CACHE_SIZE) # * {(sha1 of text, k, num_perm): signature}
+_minhash_perms = {}
+
+def _minhash_key(text, k, num_perm):
+    import hashlib
+    return (hashlib.sha1(text.encode()).digest(), k, num_perm)
+
+def minhash(text, k=MINHASH_K, num_perm=MINHASH_PERM):
+    """
+    MinHash signature of text's k-shingles, estimating k_shingling by the fraction of equal entries
+    Signatures are kept (by text) in minhash_cache, so each text is tokenized once
+
+    Return: np.array of num_perm uint32
+    """
+    import zlib
+    key = _minhash_key(text, k, num_perm)
+    sig = minhash_cache.get(key)
+    if sig is not None:
+        return sig
+    if num_perm not in _minhash_perms:
+        # * Fixed seed: signatures are comparable across processes (and stored)
+        rng = np.random.RandomState(1)
+        _minhash_perms[num_perm] = (rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64),
+                                    rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64))
+    a, b = _minhash_perms[num_perm]
+    hv = np.fromiter((zlib.crc32('\x1f'.join(s).encode()) for s in shingles(text, k=k)), dtype=np.uint64)
+    sig = np.full(num_perm, 0xFFFFFFFF, dtype=np.uint64)
+    for i in range(0, len(hv), 1024):
+        # * a, b, hv < 2^32: no overflow in uint64
+        phv = (np.outer(hv[i:i+1024], a) + b) % _MERSENNE & np.uint64(0xFFFFFFFF)
+        sig = np.minimum(sig, phv.min(axis=0))
+    sig = sig.astype(np.uint32)
+    minhash_cache.put(key, sig)
+    return sig
+
+def remember_minhash(text, sig, k=MINHASH_K, num_perm=MINHASH_PERM):
+    """
+    Put a stored signature (np.array or bytes) of text into minhash_cache
+    
+    Return: Whether sig is valid for (k, num_perm)
+    """
+    if isinstance(sig, bytes):
+        sig = np.frombuffer(sig, dtype=np.uint32)
+    if len(sig) != num_perm:
+        return False
+    minhash_cache.put(_minhash_key(text, k, num_perm), sig)
+    return True
+
+def minhash_similarity(sig1, sig2):
+    """Return: Estimated Jaccard similarity of 2 signatures"""
+    return np.count_nonzero(sig1 == sig2) / len(sig1)
+
+def near_duplicate(text1, text2, threshold, k=MINHASH_K, margin=MINHASH_MARGIN):
+    """
+    Approximates k_shingling(text1, text2) >= threshold by MinHash signatures
+    An estimate farther than margin from threshold decides alone (rarely, not as exact k_shingling would),
+    exact k_shingling is only calculated when the estimate is within margin of threshold
+
+    Return: bool
+    """
+    est = minhash_similarity(minhash(text1, k=k), minhash(text2, k=k))
+    if abs(est - threshold) >= margin:
+        return est >= threshold
+    return k_shingling(text1, text2, k=k) >= threshold
 
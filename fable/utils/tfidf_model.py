@@ -0,0 +1,95 @@
+"""
+Corpus TF-IDF model of tools.Similar, fitted once and saved to disk
+Corpus docs are picked deterministically (by hash of _id), so building on the same corpus gives the same model (same version)
+
+Build: python -m fable.utils.tfidf_model build [--out path] [--size 10000]
+Similar loads the model at config 'tfidf_model' (default: {tmp_path}/tfidf_model)
+"""
+import os
+import re
+import hashlib
+import argparse
+
+from . import text_utils
+from .. import config, tracer
+
+import logging
+logging.setLoggerClass(tracer.tracer)
+tracer = logging.getLogger('logger')
+logging.setLoggerClass(logging.Logger)
+
+CORPUS_SIZE = 10000 # * Docs fitted on, same as Similar's default corpus_size
+CORPUS_QUERY = {'$or': [{'src': 'realweb'}, {'usage': re.compile('represent')}]} # * Same docs Similar samples from
+
+
+def model_path():
+    """Return: Path of the model Similar loads"""
+    return config.config('tfidf_model') or os.path.join(config.TMP_PATH, 'tfidf_model')
+
+
+def exists(path=None):
+    return os.path.exists(os.path.join(path or model_path(), 'meta.json'))
+
+
+def select_corpus(db, size=CORPUS_SIZE, batch=1000):
+    """
+    Pick size docs of db.corpus deterministically (smallest sha1 of _id)
+
+    Return: [content]
+    """
+    ids = [doc['_id'] for doc in db.corpus.find(CORPUS_QUERY, {'_id': True})]
+    ids.sort(key=lambda i: hashlib.sha1(str(i).encode()).hexdigest())
+    ids = ids[:size]
+    contents = {}
+    for i in range(0, len(ids), batch):
+        for doc in db.corpus.find({'_id': {'$in': ids[i:i+batch]}}, {'content': True}):
+            if doc.get('content'):
+                contents[doc['_id']] = doc['content']
+    return [contents[i] for i in ids if i in contents]
+
+
+def build(db, path=None, size=CORPUS_SIZE):
+    """
+    Fit TFidfStatic on corpus selected from db.corpus, and save it to path
+
+    Return: meta of saved model
+    """
+    path = path or model_path()
+    corpus = select_corpus(db, size=size)
+    if len(corpus) == 0:
+        raise ValueError('No corpus in db.corpus to build tfidf model on')
+    tfidf = text_utils.TFidfStatic(corpus)
+    return tfidf.save(path, meta={'corpus_size': size, 'corpus_docs': len(corpus)})
+
+
+def load(path=None):
+    """Return: TFidfStatic saved at path, None if not built"""
+    path = path or model_path()
+    if not exists(path):
+        return None
+    try:
+        return text_utils.TFidfStatic.load(path)
+    except Exception as e:
+        tracer.warn(f'tfidf_model: Cannot load {path}: {str(e)}')
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the corpus tfidf model used by tools.Similar')
+    parser.add_argument('command', choices=['build', 'info'])
+    parser.add_argument('--out', default=None, help='Directory to save model to. Default: config tfidf_model or {tmp_path}/tfidf_model')
+    parser.add_argument('--size', type=int, default=CORPUS_SIZE, help='Number of corpus docs to fit on')
+    args = parser.parse_args()
+    if args.command == 'build':
+        meta = build(config.DB, path=args.out, size=args.size)
+    else:
+        tfidf = load(args.out)
+        if tfidf is None:
+            print(f'No model at {args.out or model_path()}')
+            return
+        meta = tfidf.meta
+    for k, v in meta.items():
+        print(f'{k}: {v}')
+
+if __name__ == '__main__':
+    main()
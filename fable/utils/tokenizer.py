@@ -0,0 +1,117 @@
+"""
+Tokenizer shared by text_utils and url_utils
+Analyzers are built once per stop words setting. Tokens of recent (text, options) and stems of words are kept in bounded LRUs
+"""
+import threading
+from collections import OrderedDict
+
+TOKEN_PATTERN = r"(?u)\b\w+\b"
+TOKEN_CACHE_SIZE = 100000 # * (text, options) -> tokens kept
+TOKEN_CACHE_MAX_LEN = 2048 # * Longer texts (contents) are not kept in token cache
+STEM_CACHE_SIZE = 500000 # * word -> stem kept
+
+
+class LRUCache:
+    """Bounded mapping, least recently used entries are evicted first. Thread-safe"""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def update(self, d):
+        for k, v in d.items():
+            self.put(k, v)
+
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits, self.misses = 0, 0
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+stemmer = None
+analyzers = {} # * {stop words key: analyzer}
+stem_cache = LRUCache(STEM_CACHE_SIZE)
+token_cache = LRUCache(TOKEN_CACHE_SIZE)
+
+
+def _stop_words_key(stop_words):
+    if stop_words is None or isinstance(stop_words, str):
+        return stop_words
+    return tuple(stop_words)
+
+
+def get_analyzer(stop_words='english'):
+    """Return: sklearn analyzer (lowercase, split by TOKEN_PATTERN, drop stop_words), built once per stop_words"""
+    key = _stop_words_key(stop_words)
+    analyzer = analyzers.get(key)
+    if analyzer is None:
+        from sklearn.feature_extraction.text import CountVectorizer
+        stop_words = list(key) if isinstance(key, tuple) else key
+        analyzer = CountVectorizer(stop_words=stop_words, token_pattern=TOKEN_PATTERN).build_analyzer()
+        analyzers[key] = analyzer
+    return analyzer
+
+
+def stem(word):
+    global stemmer
+    s = stem_cache.get(word)
+    if s is None:
+        if stemmer is None:
+            from nltk.stem.snowball import SnowballStemmer
+            stemmer = SnowballStemmer('english')
+        s = stemmer.stem(word)
+        stem_cache.put(word, s)
+    return s
+
+
+def tokenize(texts, stop_words='english', nonstop_words=[], stemming=True):
+    """
+    Tokenize a text: '_' as separator, remove nonstop_words, analyze, then stem
+
+    Returns: list of features in the original order
+    """
+    cacheable = len(texts) <= TOKEN_CACHE_MAX_LEN
+    if cacheable:
+        key = (texts, _stop_words_key(stop_words), tuple(nonstop_words), stemming)
+        tokens = token_cache.get(key)
+        if tokens is not None:
+            return list(tokens)
+    t = texts.replace('_', ' ')
+    # * Merge nonstop words
+    for nsw in nonstop_words:
+        t = t.replace(nsw, '')
+    tokens = get_analyzer(stop_words)(t)
+    if stemming:
+        tokens = [stem(w) for w in tokens]
+    if cacheable:
+        token_cache.put(key, tuple(tokens))
+    return tokens
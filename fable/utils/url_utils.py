@@ -13,10 +13,7 @@ import regex
 import difflib
 import datetime
 
-from sklearn.feature_extraction.text import CountVectorizer
-from nltk.corpus import stopwords
-from nltk.stem.snowball import SnowballStemmer
-from nltk.stem import WordNetLemmatizer
+from . import tokenizer
 
 def _safe_dparse(ts):
     try:
@@ -551,42 +548,13 @@ def netloc_dir(url, nondigit=True, nondate=False, exclude_index=False):
         p = nondate_pathname(p)
     return ('.'.join(hosts), p.lower())
 
-stemmer = None 
-lemmatizer = None
-stem_cache = {}
-
 def tokenize(texts, stop_words='english', nonstop_words=[], stemming=True):
     """
-    Simple function for tokenizing a text. Extracted from sklearn src code
+    Simple function for tokenizing a text. See tokenizer.tokenize
     
     Returns: list of features in the original order
     """
-    global stemmer, lemmatizer, stem_cache
-    if stemmer is None:
-        stemmer = SnowballStemmer('english')
-        lemmatizer = WordNetLemmatizer()
-    texts = texts.replace('_', ' ')
-    # * Merge nonstop words
-    for nsw in nonstop_words:
-        texts = texts.replace(nsw, '')
-    # # ? Tokenize: Scikit-Learn version
-    cv = CountVectorizer(stop_words=stop_words, token_pattern=r"(?u)\b\w+\b") # TODO: Not necessary english
-    analyze = cv.build_analyzer()
-    texts = analyze(texts)
-    # ? Tokenize: nltk version
-    # texts = nltk.word_tokenize(texts)
-    def cached_transform(t, func, cache):
-        if t in cache:
-            return cache[t]
-        tt = func(t)
-        cache[t] = tt
-        return tt
-    # * Stemming
-    if stemming:
-        texts = [cached_transform(t, stemmer.stem, stem_cache) for t in texts]
-    # * Lemmatization
-    # texts = [lemmatizer.lemmatize(t) for t in texts]
-    return texts
+    return tokenizer.tokenize(texts, stop_words=stop_words, nonstop_words=nonstop_words, stemming=stemming)
 
 def tokenize_url(url, include_all=False, process=False):
     """
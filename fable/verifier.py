@@ -248,15 +248,35 @@ class Verifier:
         self._crawled = set()
         self.memo = memo
         self.similar = similar
-
-    def clear(self):
+        self._src = None
+        self._alias_match_base = defaultdict(dict) # * _url_alias_match set by adding candidates
+        self._order = {} # * {url / (url, cand): (section, seq)} Order as if all candidates are added at once
+        self._seq = 0
+        # * Caches that survive clear(): rules only depend on (url, cand, title) when not common_prefix
+        self._rule_cache = {}
+        self._suspicious_cache = {}
+        self._score_cache = {}
+        self._cluster_keys = {} # * {rule: _score_cache key of its cluster in the last ranking}
+
+    def clear(self, cache=False):
+        """
+        cache: Whether to also drop rules/scores cached for previous candidates
+        """
         self.url_candidates = defaultdict(lambda: defaultdict(set)) # * {url: {cand: {matched}}}
         self.url_title = {}
         self._url_alias_match = defaultdict(dict)
+        self._alias_match_base = defaultdict(dict)
+        self._order = {}
+        self._seq = 0
         self._crawled = set()
         self.s_clusters = None
         self._g_clusters = None
         self._r_clusters = None
+        self._cluster_keys = {}
+        if cache:
+            self._rule_cache = {}
+            self._suspicious_cache = {}
+            self._score_cache = {}
 
     def _method_str(self, reason):
         return f"{reason['method']}:{reason.get('type', '')}"
@@ -290,14 +310,13 @@ class Verifier:
         cands_titles = {}
         cands = [c[1] for c in url_cand if url_utils.url_match(target_url, c[0])]
         cands_htmls = {}
+        cands = [cand for cand in cands if not (cand in alias_match and 'fuzzy_search' not in alias_match[cand])]
+        # # * Sanity check (SE could also got broken pages)
+        # if sic_transit.broken(cand, html=True)[0] != False:
+        #     continue
+        cand_crawls = self.memo.crawl_many(cands)
         for cand in cands:
-            if cand in alias_match and 'fuzzy_search' not in alias_match[cand]:
-                continue
-        
-            # # * Sanity check (SE could also got broken pages)
-            # if sic_transit.broken(cand, html=True)[0] != False:
-            #     continue
-            cand_html = self.memo.crawl(cand)
+            cand_html = cand_crawls[cand]
             if cand_html is None: continue
             cands_htmls[cand] = cand_html
             cands_contents[cand] = self.memo.extract_content(cand_html)
@@ -313,11 +332,22 @@ class Verifier:
         return self._url_alias_match[target_url]
     
 
+    def _add_candidate(self, url, cand, method, section=0):
+        """
+        Add (normed) url, cand to url_candidates
+        section: 0 for alias, 1 for examples. Clusters are formed in (section, first seen) order
+        """
+        self._seq += 1
+        for key in [url, (url, cand)]:
+            self._order[key] = min(self._order.get(key, (section, self._seq)), (section, self._seq))
+        self.url_candidates[url][cand].add(method)
+        self.s_clusters = None
+
     def add_urlalias(self, url, alias, title, reason):
         url = self._url_norm(url)
         cand = self._url_norm(alias)
         method = self._method_str(reason)
-        self.url_candidates[url][cand].add(method)
+        self._add_candidate(url, cand, method)
         self.url_title[url] = title
 
     def add_aliasexample(self, aliasexmaple, clear=False):
@@ -348,12 +378,12 @@ class Verifier:
                 # if len(matched_token.split(' ')) <= 1:
                 #     continue
             if reason['type'] != 'fuzzy_search':
-                self._url_alias_match[url][cand] = self._method_str(reason)
+                self._alias_match_base[url][cand] = self._method_str(reason)
             if self._debug:
                 if reason['method'] != 'wayback_alias':
                     reason['type'] = 'fuzzy_search'
             method = self._method_str(reason)
-            self.url_candidates[url][cand].add(method)
+            self._add_candidate(url, cand, method, section=0)
             self.url_title[url] = title
         
         for obj in aliasexmaple['examples']:
@@ -374,8 +404,15 @@ class Verifier:
                 if reason['method'] != 'wayback_alias':
                     reason['type'] = 'fuzzy_search'
             method = self._method_str(reason)
-            self.url_candidates[url][cand].add(method)
+            self._add_candidate(url, cand, method, section=1)
             self.url_title[url] = title
+
+    def add_candidates(self, aliasexample):
+        """
+        Incrementally add {"alias": [], "examples": []} on top of previous candidates
+        Call update_clusters (or verify_url) afterwards. Results are the same as adding all candidates at once
+        """
+        self.add_aliasexample(aliasexample, clear=False)
     
     def add_gtobj(self, gt_obj, clear=False):
         """
@@ -398,12 +435,12 @@ class Verifier:
                     reason = search_alias[1].copy()
                     alias = self._url_norm(search_alias[0])
                     if reason['type'] != 'fuzzy_search':
-                        self._url_alias_match[url][alias] = self._method_str(reason)
+                        self._alias_match_base[url][alias] = self._method_str(reason)
                     if self._debug:
                         if reason['method'] != 'wayback_alias':
                             reason['type'] = 'fuzzy_search'
                         pass
-                    self.url_candidates[url][alias].add(self._method_str(reason))
+                    self._add_candidate(url, alias, self._method_str(reason))
         # * Backlink
         backlink_alias = gt_obj.get('backlink', None)
         if backlink_alias is not None and backlink_alias[0] is not None:
@@ -411,12 +448,12 @@ class Verifier:
             reason = backlink_alias[1].copy()
             alias = self._url_norm(backlink_alias[0])
             if reason['type'] != 'fuzzy_search':
-                self._url_alias_match[url][alias] = self._method_str(reason)
+                self._alias_match_base[url][alias] = self._method_str(reason)
             if self._debug:
                 if reason['method'] != 'wayback_alias' and reason['type'] != 'archive_canonical':
                     reason['type'] = 'fuzzy_search'
                 pass
-            self.url_candidates[url][alias].add(self._method_str(reason))
+            self._add_candidate(url, alias, self._method_str(reason))
         # * Inference
         infer_alias = gt_obj.get('inference', None)
         if infer_alias is not None and infer_alias[0] is not None:
@@ -424,12 +461,12 @@ class Verifier:
             reason = infer_alias[1].copy()
             alias = self._url_norm(infer_alias[0])
             if reason['type'] != 'fuzzy_search':
-                self._url_alias_match[url][alias] = self._method_str(reason)
+                self._alias_match_base[url][alias] = self._method_str(reason)
             if self._debug:
                 if reason['method'] not in ['wayback_alias', 'inference']:
                     reason['type'] = 'fuzzy_search'
                 pass
-            self.url_candidates[url][alias].add(self._method_str(reason))
+            self._add_candidate(url, alias, self._method_str(reason))
         
         # * Prepare for examples
         examples = gt_obj.get('examples', [])
@@ -449,14 +486,39 @@ class Verifier:
                 if reason['method'] == 'redirection':
                     continue
                 pass
-            self.url_candidates[ex_url][ex_cand].add(self._method_str(reason))  
+            self._add_candidate(ex_url, ex_cand, self._method_str(reason))
+
+    def _ordered_candidates(self):
+        """url_candidates in the order as if they were all added at once"""
+        ordered = {}
+        for url in sorted(self.url_candidates, key=lambda u: self._order[u]):
+            cands = self.url_candidates[url]
+            ordered[url] = {cand: cands[cand] for cand in sorted(cands, key=lambda c: self._order[(url, c)])}
+        return ordered
+
+    def _suspicious(self, url, cand):
+        if (url, cand) not in self._suspicious_cache:
+            self._suspicious_cache[(url, cand)] = url_utils.suspicious_alias(url, cand)
+        return self._suspicious_cache[(url, cand)]
+
+    def _transformation_rule(self, url, cand, title, all_pairs):
+        """Cached URLAlias.transformation_rules. Return: (hostname, tuple(rules))"""
+        key = (url, cand, title)
+        if not self._common_prefix and key in self._rule_cache:
+            return self._rule_cache[key]
+        ua = URLAlias(url, cand, {}, title=title)
+        rule = ua.transformation_rules(common_prefix=self._common_prefix, others_pairs=all_pairs)
+        rule = (rule[0], tuple([r for r in rule[1]]))
+        if not self._common_prefix:
+            self._rule_cache[key] = rule
+        return rule
 
     def _filter_suspicious_cands(self):
         new_url_candidates = defaultdict(lambda: defaultdict(set))
         # * Filter cands that looks suspicious
-        for url, cands in self.url_candidates.items():
+        for url, cands in self._ordered_candidates().items():
             for cand, v in cands.items():
-                if url_utils.suspicious_alias(url, cand):
+                if self._suspicious(url, cand):
                     continue
                 new_url_candidates[url][cand] = v
         url_candidates = new_url_candidates
@@ -482,10 +544,12 @@ class Verifier:
         Return cluster: [{pattern, [candidates]}]
         """
         url_candidates = self._filter_suspicious_cands()
+        # * Other pairs only matter for common prefix
         all_pairs = []
-        for url, candidates in url_candidates.items(): 
-            for cand in candidates:
-                all_pairs.append(URLAlias(url, cand, {}))
+        if self._common_prefix:
+            for url, candidates in url_candidates.items(): 
+                for cand in candidates:
+                    all_pairs.append(URLAlias(url, cand, {}))
 
         cluster = defaultdict(list)
         for turl, tcands in url_candidates.items():
@@ -494,16 +558,30 @@ class Verifier:
                 if not self._fuzzy:
                     if len(reason) > 1 and 'search:fuzzy_search' in reason:
                         reason.remove('search:fuzzy_search')
-                ua = URLAlias(turl, tcand, {}, title=title)
-                rule = ua.transformation_rules(common_prefix=self._common_prefix, others_pairs=all_pairs)
-                rule = (rule[0], tuple([r for r in rule[1]]))
-                ua_tuple = list(ua.to_tuple())
-                ua_tuple[-1] = '+'.join(reason)
+                rule = self._transformation_rule(turl, tcand, title, all_pairs)
+                ua_tuple = [turl, tcand, '+'.join(reason)]
                 cluster[rule].append(ua_tuple)
         cluster = [{'values': v, "rule": [k[0],list(k[1])]} for k, v in cluster.items()]
         return cluster
      
     def _rank_cluster(self, cluster):
+        cluster_score = []
+        for c in cluster:
+            # * Clusters not touched since last ranking reuse their score, touched ones drop their old score
+            rule = (self._src, c['rule'][0], tuple(c['rule'][1]))
+            key = rule + (tuple(tuple(v) for v in c['values']),)
+            old_key = self._cluster_keys.get(rule)
+            if old_key is not None and old_key != key:
+                self._score_cache.pop(old_key, None)
+            self._cluster_keys[rule] = key
+            if key not in self._score_cache:
+                self._score_cache[key] = self._score_cluster(c)
+            if self._score_cache[key] is not None:
+                cluster_score.append((c, self._score_cache[key]))
+        return sorted(cluster_score, key=lambda x: x[1], reverse=True)
+
+    def _score_cluster(self, c):
+        """Return: score of cluster c, None if c should not be ranked"""
         def __predictability(rule):
             if self._fuzzy:
                 length = len(rule)
@@ -511,36 +589,32 @@ class Verifier:
             else:
                 pred = len([r for r in rule if r[0] == 0])
             return -pred
-        cluster_score = []
-        for c in cluster:
-            seen_orig_url = set()
-            seen_hints = set()
-            pred = __predictability(c['rule'][1])
-            if pred <= -len(c['rule'][1]):
-                    continue 
-            for url, cand, method in c['values']:
-                seen_orig_url.add(url)
-                method = method.split('+')
-                method = [m.split(":")[0] for m in method] + [m.split(":")[1] for m in method]
-                seen_hints.update(set(self.valid_hints.keys()).intersection(method))
-            hint_score = sum([self.valid_hints[s] for s in seen_hints])
-            if self._fuzzy:
-                # ! Diff1. Ground truth
-                if self._src == 'gt' and len(c['values']) == 1 and tuple(c['rule'][1][-1]) < (1, ""):
-                    continue
-                # ! Diff2. Real-world
-                elif self._src == 'rw' and len(c['values']) == 1:
-                    continue
-                cand_url = defaultdict(set)
-                for url, cand, method in c['values']:
-                    cand_url[cand].add(url)
-                # if max([len(v) for v in cand_url.values()]) > 1:
-                #     continue
-                cluster_score.append((c, (hint_score, pred, len(seen_orig_url))))         
-            else:
-                if hint_score > 0:
-                    cluster_score.append((c, (hint_score, pred, len(seen_orig_url))))
-        return sorted(cluster_score, key=lambda x: x[1], reverse=True)
+        seen_orig_url = set()
+        seen_hints = set()
+        pred = __predictability(c['rule'][1])
+        if pred <= -len(c['rule'][1]):
+            return
+        for url, cand, method in c['values']:
+            seen_orig_url.add(url)
+            method = method.split('+')
+            method = [m.split(":")[0] for m in method] + [m.split(":")[1] for m in method]
+            seen_hints.update(set(self.valid_hints.keys()).intersection(method))
+        hint_score = sum([self.valid_hints[s] for s in seen_hints])
+        if self._fuzzy:
+            # ! Diff1. Ground truth
+            if self._src == 'gt' and len(c['values']) == 1 and tuple(c['rule'][1][-1]) < (1, ""):
+                return
+            # ! Diff2. Real-world
+            elif self._src == 'rw' and len(c['values']) == 1:
+                return
+            # cand_url = defaultdict(set)
+            # for url, cand, method in c['values']:
+            #     cand_url[cand].add(url)
+            # if max([len(v) for v in cand_url.values()]) > 1:
+            #     continue
+            return (hint_score, pred, len(seen_orig_url))
+        elif hint_score > 0:
+            return (hint_score, pred, len(seen_orig_url))
 
     def _satisfied_cluster(self, cluster, top_clusters):
         def __more_trustable(r1, r2):
@@ -638,6 +712,30 @@ class Verifier:
         return new_cluster
 
 
+    def update_clusters(self):
+        """
+        (Re)generate, rank and select clusters from current candidates
+        Rules and cluster scores are cached, so after add_candidates only new pairs get rules computed
+        and only clusters touched by them get rescored (their previous scores are dropped)
+        Grouping pairs into clusters is still redone over all candidates every time:
+        the suspicious filter depends on all candidates, and verify_url rewrites cluster values in place
+        """
+        self._url_alias_match = defaultdict(dict, {u: m.copy() for u, m in self._alias_match_base.items()})
+        cluster = self._gen_cluster()
+        self._g_clusters = cluster
+        cluster = self._rank_cluster(cluster)
+        self._r_clusters = cluster
+        if len(cluster) > 0:
+            top_cluster = cluster[0]
+            top_clusters = [top_cluster[0]]
+            for c, score in cluster[1:]:
+                if len(c['rule'][1]) == len(top_cluster[0]['rule'][1]) and score[1] >= top_cluster[1][1]: top_clusters.append(c)
+                else: break # TODO: Need this policy?
+            cluster = [c[0] for c in cluster[len(top_clusters):]]
+            self.s_clusters = self._satisfied_cluster(cluster, top_clusters)
+        else:
+            self.s_clusters = []
+
     def verify_url(self, url):
         """
         verify candidates for url, return [verified obj]
@@ -647,20 +745,7 @@ class Verifier:
         """
         url = self._url_norm(url)
         if self.s_clusters is None:
-            cluster = self._gen_cluster()
-            self._g_clusters = cluster
-            cluster = self._rank_cluster(cluster)
-            self._r_clusters = cluster
-            if len(cluster) > 0:
-                top_cluster = cluster[0]
-                top_clusters = [top_cluster[0]]
-                for c, score in cluster[1:]:
-                    if len(c['rule'][1]) == len(top_cluster[0]['rule'][1]) and score[1] >= top_cluster[1][1]: top_clusters.append(c)
-                    else: break # TODO: Need this policy?
-                cluster = [c[0] for c in cluster[len(top_clusters):]]
-                self.s_clusters = self._satisfied_cluster(cluster, top_clusters)
-            else:
-                self.s_clusters = []
+            self.update_clusters()
         s_clusters = [self._more_property_match(s, url) for s in self.s_clusters]
         s_clusters = [s for s in s_clusters if self._valid_cluster(s, url)]
 
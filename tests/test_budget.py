@@ -0,0 +1,44 @@
+"""
+Budget limits and per-technique accounting
+"""
+import pytest
+import threading
+
+from fable.budget import Budget
+
+def test_budget_exhausted():
+    budget = Budget(max_crawls=3, max_searches=1)
+    assert(budget.limited())
+    with budget.track('search'):
+        budget.charge('search')
+        budget.charge('crawl')
+    assert(budget.exhausted() and budget.exhausted_reason == 'search')
+    budget.start()
+    assert(not budget.exhausted())
+    with budget.track('hist_redir'):
+        budget.charge('crawl', n=2)
+        budget.charge('cdx')
+    assert(not budget.exhausted())
+    budget.charge('crawl')
+    assert(budget.exhausted() and budget.exhausted_reason == 'crawl')
+    report = budget.report()
+    assert(report['crawl'] == 3 and report['cdx'] == 1 and report['search'] == 0)
+    assert(report['techniques']['hist_redir']['crawl'] == 2)
+    assert(report['techniques']['other']['crawl'] == 1)
+    assert('search' not in report['techniques'])
+    assert(not Budget().limited())
+
+def test_budget_track_per_thread():
+    budget = Budget()
+    def prefetch():
+        with budget.track('search'):
+            budget.charge('search')
+    with budget.track('verify'):
+        t = threading.Thread(target=prefetch)
+        t.start()
+        t.join()
+        budget.charge('crawl')
+    report = budget.report()
+    assert(report['techniques']['search']['search'] == 1)
+    assert(report['techniques']['verify']['crawl'] == 1)
+    assert(report['techniques']['verify']['search'] == 0)
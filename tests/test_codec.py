@@ -0,0 +1,47 @@
+"""
+Crawl html codecs: zstd with trained dictionaries, old brotli docs still read
+"""
+import brotli
+
+from fable import tools
+from fable.utils import storage, codec
+
+def page(site, i):
+    nav = ''.join(f'<li><a href="/{site}/section{j}">Section {j} of {site}</a></li>' for j in range(30))
+    return f'<html><head><title>{site} {i}</title></head><body><ul>{nav}</ul><p>Article {i} about {i * 7} things</p></body></html>'
+
+def test_codec_dict(tmp_path):
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    for i in range(40):
+        html = page('a.com', i)
+        db.crawl.insert_one({'_id': f'http://a.com/{i}', 'url': f'http://a.com/{i}', 'site': 'a.com', 'html': brotli.compress(html.encode()), 'ttl': 0})
+    codec.train_dictionaries(db, size=4096, recompress=True)
+    assert(db.zstd_dicts.count_documents({'key': 'site:a.com'}) == 1)
+    doc = db.crawl.find_one({'_id': 'http://a.com/3'})
+    assert(doc['codec'] == 'zstd' and doc['dict_id'].startswith('site:a.com:'))
+    # * Fresh codec reads dictionary from db, and legacy brotli docs (no codec field)
+    c = codec.HtmlCodec(codec='zstd', db=db)
+    assert(c.decompress(doc) == page('a.com', 3))
+    assert(c.decompress({'html': brotli.compress(b'<html></html>')}) == '<html></html>')
+    fields = c.compress(page('a.com', 100), site='a.com')
+    assert(fields['dict_id'] == doc['dict_id'] and len(fields['html']) < len(brotli.compress(page('a.com', 100).encode())))
+    # * Memoizer stores crawls with its codec
+    memo = tools.Memoizer(db=db, cache=tools.CrawlCache(), codec=c)
+    memo.db.crawl.update_one({'_id': 'http://a.com/new'}, {'$set': memo._crawl_obj('http://a.com/new', page('a.com', 200), 'http://a.com/new', 1e12)}, upsert=True)
+    assert(memo.crawl('http://a.com/new') == page('a.com', 200))
+
+def test_codec_dictionary_smaller(tmp_path):
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    htmls = [page('a.com', i) for i in range(40)]
+    c = codec.HtmlCodec(codec='zstd', db=db)
+    c.train(htmls[:20], 'site:a.com', size=4096)
+    plain = codec.HtmlCodec(codec='zstd', db=db, use_dict=False)
+    size = lambda c: sum(len(c.compress(h, site='a.com')['html']) for h in htmls[20:])
+    assert(size(c) < size(plain))
+
+def test_config_defaults():
+    from fable import config
+    # * Unset keys read their DEFAULT_CONFIG value
+    for key in ['crawl_codec', 'storage']:
+        if key not in config.var_dict:
+            assert(config.config(key) == config.DEFAULT_CONFIG[key])
@@ -0,0 +1,218 @@
+"""
+In-memory crawl cache of Memoizer: LRU bounded by bytes, ttl respected
+"""
+import pytest
+import sys
+import time
+
+from fable import tools
+
+def test_crawl_cache_lru():
+    html = 'x' * 1000
+    entry_size = tools.CrawlCache()._entry_size('http://a.com/0', html, None)
+    cache = tools.CrawlCache(max_bytes=entry_size * 3)
+    for i in range(3):
+        cache.put(f'http://a.com/{i}', html)
+    assert(cache.get('http://a.com/0') == (html, None)) # * 0 becomes most recent
+    cache.put('http://a.com/3', html)
+    assert(cache.get('http://a.com/1') is None) # * Least recent evicted
+    assert(cache.get('http://a.com/0') is not None)
+    assert(cache.size <= cache.max_bytes)
+    stats = cache.stats()
+    assert(stats['hits'] == 2 and stats['misses'] == 1 and stats['evictions'] == 1 and stats['entries'] == 3)
+    # * Too large to be cached at all
+    cache.put('http://a.com/large', 'x' * entry_size * 4)
+    assert(cache.get('http://a.com/large') is None)
+
+def test_crawl_cache_ttl_final_url():
+    cache = tools.CrawlCache()
+    cache.put('http://a.com/expired', 'html', ttl=time.time() - 1)
+    assert(cache.get('http://a.com/expired') is None)
+    assert(cache.stats()['entries'] == 0)
+    # * Wayback crawls never expire
+    wayback_url = 'http://web.archive.org/web/2010/http://a.com/'
+    cache.put(wayback_url, 'html', ttl=time.time() - 1)
+    assert(cache.get(wayback_url) == ('html', None))
+    # * Final url required but not known
+    assert(cache.get(wayback_url, final_url=True) is None)
+    cache.put(wayback_url, 'html', final_url='http://web.archive.org/web/2010/http://a.com/index.html')
+    assert(cache.get(wayback_url, final_url=True)[1].endswith('index.html'))
+    cache.put(wayback_url, 'new html')
+    assert(cache.get(wayback_url, final_url=True) == ('new html', 'http://web.archive.org/web/2010/http://a.com/index.html'))
+    cache.invalidate(wayback_url)
+    assert(cache.get(wayback_url) is None)
+
+def test_crawl_many(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    import threading
+    from fable.utils import storage
+    inflight, max_inflight, fetched = {}, {}, []
+    lock = threading.Lock()
+    def requests_crawl(url, raw=False, **kwargs):
+        host = url.split('/')[2]
+        with lock:
+            fetched.append(url)
+            inflight[host] = inflight.get(host, 0) + 1
+            max_inflight[host] = max(max_inflight.get(host, 0), inflight[host])
+        time.sleep(0.05)
+        with lock:
+            inflight[host] -= 1
+        if 'broken' in url:
+            return None
+        return SimpleNamespace(status_code=200, text=f'html of {url}', url=url + '?final', headers={})
+    monkeypatch.setattr(tools.crawl, 'requests_crawl', requests_crawl)
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    memo = tools.Memoizer(db=db, cache=tools.CrawlCache())
+    memo.crawl('http://a.com/0')
+    urls = [f'http://{h}.com/{i}' for h in 'ab' for i in range(4)] + ['http://a.com/broken']
+    results = memo.crawl_many(urls, final_url=True, per_host=2)
+    assert(list(results.keys()) == urls)
+    assert(results['http://a.com/1'] == ('html of http://a.com/1', 'http://a.com/1?final'))
+    assert(results['http://a.com/broken'] == (None, None))
+    assert(max(max_inflight.values()) <= 2)
+    # * Persisted in bulk, served from cache/db afterwards
+    assert(db.crawl.count_documents({}) == 8)
+    fetched.clear()
+    memo.cache.clear()
+    assert(memo.crawl_many(urls[:-1])['http://b.com/3'] == 'html of http://b.com/3')
+    assert(fetched == [])
+
+def test_crawl_revalidate(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    from requests.structures import CaseInsensitiveDict
+    from fable.utils import storage
+    sent = []
+    def requests_crawl(url, raw=False, headers={}, **kwargs):
+        sent.append(headers)
+        if headers.get('If-None-Match') == '"v1"':
+            return SimpleNamespace(status_code=304, text='', url=url, headers=CaseInsensitiveDict({'ETag': '"v1"', 'Cache-Control': 'max-age=100'}))
+        return SimpleNamespace(status_code=200, text='html v1', url=url, headers=CaseInsensitiveDict({'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}))
+    monkeypatch.setattr(tools.crawl, 'requests_crawl', requests_crawl)
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    memo = tools.Memoizer(db=db, cache=tools.CrawlCache())
+    url = 'http://a.com/page'
+    assert(memo.crawl(url) == 'html v1' and sent[-1] == {})
+    # * Expire the crawl, keeping its extraction
+    db.crawl.update_one({'_id': url}, {'$set': {'ttl': time.time() - 1, 'title': 'Page'}})
+    memo.cache.clear()
+    assert(memo.crawl(url) == 'html v1')
+    assert(sent[-1] == {'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+    doc = db.crawl.find_one({'_id': url})
+    assert(doc['ttl'] > time.time() and doc['title'] == 'Page')
+    # * Batch version revalidates too
+    db.crawl.update_one({'_id': url}, {'$set': {'ttl': time.time() - 1}})
+    memo.cache.clear()
+    assert(memo.crawl_many([url]) == {url: 'html v1'})
+    assert(len(sent) == 3 and db.crawl.find_one({'_id': url})['title'] == 'Page')
+
+def test_negative_cache(tmp_path, monkeypatch):
+    from fable.utils import storage
+    from fable.utils.negative_cache import NegativeCache
+    from fable.utils.singleflight import SingleFlight
+    # * Failures are also remembered by the flight for its lease ttl
+    monkeypatch.setattr(tools, 'flight', SingleFlight(lease_ttl=0.5))
+    requested = []
+    def requests_crawl(url, raw=False, failure=None, **kwargs):
+        requested.append(url)
+        if 'blocked' in url:
+            failure.update({'kind': 'robots', 'reason': 'Not Allowed by Robot.txt'})
+            return None, 'Not Allowed by Robot.txt'
+        elif 'dead' in url:
+            failure.update({'kind': 'http', 'reason': 'HTTP 404'})
+        else:
+            failure.update({'kind': 'transport', 'reason': 'Timeout'})
+    monkeypatch.setattr(tools.crawl, 'requests_crawl', requests_crawl)
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    negative = NegativeCache(ttl={'transport': 0.5}, db=db)
+    memo = tools.Memoizer(db=db, cache=tools.CrawlCache(), negative_cache=negative)
+    url = 'http://a.com/timeout'
+    assert(memo.crawl(url) is None and memo.crawl(url, final_url=True) == (None, None))
+    assert(memo.crawl_many([url]) == {url: None})
+    assert(requested == [url])
+    assert(db.crawl_failed.find_one({'_id': f'crawl:{url}'})['reason'] == 'Timeout')
+    # * Other processes see it through db, other callers (namespaces) do not
+    assert(NegativeCache(ttl=0.5, db=db).get(url) == 'Timeout')
+    assert(NegativeCache(ttl=0.5, db=db).get(url, namespace='status') is None)
+    time.sleep(0.6)
+    assert(memo.crawl(url) is None and len(requested) == 2)
+    # * 4xx and robots-disallowed are remembered with their own (longer) ttl
+    dead, blocked = 'http://a.com/dead', 'http://a.com/blocked'
+    assert(memo.crawl(dead) is None and memo.crawl(blocked) is None)
+    assert(db.crawl_failed.find_one({'_id': f'crawl:{dead}'})['kind'] == 'http')
+    assert(db.crawl_failed.find_one({'_id': f'crawl:{blocked}'})['reason'] == 'Not Allowed by Robot.txt')
+    time.sleep(0.6)
+    assert(memo.crawl(dead) is None and memo.crawl_many([blocked]) == {blocked: None})
+    assert(requested.count(dead) == 1 and requested.count(blocked) == 1)
+    # * Misses are remembered shortly, without querying db again
+    fresh = NegativeCache(ttl=60, db=db)
+    assert(fresh.get('http://a.com/ok') is None)
+    db.crawl_failed.insert_one({'_id': 'crawl:http://a.com/ok', 'url': 'http://a.com/ok', 'reason': 'Timeout', 'ttl': time.time() + 60})
+    assert(fresh.get('http://a.com/ok') is None)
+
+def test_crawl_coalesced(tmp_path, monkeypatch):
+    import threading
+    from types import SimpleNamespace
+    from fable.utils import storage
+    from fable.utils.singleflight import SingleFlight
+    monkeypatch.setattr(tools, 'flight', SingleFlight())
+    requested = []
+    def requests_crawl(url, raw=False, **kwargs):
+        requested.append((url, str(kwargs.get('proxies'))))
+        time.sleep(0.2)
+        return SimpleNamespace(status_code=200, text='<html>page</html>', url=url, headers={})
+    monkeypatch.setattr(tools.crawl, 'requests_crawl', requests_crawl)
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    memos = [tools.Memoizer(db=db, cache=tools.CrawlCache()) for _ in range(2)]
+    url = 'http://a.com/page'
+    results = []
+    # * crawl and crawl_many of the same url share one fetch
+    threads = [threading.Thread(target=lambda: results.append(memos[0].crawl(url))), 
+               threading.Thread(target=lambda: results.append(memos[1].crawl_many([url])[url]))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert(results == ['<html>page</html>'] * 2 and len(requested) == 1)
+    assert(db.leases.count_documents({}) == 0)
+    # * Different options are not coalesced
+    other = 'http://a.com/other'
+    threads = [threading.Thread(target=lambda p=p: memos[0].crawl(other, proxies=p)) for p in [{}, {'http': 'p'}]]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert(len([r for r in requested if r[0] == other]) == 2)
+
+def test_more_crawls_batch(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    from fable.utils import storage
+    requested = []
+    def requests_crawl(url, raw=False, **kwargs):
+        requested.append(url)
+        return SimpleNamespace(status_code=200, text=f'<html><title>{url}</title></html>', url=url, headers={})
+    monkeypatch.setattr(tools.crawl, 'requests_crawl', requests_crawl)
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    memo = tools.Memoizer(db=db, cache=tools.CrawlCache())
+    monkeypatch.setattr(memo, 'extract_title', lambda html, **kwargs: html)
+    monkeypatch.setattr(memo, 'extract_content', lambda html, **kwargs: html)
+    links = ''.join(f'<a href="http://a.com/dir/page{i}.html">{i}</a>' for i in range(8))
+    html = f'<html><body>{links}</body></html>'
+    # * Stop at 2 samples, without crawling a whole batch
+    more_crawls = memo.get_more_crawls('http://a.com/dir/index.html', html=html)
+    assert(len(more_crawls) == 2 and len(requested) == 2)
+
+def test_extraction_crawl_fields_versioned(tmp_path, monkeypatch):
+    from fable.utils import storage
+    monkeypatch.setattr(tools.text_utils, 'extract_title', lambda html, version='mine', **kwargs: f'{version} title')
+    monkeypatch.setattr(tools.text_utils, 'extract_title_body', lambda html, **kwargs: ('tb title', 'tb content'))
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    memo = tools.Memoizer(db=db, cache=tools.CrawlCache())
+    html = '<html><title>Page</title></html>'
+    db.crawl.insert_one({'_id': 'http://a.com/page', 'url': 'http://a.com/page', 'digest': tools.html_digest(html)})
+    assert(memo.extract_title_content(html) == ('tb title', 'tb content'))
+    assert(db.crawl.find_one({'_id': 'http://a.com/page'})['title_version'] == 'title_body@1')
+    # * Crawl fields of another extractor are not reused nor kept
+    db.extractions.delete_many({})
+    assert(memo.extract_title(html) == 'mine title')
+    assert(memo.extract_title(html, version='domdistiller') == 'domdistiller title')
+    crawl = db.crawl.find_one({'_id': 'http://a.com/page'})
+    assert(crawl['title'] == 'domdistiller title' and crawl['title_version'] == 'domdistiller@1')
+    db.extractions.delete_many({})
+    assert(memo.extract_title(html, version='domdistiller') == 'domdistiller title')
+    assert(memo.extract_title(html) == 'mine title')
@@ -0,0 +1,29 @@
+"""
+entrypoint: jsonl output in input order, whatever the workers and scheduling
+"""
+import json
+import sys
+import pytest
+
+import entrypoint
+
+def test_jsonl_parallel_matches_serial(tmp_path, monkeypatch):
+    input_urls = [{'netloc_dir': f'{site}/dir{i}', 'urls': []} for i, site in enumerate(['a.com', 'b.com', 'a.com', 'c.com', 'b.com'])]
+    input_file = tmp_path / 'input.json'
+    json.dump(input_urls, open(input_file, 'w'))
+    def run(input_urls, log_file, workers=1, site_affinity=True, **kwargs):
+        order = [(idx, obj) for batch in entrypoint.schedule_by_site(input_urls) for idx, obj in batch] \
+                    if site_affinity else list(enumerate(input_urls))
+        # * Workers finish in any order
+        if workers > 1: order = order[::-1]
+        for idx, obj in order:
+            yield idx, {'netloc_dir': obj['netloc_dir'], 'aliases': []}
+    monkeypatch.setattr(entrypoint, 'run', run)
+    outputs = {}
+    for workers in [1, 4]:
+        output_file = tmp_path / f'output_{workers}.jsonl'
+        monkeypatch.setattr(sys, 'argv', ['entrypoint.py', '--workers', str(workers), '--log', str(tmp_path / 'run.log'), str(input_file), str(output_file)])
+        entrypoint.main()
+        outputs[workers] = open(output_file).read()
+    assert(outputs[1] == outputs[4])
+    assert([json.loads(l)['netloc_dir'] for l in outputs[1].splitlines()] == [obj['netloc_dir'] for obj in input_urls])
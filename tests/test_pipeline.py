@@ -0,0 +1,23 @@
+"""
+StageScheduler should order stages by hit rate per cost, and learn from recorded runs
+"""
+import pytest
+
+from fable import pipeline
+
+def test_scheduler_order():
+    scheduler = pipeline.StageScheduler(persist=False)
+    # * Declared priors: cheap archive based stages before search
+    order = [s.name for s in scheduler.order('url')]
+    assert(order.index('hist_redir') < order.index('search'))
+    assert(order.index('archive_canonical') < order.index('search'))
+    assert([s.name for s in scheduler.order('directory')] == ['neighbor'])
+
+    # * Search keeps resolving URLs quickly, hist_redir keeps failing slowly
+    stages = {s.name: s for s in scheduler.stages}
+    for _ in range(20):
+        scheduler.record(stages['search'], True, 1)
+        scheduler.record(stages['hist_redir'], False, 10)
+    order = [s.name for s in scheduler.order('url')]
+    assert(order.index('search') < order.index('hist_redir'))
+    assert(scheduler.stats['search'] == {'tries': 20, 'hits': 20, 'time': 20})
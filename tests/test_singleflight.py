@@ -0,0 +1,88 @@
+"""
+Concurrent calls with the same key should run only once, in process and across processes (through leases)
+"""
+import pytest
+import time
+import threading
+
+from fable.utils import storage
+from fable.utils.singleflight import SingleFlight
+
+def test_singleflight_in_process():
+    flight = SingleFlight()
+    runs = []
+    def fn():
+        runs.append(1)
+        time.sleep(0.2)
+        return 'result'
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', fn))) for _ in range(5)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert(len(runs) == 1 and results == ['result'] * 5)
+    assert(flight.stats['coalesced'] == 4)
+    # * Errors are raised to all callers, and the key can be run again afterwards
+    def fail():
+        raise ValueError('failed')
+    with pytest.raises(ValueError):
+        flight.do('key', fail)
+    assert(flight.do('key', fn) == 'result')
+
+def test_singleflight_lease(tmp_path):
+    # * Two SingleFlights play two processes sharing the db
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    flights = [SingleFlight(poll=0.05), SingleFlight(poll=0.05)]
+    runs = []
+    def fn():
+        runs.append(1)
+        time.sleep(0.3)
+        db.results.update_one({'_id': 'key'}, {'$set': {'value': 'result'}}, upsert=True)
+        return 'result'
+    def lookup():
+        doc = db.results.find_one({'_id': 'key'})
+        return doc['value'] if doc else None
+    results = []
+    threads = [threading.Thread(target=lambda f=f: results.append(f.do('key', fn, lookup=lookup, lease_db=db))) for f in flights]
+    threads[0].start()
+    time.sleep(0.1)
+    threads[1].start()
+    for t in threads: t.join()
+    assert(len(runs) == 1 and results == ['result'] * 2)
+    assert(flights[1].stats['lease_waits'] == 1)
+    assert(db.leases.count_documents({}) == 0)
+    # * Expired lease (holder died) is taken over
+    db.leases.insert_one({'_id': 'dead', 'owner': 'other', 'expire': time.time() - 1})
+    assert(flights[0].do('dead', lambda: 'taken', lookup=lambda: None, lease_db=db) == 'taken')
+
+def test_singleflight_failed(tmp_path):
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    flights = [SingleFlight(poll=0.05, lease_ttl=0.5), SingleFlight(poll=0.05, lease_ttl=0.5)]
+    runs = []
+    def fn():
+        runs.append(1)
+        time.sleep(0.2)
+        return None
+    failed = lambda r: r is None
+    results = []
+    threads = [threading.Thread(target=lambda f=f: results.append(f.do('empty', fn, lookup=lambda: None, lease_db=db, \
+                                failed=failed, default='default'))) for f in flights]
+    threads[0].start()
+    time.sleep(0.1)
+    threads[1].start()
+    for t in threads: t.join()
+    # * Waiting process gets default instead of running again, the failed mark stays for lease ttl
+    assert(len(runs) == 1 and sorted(results, key=str) == [None, 'default'])
+    assert(db.leases.find_one({'_id': 'empty'})['failed'])
+    assert(flights[0].do('empty', fn, lookup=lambda: None, lease_db=db, failed=failed) is None)
+    assert(flights[1].do('empty', fn, lookup=lambda: None, lease_db=db, failed=failed, default='default') == 'default')
+    assert(len(runs) == 1)
+    time.sleep(0.6)
+    assert(flights[1].do('empty', fn, lookup=lambda: None, lease_db=db, failed=failed) is None and len(runs) == 2)
+
+def test_flight_key():
+    from fable.utils.singleflight import flight_key
+    assert(flight_key('crawl', 'http://a.com/') == 'crawl:http://a.com/')
+    proxied = flight_key('crawl', 'http://a.com/', {'max_retry': 0, 'proxies': {'http': 'p'}})
+    assert(proxied.startswith('crawl:http://a.com/:'))
+    assert(proxied != flight_key('crawl', 'http://a.com/', {'max_retry': 0, 'proxies': {}}))
+    assert(proxied == flight_key('crawl', 'http://a.com/', {'proxies': {'http': 'p'}, 'max_retry': 0}))
@@ -0,0 +1,40 @@
+"""
+Importing fable should be cheap: heavy dependencies and DB connections are deferred to first use
+"""
+import pytest
+import sys
+import json
+import subprocess
+
+HEAVY_MODULES = ['sklearn', 'nltk', 'newspaper', 'goose3', 'justext', 'langdetect', 'dateparser', 'pandas']
+
+def _import_stats(module):
+    """
+    Import module in a fresh interpreter
+
+    Return: {'time': import time, 'loaded': [heavy modules loaded], 'db': whether config.DB is connected}
+    """
+    code = f"""
+import sys, time, json
+start = time.time()
+import {module}
+end = time.time()
+from fable import config
+print(json.dumps({{'time': end - start, 'loaded': [m for m in {HEAVY_MODULES} if m in sys.modules], 'db': 'DB' in vars(config)}}))
+"""
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return json.loads(output.decode().strip().split('\n')[-1])
+
+def test_import_url_utils():
+    stats = _import_stats('fable.utils.url_utils')
+    print(stats)
+    assert(stats['loaded'] == [])
+    assert(not stats['db'])
+    assert(stats['time'] < 2)
+
+def test_import_fable():
+    stats = _import_stats('fable.fable')
+    print(stats)
+    assert(stats['loaded'] == [])
+    assert(not stats['db'])
+    assert(stats['time'] < 5)
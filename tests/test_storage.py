@@ -0,0 +1,79 @@
+"""
+SQLite storage should behave like the mongo collections FABLE uses
+"""
+import pytest
+import re
+import threading
+from pymongo import UpdateOne, InsertOne
+
+from fable.utils import storage
+
+@pytest.fixture
+def db(tmp_path):
+    return storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+
+def test_storage_crud(db):
+    db.crawl.create_index([('site', storage.ASCENDING), ('url', storage.ASCENDING)], unique=True)
+    db.crawl.update_one({'_id': 'http://a.com/1'}, {'$set': {'url': 'http://a.com/1', 'site': 'a.com', 'html': b'\x00\xff', 'ttl': 10}}, upsert=True)
+    db.crawl.update_one({'_id': 'http://a.com/1'}, {'$set': {'title': 'A'}, '$inc': {'hits': 2}}, upsert=True)
+    db.crawl.insert_one({'_id': 'http://web.archive.org/web/2010/http://a.com/1', 'url': 'http://web.archive.org/web/2010/http://a.com/1', 'site': 'a.com'})
+    doc = db.crawl.find_one({'_id': 'http://a.com/1', 'title': {'$exists': True}})
+    assert(doc['html'] == b'\x00\xff' and doc['hits'] == 2 and doc['ttl'] == 10)
+    assert(db.crawl.find_one({'_id': 'http://a.com/1', 'final_url': {'$exists': True}}) is None)
+    # * Unique index
+    with pytest.raises(storage.DuplicateKeyError):
+        db.crawl.insert_one({'url': 'http://a.com/1', 'site': 'a.com'})
+    # * Regex, $or, $in, comparison, projection
+    live = list(db.crawl.find({'site': 'a.com', 'url': re.compile(r'^((?!web\.archive\.org).)*$')}, {'title': True}))
+    assert(live == [{'_id': 'http://a.com/1', 'title': 'A'}])
+    assert(len(list(db.crawl.find({'$or': [{'title': 'A'}, {'url': {'$regex': 'archive'}}]}))) == 2)
+    assert(len(list(db.crawl.find({'_id': {'$in': ['http://a.com/1', 'http://a.com/2']}}))) == 1)
+    assert(db.crawl.count_documents({'ttl': {'$gt': 5, '$lte': 10}}) == 1)
+    db.crawl.update_one({'_id': 'http://a.com/1'}, {'$unset': {'title': ''}})
+    assert('title' not in db.crawl.find_one({'_id': 'http://a.com/1'}))
+    assert(db.crawl.delete_one({'site': 'a.com'}).deleted_count == 1)
+    assert(db.crawl.count_documents({}) == 1)
+
+def test_storage_bulk_aggregate(db):
+    db.corpus.bulk_write([InsertOne({'src': 'realweb', 'content': f'doc {i}'}) for i in range(10)] \
+                        + [InsertOne({'src': 'wayback', 'usage': 'archive', 'content': 'archived'})])
+    db.corpus.bulk_write([UpdateOne({'content': 'doc 0'}, {'$set': {'usage': 'represent'}}, upsert=True),
+                          UpdateOne({'content': 'doc new'}, {'$set': {'src': 'wayback', 'usage': 'represent'}}, upsert=True)], ordered=False)
+    corpus = list(db.corpus.aggregate([
+        {'$match':  {'$or': [{'src': 'realweb'}, {'usage': re.compile('represent')}]}},
+        {'$project': {'content': True}},
+        {'$sample': {'size': 5}},
+    ], allowDiskUse=True))
+    assert(len(corpus) == 5 and all(set(c.keys()) == {'_id', 'content'} for c in corpus))
+    assert(db.corpus.count_documents({'$or': [{'src': 'realweb'}, {'usage': re.compile('represent')}]}) == 11)
+    # * Inserted docs get _id, searched results list stays in order
+    db.searched.insert_one({'query': 'q', 'engine': 'bing', 'results': ['b', 'a']})
+    doc = db.searched.find_one({'query': 'q', 'engine': 'bing'})
+    assert(doc['_id'] and doc['results'] == ['b', 'a'])
+    assert(db.searched.find_one({'results': 'a'}) is not None) # * Array matches by element
+
+def test_storage_concurrent_inc(db):
+    def inc():
+        for _ in range(20):
+            db.stage_stats.update_one({'_id': 'search'}, {'$inc': {'tries': 1}}, upsert=True)
+    threads = [threading.Thread(target=inc) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert(db.stage_stats.find_one({'_id': 'search'})['tries'] == 80)
+
+def test_storage_pushdown(db):
+    db.crawl.insert_many([{'_id': f'http://{s}/{i}', 'url': f'http://{s}/{i}', 'site': s, 'html': b'\x00' * 100} for s in ['a.com', 'b.com'] for i in range(3)])
+    statements = []
+    db._conn.set_trace_callback(statements.append)
+    # * Prefix regexes use the (default) url index, html is removed before decoding when not asked for
+    docs = list(db.crawl.find({'url': re.compile(r'^http://a\.com/')}, {'site': True}))
+    assert(sorted(d['_id'] for d in docs) == [f'http://a.com/{i}' for i in range(3)])
+    assert("json_extract(doc, '$.url') >= " in statements[-1] and 'json_remove' in statements[-1])
+    plan = db._conn.execute("EXPLAIN QUERY PLAN SELECT doc FROM crawl WHERE json_extract(doc, '$.url') >= ?", ('a',)).fetchall()
+    assert('crawl_url' in str(plan))
+    assert(db.crawl.count_documents({'_id': {'$regex': '^http://b'}}) == 3)
+    assert(db.crawl.count_documents({'url': {'$regex': '^HTTP://B', '$options': 'i'}}) == 3)
+    assert(db.crawl.count_documents({'url': re.compile('^http://a|b.com')}) == 6)
+    # * Fields used by the query are kept
+    assert(db.crawl.find_one({'html': {'$exists': True}}, {'url': True})['url'])
+    assert(set(db.crawl.find_one({'site': 'b.com'}, {'html': False})) == {'_id', 'url', 'site'})
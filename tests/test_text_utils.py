@@ -0,0 +1,132 @@
+"""
+text_utils without network or db
+"""
+import copy
+import numpy as np
+
+from fable.utils import text_utils
+
+corpus = ["the cat sat on the mat", "dogs are running in the park", "stock market falls sharply today",
+          "new research on cats and dogs", "park opening hours extended"]
+
+def test_tfidf_workingset():
+    from sklearn.metrics.pairwise import cosine_similarity
+    tfidf = text_utils.TFidfStatic(corpus)
+    # * Terms all in corpus: same as corpus vectorizer
+    a, b = "cats sat in the park", "dogs running in the park today"
+    tfidf.add_corpus([a, b])
+    expected = cosine_similarity(tfidf.vectorizer.transform([a]), tfidf.vectorizer.transform([b]))[0, 0]
+    assert(abs(tfidf.similar(a, b) - expected) < 1e-9)
+    # * Unseen terms get idf from their df within workingset
+    ws = ["zebra cat", "zebra dog", "quokka cat"]
+    tfidf.add_corpus(ws)
+    idf = lambda df: np.log((len(corpus) + 1) / (df + 1)) + 1
+    cat = tfidf.idf[tfidf.vocab['cat']]
+    assert(abs(tfidf.similar(ws[0], ws[2]) - cat ** 2 / np.sqrt((idf(2) ** 2 + cat ** 2) * (idf(1) ** 2 + cat ** 2))) < 1e-9)
+    assert(tfidf.similar(ws[0], "") == 0 and tfidf.similar(ws[0], "the a") == 0)
+    assert(tfidf.topN("zebra zebra cat")[0] == 'zebra')
+    # * Forks have their own workingset, share vectorized texts
+    forked = copy.copy(tfidf)
+    forked._clear_workingset()
+    assert(len(forked.workingset) == 0 and len(tfidf.workingset) > 0)
+    assert(forked._vectorize(ws[0]) is tfidf._vectorize(ws[0]))
+
+def test_tfidf_model(tmp_path):
+    from fable import tools
+    from fable.utils import storage, tfidf_model
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    db.corpus.insert_many([{'_id': i, 'src': 'realweb', 'content': c} for i, c in enumerate(corpus)] + [{'_id': 99, 'src': 'other', 'content': 'zebra'}])
+    meta = tfidf_model.build(db, path=str(tmp_path / 'model'))
+    # * Same corpus gives the same model
+    assert(tfidf_model.build(db, path=str(tmp_path / 'model2'))['version'] == meta['version'])
+    assert(meta['corpus_docs'] == len(corpus))
+    similar = tools.Similar(use_db=False, model=str(tmp_path / 'model'))
+    fitted = text_utils.TFidfStatic(corpus)
+    assert(similar.tfidf.meta['version'] == meta['version'] and similar.tfidf.num_docs == len(corpus))
+    a, b = "cats sat in the zebra park", "dogs running in the park today"
+    assert(abs(similar.tfidf.similar(a, b) - fitted.similar(a, b)) < 1e-9)
+    assert(similar.tfidf.topN(a) == fitted.topN(a))
+    assert(tfidf_model.load(str(tmp_path / 'missing')) is None)
+
+def test_similar_batch():
+    from fable import tools
+    similar = tools.Similar(use_db=False, corpus=corpus)
+    tfidf = similar.tfidf
+    texts = ["cats sitting on mats zebra", "zebra running quickly in a park", "market zebra quokka", "quokka", ""]
+    tfidf.add_corpus(texts)
+    grid = tfidf.similar_matrix(texts, texts)
+    assert(np.abs(grid - np.array([[tfidf.similar(a, b) for b in texts] for a in texts])).max() < 1e-9)
+    # * Same rankings as pair by pair
+    old_sig = ('http://a.com/old', 'zebra park', ['cats on mats', 'market news'])
+    new_sigs = [('http://a.com/1', 'zebra running park', ['cats sat on mats', '']), ('http://a.com/2', 'quokka', ['stock market'])]
+    simis = similar.match_url_sig(old_sig, new_sigs)
+    assert(simis['anchor']['http://a.com/1'][2] == max(simis['anchor'][l][2] for l in simis['anchor']))
+    assert(abs(simis['sig']['http://a.com/1'][2] - tfidf.similar('cats on mats', 'cats sat on mats')) < 1e-9)
+    tokens = similar.token_similar('http://a.com/old', 'zebra park', {'http://a.com/1': ['park', 'zebra park'], 'http://a.com/2': ['quokka']}, shorttext=True)
+    assert(tokens[0][0] == 'http://a.com/1' and tokens[0][2] == 'zebra park' and tokens[1][1] == 0)
+
+def test_tokenize_cache():
+    from fable.utils import tokenizer, url_utils
+    tokens = text_utils.tokenize('Running_dogs and the cats')
+    assert(tokens == ['run', 'dog', 'cat'])
+    tokens.append('x') # * Callers get their own list
+    assert(text_utils.tokenize('Running_dogs and the cats') == ['run', 'dog', 'cat'])
+    assert(url_utils.tokenize("the dog's bone", stop_words=None, nonstop_words=["'"]) == ['the', 'dog', 'bone'])
+    assert(url_utils.tokenize('running-dogs', stop_words=[], stemming=False) == ['running', 'dogs'])
+    cache = tokenizer.LRUCache(2)
+    for k in 'abc':
+        cache.put(k, k)
+    assert(len(cache) == 2 and cache.get('a') is None and cache.get('c') == 'c')
+
+def test_minhash_near_duplicate():
+    import random
+    rng = random.Random(0)
+    words = [f'word{i}' for i in range(3000)]
+    base = [rng.choice(words) for _ in range(500)]
+    same = ' '.join(base)
+    close = ' '.join(w if rng.random() > 0.005 else rng.choice(words) for w in base)
+    far = ' '.join(w if rng.random() > 0.3 else rng.choice(words) for w in base)
+    for other in [same, close, far, '']:
+        for threshold in [0.9, 0.95]:
+            assert(text_utils.near_duplicate(same, other, threshold) == (text_utils.k_shingling(same, other) >= threshold))
+    sig = text_utils.minhash(close)
+    assert(text_utils.minhash_similarity(sig, text_utils.minhash(same)) > 0.8)
+    assert(text_utils.minhash_similarity(text_utils.minhash(''), text_utils.minhash('the')) == 1)
+    # * Stored signatures (bytes) are reused, invalid ones are not
+    text_utils.minhash_cache.clear()
+    assert(text_utils.remember_minhash(close, sig.tobytes()) and text_utils.minhash_cache.get(text_utils._minhash_key(close, 5, 128)) is not None)
+    assert(not text_utils.remember_minhash(close, b''))
+
+def test_extractor_version():
+    assert(text_utils.extractor_version('domdistiller') == f"domdistiller@{text_utils.EXTRACTOR_VERSIONS['domdistiller']}")
+    assert(text_utils.extractor_version(['boilerpipe', 'justext']).count('@') == 2)
+
+def test_near_duplicate_threshold_boundary():
+    # * MinHash only approximates k_shingling, decisions at the threshold fall back to exact k_shingling
+    words = [f'word{i}' for i in range(200)]
+    text1 = ' '.join(words)
+    text2 = ' '.join(words[:190] + [f'other{i}' for i in range(10)])
+    exact = text_utils.k_shingling(text1, text2)
+    assert(0.85 < exact < 0.95)
+    assert(text_utils.near_duplicate(text1, text2, exact))
+    assert(not text_utils.near_duplicate(text1, text2, exact + 1e-9))
+    for threshold in [exact - 0.05, exact + 0.05]:
+        assert(text_utils.near_duplicate(text1, text2, threshold) == (exact >= threshold))
+
+def test_content_near_duplicate_lazy(tmp_path):
+    from fable import tools
+    from fable.utils import storage
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    content = ' '.join(f'word{i}' for i in range(100))
+    db.crawl.insert_one({'_id': 'http://a.com/1', 'url': 'http://a.com/1', 'content': content})
+    crawl = db.crawl.find_one({'_id': 'http://a.com/1'})
+    assert('minhash' not in crawl)
+    # * Signature is computed and persisted (by _id) on first use
+    assert(tools.content_near_duplicate(content, crawl, 0.9, db=db))
+    stored = db.crawl.find_one({'_id': 'http://a.com/1'})['minhash']
+    assert(stored == text_utils.minhash(content).tobytes() and crawl['minhash'] == stored)
+    # * Then reused from the crawl
+    text_utils.minhash_cache.clear()
+    db.crawl.update_one({'_id': 'http://a.com/1'}, {'$unset': {'minhash': ''}})
+    assert(tools.content_near_duplicate(content, crawl, 0.9, db=db))
+    assert('minhash' not in db.crawl.find_one({'_id': 'http://a.com/1'}))
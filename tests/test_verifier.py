@@ -0,0 +1,48 @@
+"""
+Incremental verifier should give the same results as re-adding all candidates every time
+"""
+import pytest
+
+from fable import verifier
+
+urls = [f'http://www.example.com/news/story_{i}.html' for i in range(6)]
+title = lambda i: f'Story number {i} | Example News'
+candidates = []
+for i, url in enumerate(urls):
+    # * Reorganized under a new pattern, plus noisy search results
+    candidates.append([url, [title(i)], f'https://example.com/articles/{i}/story-number-{i}', {'method': 'wayback_alias', 'type': 'wayback_alias'}])
+    candidates.append([url, [title(i)], f'https://example.com/search?q=story{i}', {'method': 'search', 'type': 'fuzzy_search'}])
+    candidates.append([url, [title(i)], f'https://example.com/tags/story', {'method': 'search', 'type': 'fuzzy_search'}])
+neighbor_candidates = [
+    ['http://www.example.com/news/other_1.html', ['Other 1 | Example News'], 'https://example.com/articles/101/other-1', {'method': 'redirection', 'type': 'redirection'}],
+]
+
+def test_incremental_verify():
+    full_vr = verifier.Verifier(fuzzy=1)
+    inc_vr = verifier.Verifier(fuzzy=1)
+    inc_vr.add_candidates({'alias': [], 'examples': neighbor_candidates})
+    touched = []
+    for i, url in enumerate(urls):
+        touched.append(url)
+        new_cands = candidates[3*i: 3*i+3]
+        full_vr.add_aliasexample({'alias': candidates[:3*i+3], 'examples': neighbor_candidates}, clear=True)
+        inc_vr.add_candidates({'alias': new_cands, 'examples': []})
+        inc_vr.update_clusters()
+        for turl in touched:
+            assert(full_vr.verify_url(turl) == inc_vr.verify_url(turl))
+        assert(full_vr._g_clusters == inc_vr._g_clusters)
+
+def test_score_cache_touched_only():
+    vr = verifier.Verifier(fuzzy=1)
+    vr.add_candidates({'alias': candidates[:6], 'examples': neighbor_candidates})
+    vr.update_clusters()
+    scored = set(vr._score_cache)
+    # * Candidate under a new pattern only touches its own cluster
+    url = 'http://www.example.com/news/story_9.html'
+    vr.add_candidates({'alias': [[url, [title(9)], 'https://example.com/2020/01/02/archive/story-number-9', {'method': 'wayback_alias', 'type': 'wayback_alias'}]], 'examples': []})
+    vr.update_clusters()
+    assert(scored <= set(vr._score_cache))
+    vr.add_candidates({'alias': candidates[6:9], 'examples': []})
+    vr.update_clusters()
+    # * Scores of clusters gaining candidates are replaced
+    assert(set(vr._score_cache) == set(vr._cluster_keys.values()) and len(scored & set(vr._score_cache)) == 0)
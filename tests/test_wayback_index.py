@@ -0,0 +1,82 @@
+"""
+Memoizer.wayback_index policies, with snapshots already indexed in db
+"""
+import pytest
+from types import SimpleNamespace
+
+from fable import tools
+from fable.utils import storage
+
+@pytest.fixture
+def memo(tmp_path):
+    db = storage.SQLiteDB(str(tmp_path / 'fable.sqlite'))
+    return tools.Memoizer(db=db, cache=tools.CrawlCache())
+
+def test_latest_rep(memo, monkeypatch):
+    words = {'20200101000000': 10, '20200201000000': 30, '20200301000000': 20}
+    def requests_crawl(url, raw=False, **kwargs):
+        ts = url.split('/')[4]
+        return SimpleNamespace(status_code=200, text=f'{ts} ' + 'word ' * words[ts], url=url, headers={})
+    extracted = []
+    def extract_body(html, version='domdistiller', **kwargs):
+        extracted.append(html)
+        return ' '.join(html.split()[1:])
+    monkeypatch.setattr(tools.crawl, 'requests_crawl', requests_crawl)
+    monkeypatch.setattr(tools.text_utils, 'extract_body', extract_body)
+    url = 'http://a.com/page'
+    memo.db.wayback_index.insert_one({'_id': url, 'url': url, 'ts': list(words), 'ts_nb': list(words)})
+    wayback_url = memo.wayback_index(url)
+    assert('20200301000000' in wayback_url) # * Median by #words
+    rep = memo.db.wayback_rep.find_one({'url': url})
+    assert(rep['words'] == 20 and rep['content_digest'])
+    assert(len(extracted) == 3)
+    # * Another URL sharing snapshots (same html) reuses extractions
+    memo.db.wayback_rep.delete_one({'url': url})
+    memo.cache.clear()
+    assert(memo.wayback_index(url) == wayback_url and len(extracted) == 3)
+
+def test_policies(memo):
+    url = 'http://a.com/archived'
+    # * Docs store ts as (CDX) strings
+    tss = ['20100101000000', '20120615000000', '20150301120000', '20200101000000']
+    memo.db.wayback_index.insert_one({'_id': url, 'url': url, 'ts': tss, 'ts_nb': tss[:2] + ['20130101000000'] + tss[2:]})
+    wayback = lambda ts: f'http://web.archive.org/web/{ts}/{url}'
+    assert(memo.wayback_index(url, policy='earliest') == wayback(tss[0]))
+    assert(memo.wayback_index(url, policy='latest') == wayback(tss[-1]))
+    assert(memo.wayback_index(url, policy='closest', ts='20140101000000') == wayback('20150301120000'))
+    assert(memo.wayback_index(url, policy='closest', ts='2012') == wayback('20120615000000'))
+    assert(memo.wayback_index(url, policy='closest', ts='20300101000000') == wayback(tss[-1]))
+    assert(memo.wayback_index(url, policy='closest-later', ts='20120615000000') == wayback('20120615000000'))
+    assert(memo.wayback_index(url, policy='closest-later', ts='20210101000000') == wayback(tss[-1]))
+    assert(memo.wayback_index(url, policy='closest-earlier', ts='20140101000000') == wayback('20120615000000'))
+    assert(memo.wayback_index(url, policy='closest-earlier', ts='20000101000000') == wayback(tss[0]))
+    assert(memo.wayback_index(url, policy='closest-earlier', ts='20140101000000', all_none_400=True) == wayback('20130101000000'))
+    assert(memo.wayback_index(url, policy='all') == [(ts, wayback(ts)) for ts in tss])
+
+def test_index_stored_as_strings(memo, monkeypatch):
+    url = 'http://a.com/fetched'
+    cps = [['20150301120000', url, '200'], ['20100101000000', url, '301'], ['20120615000000', url, '200']]
+    monkeypatch.setattr(tools.crawl, 'wayback_index', lambda url, **kwargs: ([list(c) for c in cps], 'Success'))
+    assert(memo.wayback_index(url, policy='earliest') == f'http://web.archive.org/web/20120615000000/{url}')
+    doc = memo.db.wayback_index.find_one({'_id': url})
+    assert(doc['ts'] == ['20120615000000', '20150301120000'])
+    assert(doc['ts_nb'] == ['20100101000000', '20120615000000', '20150301120000'])
+
+def test_many_charged_to_technique(memo, monkeypatch):
+    from fable.budget import Budget
+    monkeypatch.setattr(tools.crawl, 'wayback_index', lambda url, **kwargs: ([['20150301120000', url, '200']], 'Success'))
+    memo.budget = Budget()
+    urls = [f'http://a.com/many{i}' for i in range(4)]
+    with memo.budget.track('wayback_index'):
+        url_cps = memo.wayback_index_many(urls)
+    assert(all(url_cps[url]['ts'] == ['20150301120000'] for url in urls))
+    techniques = memo.budget.report()['techniques']
+    assert(techniques['wayback_index']['cdx'] == 4 and 'other' not in techniques)
+
+def test_ts_array_contents_changed(memo):
+    url = 'http://a.com/reindexed'
+    cps = {'ts': ['20100101000000', '20120101000000']}
+    assert(list(memo._ts_array(url, cps, 'ts')) == [20100101000000, 20120101000000])
+    # * Same #snapshots, different contents
+    cps = {'ts': ['20100101000000', '20150101000000']}
+    assert(list(memo._ts_array(url, cps, 'ts')) == [20100101000000, 20150101000000])